@@ -0,0 +1,168 @@
+"""Admin reports, read only from the rollup tables.
+
+    python analytics.py [--clinic north | --db database.db] rebuild
+    python analytics.py [--clinic north | --db database.db] report [--days 30]
+
+rollup_appointments, rollup_approval_latency and rollup_triage_risk are
+kept current by triggers on appointments and consultations (database
+migration 5). A booking, status change or new triage result updates one
+or two rollup rows in the same transaction. The reports below therefore
+never touch the raw tables, and their cost depends on the number of days
+and doctors in the window, not the number of appointments. `rebuild`
+recomputes every rollup from scratch, e.g. after a bulk load done with
+triggers dropped.
+
+Admins are the usernames listed in ADMIN_USERS (comma-separated).
+"""
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+import database
+import tenants
+
+ADMIN_USERS = frozenset(u.strip() for u in os.environ.get("ADMIN_USERS", "").split(",") if u.strip())
+DEFAULT_DAYS = 30
+
+# Upper bounds in seconds of rollup_approval_latency.bucket 0..5 (bucket 6
+# is anything slower); must match database._latency_bucket
+LATENCY_BUCKETS = (900, 3600, 14400, 86400, 259200, 604800)
+
+GROUPS = {"doctor": "doctor_username", "specialization": "specialization", "day": "day"}
+
+
+def is_admin(username):
+    return username in ADMIN_USERS
+
+
+def window(since=None, until=None, days=DEFAULT_DAYS):
+    """(since, until) as ISO dates, defaulting to the last `days` days.
+    Raises ValueError for anything that isn't YYYY-MM-DD."""
+    until = date.fromisoformat(until) if until else date.today()
+    since = date.fromisoformat(since) if since else until - timedelta(days=days - 1)
+    return since.isoformat(), until.isoformat()
+
+
+# ---------------- REPORTS ----------------
+
+def appointment_counts(conn, group="specialization", since=None, until=None):
+    """Appointments per doctor, specialization or day, split by status."""
+    column = GROUPS[group]
+    since, until = window(since, until)
+    rows = conn.execute(f"""
+        SELECT {column} AS key, status, SUM(n) AS n
+        FROM rollup_appointments
+        WHERE day BETWEEN ? AND ?
+        GROUP BY {column}, status
+    """, (since, until)).fetchall()
+
+    report = {}
+    for row in rows:
+        entry = report.setdefault(row["key"], {"key": row["key"], "total": 0})
+        entry[row["status"]] = row["n"]
+        entry["total"] += row["n"]
+    entries = [e for e in report.values() if e["total"]]
+    if group == "day":
+        return sorted(entries, key=lambda e: e["key"])
+    return sorted(entries, key=lambda e: (-e["total"], e["key"]))
+
+
+def _bucket_percentile(buckets, count, q):
+    # Upper bound of the bucket holding the q-th decision; None past the last bound
+    seen = 0
+    for bucket in range(len(LATENCY_BUCKETS) + 1):
+        seen += buckets.get(bucket, 0)
+        if seen >= q * count:
+            return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else None
+    return None
+
+
+def approval_latency(conn, group="specialization", since=None, until=None):
+    """Time from booking to the doctor's first decision, by decision day.
+
+    p50/p90 are histogram bucket upper bounds in hours (None means slower
+    than a week).
+    """
+    column = GROUPS[group]
+    since, until = window(since, until)
+    rows = conn.execute(f"""
+        SELECT {column} AS key, outcome, bucket, SUM(n) AS n, SUM(total_seconds) AS seconds
+        FROM rollup_approval_latency
+        WHERE day BETWEEN ? AND ?
+        GROUP BY {column}, outcome, bucket
+    """, (since, until)).fetchall()
+
+    groups = {}
+    for row in rows:
+        entry = groups.setdefault(row["key"], {"key": row["key"], "decisions": 0, "seconds": 0.0, "buckets": {}})
+        entry["decisions"] += row["n"]
+        entry["seconds"] += row["seconds"]
+        entry[row["outcome"]] = entry.get(row["outcome"], 0) + row["n"]
+        entry["buckets"][row["bucket"]] = entry["buckets"].get(row["bucket"], 0) + row["n"]
+
+    report = []
+    for entry in groups.values():
+        buckets, count = entry.pop("buckets"), entry["decisions"]
+        if not count:
+            continue
+        p50, p90 = (_bucket_percentile(buckets, count, q) for q in (0.5, 0.9))
+        entry["mean_hours"] = round(entry.pop("seconds") / count / 3600, 2)
+        entry["p50_hours"] = p50 / 3600 if p50 else None
+        entry["p90_hours"] = p90 / 3600 if p90 else None
+        report.append(entry)
+    if group == "day":
+        return sorted(report, key=lambda e: e["key"])
+    return sorted(report, key=lambda e: (-e["decisions"], e["key"]))
+
+
+def risk_distribution(conn, since=None, until=None):
+    """Triage risk levels of consultations in the window, with shares."""
+    since, until = window(since, until)
+    rows = conn.execute("""
+        SELECT risk, SUM(n) AS n
+        FROM rollup_triage_risk
+        WHERE day BETWEEN ? AND ?
+        GROUP BY risk
+    """, (since, until)).fetchall()
+    total = sum(row["n"] for row in rows)
+    return [
+        {"risk": row["risk"], "n": row["n"], "share": round(row["n"] / total, 4)}
+        for row in sorted(rows, key=lambda r: -r["n"]) if row["n"]
+    ]
+
+
+def rebuild(conn):
+    """Recompute every rollup from the base tables in one transaction."""
+    with conn:
+        for sql in database.ROLLUP_BACKFILL:
+            conn.execute(sql)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytics rollup tools")
+    tenants.add_arguments(parser)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild")
+    report = sub.add_parser("report")
+    report.add_argument("--days", type=int, default=DEFAULT_DAYS)
+    args = parser.parse_args()
+
+    conn = database.connect(tenants.cli_path(parser, args))
+    if args.command == "rebuild":
+        rebuild(conn)
+        print("Rollups rebuilt.")
+    else:
+        since, until = window(days=args.days)
+        print(f"{since} .. {until}")
+        for entry in appointment_counts(conn, "specialization", since, until):
+            print(f"  {entry['key']:<20} {entry['total']:>8}")
+        for entry in approval_latency(conn, "specialization", since, until):
+            print(f"  {entry['key']:<20} {entry['decisions']:>8} decisions, mean {entry['mean_hours']}h")
+        for entry in risk_distribution(conn, since, until):
+            print(f"  {entry['risk']:<20} {entry['n']:>8} ({entry['share']:.1%})")
+    conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
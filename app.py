@@ -1,19 +1,57 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response
 import sqlite3
-from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
-from ml_engine import chatbot_reply,summarize_consultation,analyze_symptoms
+from datetime import datetime, timedelta
+from ml_engine import chatbot_reply,summarize_consultation,analyze_symptoms,flows,recommend_specializations,intake_summary
+import ml_engine
+import analytics
+import assets
+import audit
+import consultations
+import database
+import directory
+import jobs
+import messaging
+import profiling
+import scheduling
+import search
+import security
+import session_store
+import tasks
+import tenants
 
 app = Flask(__name__)
 app.secret_key = "telemedicine_2026_secret"
 
+# Cookie carries only a session id; data and chat history live server-side.
+session_store.init_app(app)
+
+# Stage timings, SQL counts and /metrics when PROFILING=1; wraps the session
+# interface, so it goes after session_store
+profiling.init_app(app)
+analyze_symptoms = profiling.traced("analyze")(analyze_symptoms)
+recommend_specializations = profiling.traced("recommend")(recommend_specializations)
+
+# Hashed, precompressed static files from `python assets.py build`
+assets.init_app(app)
+
+# Memory-map the TF-IDF model now (building it if missing) rather than in
+# the first chatbot request; `python ml_engine.py build-recommender` rebuilds it
+ml_engine.load_recommender()
+
 
 # ---------------- DATABASE ----------------
 
+# Per-clinic database files when a clinics file exists; sets g.db_path,
+# which get_db() routes by. Only those files are created/migrated, so a
+# split's retired database.db isn't recreated empty.
+database.init_app(app, tenants.paths())
+tenants.init_app(app)
+
+
 def get_db_connection():
-    conn = sqlite3.connect("database.db")
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pooled, request-scoped connection; returned to the pool on teardown.
+    return profiling.wrap(database.get_db())
 
 
 # ---------------- LOGIN REQUIRED DECORATOR ----------------
@@ -35,6 +73,21 @@ def login_required(role=None):
     return wrapper
 
 
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not analytics.is_admin(session.get('username')):
+            flash("Unauthorized access", "danger")
+            return redirect(url_for('login'))
+        return f(*args, **kwargs)
+    return decorated
+
+
+@app.errorhandler(security.HasherBusy)
+def hasher_busy(e):
+    return "The server is busy. Please try again in a moment.", 503, {"Retry-After": "2"}
+
+
 # ---------------- INDEX ----------------
 
 @app.route('/')
@@ -50,14 +103,35 @@ def login():
         username = request.form.get('uname')
         password = request.form.get('psw')
 
+        if security.RATE_LIMITS_ENABLED and (not security.ip_limiter.hit(request.remote_addr)
+                                             or not security.user_limiter.available(username)):
+            audit.log_action(username, "Login throttled", ip=request.remote_addr)
+            flash("Too many login attempts. Please wait and try again.", "danger")
+            return render_template("login.html"), 429
+
         db = get_db_connection()
         user = db.execute(
             "SELECT * FROM users WHERE username=?",
             (username,)
         ).fetchone()
-        db.close()
 
-        if user and check_password_hash(user['password'], password):
+        try:
+            valid = security.check_login(password, user['password'] if user else None)
+        except security.HasherBusy:
+            flash("The server is busy. Please try again in a moment.", "danger")
+            return render_template("login.html"), 503
+
+        if valid:
+
+            # upgrade the stored hash if the configured method has changed;
+            # if the pool is busy it simply happens on a later login
+            if security.needs_rehash(user['password']):
+                try:
+                    db.execute("UPDATE users SET password=? WHERE id=?",
+                               (security.hash_password_pooled(password), user['id']))
+                    db.commit()
+                except security.HasherBusy:
+                    pass
 
             # clear old session
             session.clear()
@@ -67,7 +141,9 @@ def login():
             session['username'] = user['username']
             session['role'] = user['role']
             session['fullname'] = user['fullname']
+            session['clinic'] = tenants.current()
 
+            audit.log_action(user['username'], "Logged in")
             flash("Login successful!", "success")
 
             # role based redirect
@@ -76,6 +152,8 @@ def login():
             else:
                 return redirect(url_for('patient_dashboard'))
 
+        security.user_limiter.hit(username)
+        audit.log_action(username, "Login failed", ip=request.remote_addr)
         flash("Invalid username or password", "danger")
 
     return render_template("login.html")
@@ -89,7 +167,7 @@ def register_patient():
         fullname = request.form['fullname']
         email = request.form['email']
         username = request.form['uname']
-        password = generate_password_hash(request.form['psw'])
+        password = security.hash_password_pooled(request.form['psw'])
 
         try:
             db = get_db_connection()
@@ -98,8 +176,8 @@ def register_patient():
                 VALUES (?, ?, ?, ?, ?)
             """, (fullname, email, username, password, 'patient'))
             db.commit()
-            db.close()
 
+            audit.log_action(username, "Registered", role="patient")
             flash("Patient registered successfully. Please login.", "success")
             return redirect(url_for('login'))
 
@@ -117,7 +195,7 @@ def register_doctor():
         fullname = request.form['fullname']
         email = request.form['email']
         username = request.form['uname']
-        password = generate_password_hash(request.form['psw'])
+        password = security.hash_password_pooled(request.form['psw'])
         specialization = request.form['specialization']
         license_id = request.form['license_id']
 
@@ -128,8 +206,9 @@ def register_doctor():
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             """, (fullname, email, username, password, 'doctor', specialization, license_id))
             db.commit()
-            db.close()
 
+            directory.invalidate(db)
+            audit.log_action(username, "Registered", role="doctor")
             flash("Doctor registered successfully. Please login.", "success")
             return redirect(url_for('login'))
 
@@ -141,33 +220,90 @@ def register_doctor():
 
 # ---------------- DOCTOR DASHBOARD ----------------
 
+DASHBOARD_PAGE_SIZE = 25
+
+
+def parse_cursor(token):
+    # Keyset cursor "<appointment_date>|<id>" as produced by make_cursor().
+    if not token or "|" not in token:
+        return None
+    date, _, id_ = token.rpartition("|")
+    try:
+        return date, int(id_)
+    except ValueError:
+        return None
+
+
+def make_cursor(row):
+    return f"{row['appointment_date']}|{row['id']}"
+
+
 @app.route('/doctor_dashboard')
 @login_required('doctor')
 def doctor_dashboard():
 
     doctor = session['username']
+    limit = DASHBOARD_PAGE_SIZE + 1  # one extra row tells us if there is a next page
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT * FROM appointments 
-        WHERE doctor_username=? AND status='Pending'
-    """, (doctor,))
-    pending = cursor.fetchall()
+    # Pending is a work queue (oldest first), approved is history (newest
+    # first); each side pages independently with its own keyset cursor.
+    pending_after = parse_cursor(request.args.get('pending_after')) or ('', 0)
+    approved_before = parse_cursor(request.args.get('approved_before')) or ('9999-12-31', 2 ** 63 - 1)
 
-    cursor.execute("""
-        SELECT * FROM appointments 
-        WHERE doctor_username=? AND status='Approved'
-    """, (doctor,))
-    approved = cursor.fetchall()
+    conn = get_db_connection()
+    rows = conn.execute("""
+        SELECT * FROM (
+            SELECT 'row' AS kind, status, id, patient_username, appointment_date, NULL AS n
+            FROM appointments
+            WHERE doctor_username=? AND status='Pending'
+              AND (appointment_date, id) > (?, ?)
+            ORDER BY appointment_date, id
+            LIMIT ?
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'row', status, id, patient_username, appointment_date, NULL
+            FROM appointments
+            WHERE doctor_username=? AND status='Approved'
+              AND (appointment_date, id) < (?, ?)
+            ORDER BY appointment_date DESC, id DESC
+            LIMIT ?
+        )
+        UNION ALL
+        SELECT 'count', status, NULL, NULL, NULL, COUNT(*)
+        FROM appointments
+        WHERE doctor_username=?
+        GROUP BY status
+    """, (
+        doctor, pending_after[0], pending_after[1], limit,
+        doctor, approved_before[0], approved_before[1], limit,
+        doctor,
+    )).fetchall()
+
+    pending, approved, counts = [], [], {}
+    for row in rows:
+        if row['kind'] == 'count':
+            counts[row['status']] = row['n']
+        elif row['status'] == 'Pending':
+            pending.append(row)
+        else:
+            approved.append(row)
 
-    conn.close()
+    next_pending = next_approved = None
+    if len(pending) > DASHBOARD_PAGE_SIZE:
+        pending = pending[:DASHBOARD_PAGE_SIZE]
+        next_pending = make_cursor(pending[-1])
+    if len(approved) > DASHBOARD_PAGE_SIZE:
+        approved = approved[:DASHBOARD_PAGE_SIZE]
+        next_approved = make_cursor(approved[-1])
 
     return render_template(
         "doctor_dashboard.html",
         pending=pending,
-        approved=approved
+        approved=approved,
+        counts=counts,
+        next_pending=next_pending,
+        next_approved=next_approved
     )
 
 
@@ -193,8 +329,6 @@ def patient_dashboard():
     """, (username,))
     appointments = cursor.fetchall()
 
-    conn.close()
-
     return render_template(
         "patient_dashboard.html",
         profile=profile,
@@ -209,30 +343,23 @@ def patient_dashboard():
 def booking():
 
     conn = get_db_connection()
-    cursor = conn.cursor()
 
-    cursor.execute("SELECT DISTINCT specialization FROM users WHERE role='doctor'")
-    specializations = [row[0] for row in cursor.fetchall()]
+    specializations = directory.specializations(conn)
 
     doctors = []
+    slots = []
     specialization = None
 
     if request.method == 'POST':
         specialization = request.form['specialization']
-
-        cursor.execute("""
-            SELECT username, fullname, specialization 
-            FROM users 
-            WHERE role='doctor' AND specialization=?
-        """, (specialization,))
-        doctors = cursor.fetchall()
-
-    conn.close()
+        doctors = directory.doctors(conn, specialization)
+        slots = scheduling.next_free_slots(conn, doctors, 8)
 
     return render_template(
         "booking.html",
         specializations=specializations,
         doctors=doctors,
+        slots=slots,
         specialization=specialization
     )
 
@@ -244,61 +371,247 @@ def booking():
 def finalize(doctor_username, specialization):
 
     conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Get doctor details
-    cursor.execute("SELECT fullname FROM users WHERE username=?", (doctor_username,))
-    doctor = cursor.fetchone()
 
-    # Get doctor's fee and UPI if set
-    cursor.execute("SELECT fee_amount, upi_id FROM doctor_fees WHERE doctor_username=?", (doctor_username,))
-    fee_data = cursor.fetchone()
+    # Doctor details, fee and UPI (cached directory entry)
+    doctor = directory.doctor(conn, doctor_username)
+    if doctor is None:
+        flash("Doctor not found", "danger")
+        return redirect(url_for('booking'))
 
-    fee_amount = fee_data[0] if fee_data else "Not set"
-    upi_id = fee_data[1] if fee_data else "Not set"
+    fee_amount = doctor['fee_amount'] if doctor['fee_amount'] is not None else "Not set"
+    upi_id = doctor['upi_id'] if doctor['upi_id'] is not None else "Not set"
+    status = 200
 
     if request.method == 'POST':
         medical_info = request.form['medical_info']
-        appointment_time = request.form['appointment_time']
+        slot = request.form.get('slot', '')
         patient_username = session['username']
 
-        cursor.execute("""
-            INSERT INTO appointments 
-            (patient_username, doctor_username, specialization, medical_info, appointment_date, status)
-            VALUES (?, ?, ?, ?, ?, 'Pending')
-        """, (patient_username, doctor_username, specialization, medical_info, appointment_time))
-
-        conn.commit()
-        conn.close()
-
-        flash("Appointment booked successfully!", "success")
-        return redirect(url_for('patient_dashboard'))
-
-    conn.close()
+        try:
+            appointment_id = scheduling.reserve(conn, patient_username, doctor, specialization, slot, medical_info)
+        except scheduling.InvalidSlot as e:
+            flash(str(e), "danger")
+            status = 400
+        except scheduling.SlotTaken as e:
+            flash(str(e), "danger")
+            status = 409
+        else:
+            # The booking is committed; a busy or broken jobs file only
+            # costs the reminder, not a 500 for a slot the patient now holds
+            try:
+                tasks.schedule_reminder(appointment_id, slot.replace("T", " "))
+            except Exception:
+                app.logger.exception("Could not queue the reminder for appointment %s", appointment_id)
+            audit.log_action(patient_username, "Booked appointment", patient=patient_username,
+                             doctor=doctor_username, slot=slot)
+            flash("Appointment booked successfully!", "success")
+            return redirect(url_for('patient_dashboard'))
+
+    # Free slots after ?after=<slot> when paging forward, else from now
+    try:
+        start = max(datetime.strptime(request.args['after'], scheduling.SLOT_FORMAT) + timedelta(minutes=1),
+                    datetime.now())
+    except (KeyError, ValueError):
+        start = None
+    slots = scheduling.next_free_slots(conn, [doctor], 12, start)
 
     return render_template(
         "finalize.html",
         doctor=doctor,
         specialization=specialization,
         fee_amount=fee_amount,
-        upi_id=upi_id
-    )
+        upi_id=upi_id,
+        slots=slots,
+        selected=request.values.get('slot')
+    ), status
 
 # ---------------- UPDATE APPOINTMENT STATUS (DOCTOR) ----------------
 
+APPOINTMENT_STATUSES = ('Approved', 'Rejected')
+
+
+def update_appointment_statuses(conn, doctor, ids, status):
+    # One transaction for the whole batch; the doctor_username filter makes
+    # ids belonging to other doctors silent no-ops. Returns rows changed.
+    with conn:
+        cursor = conn.executemany("""
+            UPDATE appointments SET status=?
+            WHERE id=? AND doctor_username=?
+        """, [(status, appointment_id, doctor) for appointment_id in ids])
+    audit.log_action(doctor, f"{status} appointments", appointment_ids=list(ids))
+    if cursor.rowcount:
+        # The status change is committed; a busy or broken jobs file only
+        # costs the notification, not a 500
+        try:
+            jobs.enqueue(tasks.notify_appointment_status,
+                         {"doctor": doctor, "ids": list(ids), "status": status, "clinic": tenants.current()})
+        except Exception:
+            app.logger.exception("Could not queue status notifications for appointments %s", list(ids))
+    return cursor.rowcount
+
+
 @app.route('/appointment_status/<int:id>/<status>')
 @login_required('doctor')
 def appointment_status(id, status):
 
+    if status in APPOINTMENT_STATUSES:
+        update_appointment_statuses(get_db_connection(), session['username'], [id], status)
+
+    return redirect(url_for('doctor_dashboard'))
+
+
+@app.route('/appointment_status/bulk', methods=['POST'])
+@login_required('doctor')
+def appointment_status_bulk():
+
+    status = request.form.get('status')
+    try:
+        ids = sorted({int(i) for i in request.form.getlist('ids')})
+    except ValueError:
+        ids = []
+
+    if status not in APPOINTMENT_STATUSES or not ids:
+        flash("Select at least one appointment", "danger")
+        return redirect(url_for('doctor_dashboard'))
+
+    updated = update_appointment_statuses(get_db_connection(), session['username'], ids, status)
+
+    if updated < len(ids):
+        flash(f"{status} {updated} of {len(ids)} appointments; the rest are not yours", "danger")
+    else:
+        flash(f"{status} {updated} appointments", "success")
+
+    return redirect(url_for('doctor_dashboard', **request.args))
+
+
+
+# ---------------- DOCTOR AVAILABILITY ----------------
+
+def parse_hhmm(value):
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+@app.route('/doctor/availability', methods=['GET', 'POST'])
+@login_required('doctor')
+def doctor_availability():
+
     conn = get_db_connection()
-    cursor = conn.cursor()
+    doctor = session['username']
 
-    cursor.execute("UPDATE appointments SET status=? WHERE id=?", (status, id))
+    if request.method == 'POST':
+        try:
+            slot_minutes = int(request.form['slot_minutes'])
+            windows = [
+                (day, parse_hhmm(request.form[f'start{day}']), parse_hhmm(request.form[f'end{day}']), slot_minutes)
+                for day in range(7) if request.form.get(f'day{day}')
+            ]
+        except (KeyError, ValueError):
+            flash("Please enter a start and end time for every selected day", "danger")
+            windows = None
+
+        if windows is not None:
+            try:
+                scheduling.set_availability(conn, doctor, windows)
+            except ValueError as e:
+                flash(str(e), "danger")
+            else:
+                audit.log_action(doctor, "Updated availability", windows=len(windows))
+                flash("Availability saved", "success")
+                return redirect(url_for('doctor_availability'))
 
-    conn.commit()
-    conn.close()
+    windows = {w[0]: w for w in reversed(scheduling.availability(conn, doctor))}
+    slot_minutes = next(iter(windows.values()))[3] if windows else 30
 
-    return redirect(url_for('doctor_dashboard'))
+    return render_template(
+        "doctor_availability.html",
+        weekdays=scheduling.WEEKDAYS,
+        windows=windows,
+        slot_minutes=slot_minutes
+    )
+
+# ---------------- CASE SEARCH (DOCTOR) ----------------
+
+@app.route('/doctor/search')
+@login_required('doctor')
+def case_search():
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+
+    results, has_more = search.search(get_db_connection(), session['username'], query, page)
+
+    return render_template(
+        "doctor_search.html",
+        query=query,
+        page=page,
+        results=results,
+        has_more=has_more
+    )
+
+
+
+# ---------------- ADMIN ANALYTICS ----------------
+# Reads only the rollup tables; see analytics.py
+
+@app.route('/admin/analytics')
+@admin_required
+def admin_analytics():
+    conn = get_db_connection()
+    days = max(1, min(request.args.get('days', analytics.DEFAULT_DAYS, type=int), 366))
+    since, until = analytics.window(days=days)
+
+    return render_template(
+        "admin_analytics.html",
+        days=days,
+        since=since,
+        until=until,
+        by_specialization=analytics.appointment_counts(conn, "specialization", since, until),
+        by_doctor=analytics.appointment_counts(conn, "doctor", since, until)[:20],
+        by_day=analytics.appointment_counts(conn, "day", since, until),
+        latency=analytics.approval_latency(conn, "specialization", since, until),
+        risks=analytics.risk_distribution(conn, since, until)
+    )
+
+
+@app.route('/admin/analytics/<report>')
+@admin_required
+def admin_analytics_report(report):
+    conn = get_db_connection()
+    group = request.args.get('group', 'specialization')
+    if group not in analytics.GROUPS:
+        return jsonify(error=f"group must be one of {', '.join(analytics.GROUPS)}"), 400
+    try:
+        since, until = analytics.window(request.args.get('since'), request.args.get('until'))
+    except ValueError:
+        return jsonify(error="since and until must be YYYY-MM-DD"), 400
+
+    if report == 'appointments':
+        data = analytics.appointment_counts(conn, group, since, until)
+    elif report == 'latency':
+        data = analytics.approval_latency(conn, group, since, until)
+    elif report == 'risk':
+        data = analytics.risk_distribution(conn, since, until)
+    else:
+        return jsonify(error="unknown report"), 404
+
+    return jsonify(since=since, until=until, report=report, data=data)
+
+
+# ---------------- DIRECTORY (ALL CLINICS) ----------------
+
+@app.route("/directory/specializations")
+@login_required()
+def directory_specializations():
+    # Looked up in every clinic's database in parallel
+    return jsonify([{"specialization": name, "clinics": clinics}
+                    for name, clinics in tenants.specializations()])
+
+
+@app.route("/directory/doctors/<specialization>")
+@login_required()
+def directory_doctors(specialization):
+    return jsonify([{key: doctor[key] for key in ("username", "fullname", "specialization", "fee_amount", "clinic")}
+                    for doctor in tenants.doctors(specialization)])
 
 
 # ---------------- LOGOUT ----------------
@@ -318,12 +631,7 @@ def book_appointment():
     cursor = conn.cursor()
 
     # 🔹 Get all available specializations
-    cursor.execute("""
-        SELECT DISTINCT specialization 
-        FROM users 
-        WHERE role='doctor' AND specialization IS NOT NULL
-    """)
-    specializations = [row["specialization"] for row in cursor.fetchall()]
+    specializations = directory.specializations(conn)
 
     # 🔹 Get patient's current appointments with status
     cursor.execute("""
@@ -335,7 +643,6 @@ def book_appointment():
     """, (patient,))
 
     bookings = cursor.fetchall()
-    conn.close()
 
     return render_template(
         "patient_booking.html",
@@ -349,13 +656,9 @@ def confirm():
     if chat_state.get("stage") != "done":
         return redirect("/chatbot")  # chatbot incomplete
 
-    symptoms = (
-        f"Symptom: {chat_state.get('symptom','')}\n"
-        f"Location: {chat_state.get('location','')}\n"
-        f"Severity: {chat_state.get('severity','')}/10\n"
-        f"Duration: {chat_state.get('duration','')}\n"
-        f"Additional info: {chat_state.get('additional','')}"
-    )
+    # Every answer the flow collected, including flow-specific ones such as
+    # the child's age and the urgency flag
+    symptoms = intake_summary(chat_state)
     session["symptoms"] = symptoms
 
     if request.method == "POST":
@@ -372,49 +675,46 @@ def chatbot():
     # Initialize session if missing
     if "chat_state" not in session:
         session["chat_state"] = {}
-    if "chat_log" not in session:
-        session["chat_log"] = []
 
     chat_state = session["chat_state"]
-    chat_log = session["chat_log"]
 
     # --- Handle Clear Chat button ---
     if request.method == "POST" and "clear_chat" in request.form:
-        # Reset session
-        session["chat_state"] = {}
-        session["chat_log"] = []
-
-        chat_state = session["chat_state"]
-        chat_log = session["chat_log"]
+        # Reset session, staying on the same intake flow
+        session_store.clear_chat()
+        chat_state = {"flow": chat_state.get("flow", "general")}
 
         # Start fresh conversation
         chat_state["stage"] = "start"
         initial_msg = chatbot_reply("", chat_state)
-        chat_log.append(("AI", initial_msg))
+        session_store.append_chat("AI", initial_msg)
 
         session["chat_state"] = chat_state
-        session["chat_log"] = chat_log
 
-        return render_template("chatbot.html", chat=chat_log, state=chat_state)
+        return render_template("chatbot.html", chat=session_store.chat_history(), state=chat_state)
 
     # --- Handle user message ---
     if request.method == "POST" and "message" in request.form:
         user_msg = request.form["message"]
         if user_msg.strip():  # only add if not empty
-            chat_log.append(("Patient", user_msg))
+            session_store.append_chat("Patient", user_msg)
             reply = chatbot_reply(user_msg, chat_state)
-            chat_log.append(("AI", reply))
+            session_store.append_chat("AI", reply)
 
             session["chat_state"] = chat_state
-            session["chat_log"] = chat_log
+
+    chat_log = session_store.chat_history()
 
     # --- GET request or first load ---
     if request.method == "GET" and not chat_log:
+        # e.g. /chatbot?flow=cardiology
+        if request.args.get("flow") in flows.flows:
+            chat_state["flow"] = request.args["flow"]
         chat_state["stage"] = "start"
         initial_msg = chatbot_reply("", chat_state)
+        session_store.append_chat("AI", initial_msg)
         chat_log.append(("AI", initial_msg))
         session["chat_state"] = chat_state
-        session["chat_log"] = chat_log
 
     return render_template("chatbot.html", chat=chat_log, state=chat_state)
 
@@ -435,6 +735,8 @@ def consult_manual():
         # Generate AI summary (or call analyze_symptoms)
         if "ai_consent" in request.form:
             session["ai"] = analyze_symptoms(combined)
+            audit.log_action(session.get("username"), "Consulted with symptoms", patient=session.get("username"),
+                             risk=session["ai"]["risk"])
         else:
             session["ai"] = {
                 "risk": "N/A",
@@ -456,15 +758,99 @@ def chatbotsummary():
 
     ai_summary = session["ai"]
 
+    # Persisted in the background; reloading this page doesn't add a row,
+    # and opening it without a consultation doesn't record an empty one
+    if symptoms.strip():
+        consultations.record(session["username"], symptoms,
+                             None if ai_summary.get("risk") == "N/A" else ai_summary)
+
     # Generate readable summary
     summary_text = summarize_consultation(symptoms)
 
+    # Specializations we actually offer that match the intake answers, each
+    # with the doctors who have the earliest free slots
+    conn = get_db_connection()
+    offered = set(directory.specializations(conn))
+    matches = [m for m in recommend_specializations(session.get("chat_state", {}), k=len(offered))
+               if m["specialization"] in offered][:3]
+    for match in matches:
+        doctors = directory.doctors(conn, match["specialization"])
+        earliest = {}
+        for slot in scheduling.next_free_slots(conn, doctors, 20):
+            earliest.setdefault(slot["doctor_username"], slot)
+        match["slots"] = list(earliest.values())[:3]
+
     return render_template(
         "chatbot_summary.html",
         ai=ai_summary,
-        summary=summary_text
+        summary=summary_text,
+        matches=matches
     )
 
+# ---------------- MESSAGING ----------------
+
+@app.route("/chat/<username>")
+@login_required()
+def chat(username):
+    user = session["username"]
+    conn = get_db_connection()
+
+    if not messaging.can_message(conn, user, username):
+        flash("You can only message your doctors or patients", "danger")
+        return redirect(url_for("doctor_dashboard" if session["role"] == "doctor" else "patient_dashboard"))
+
+    messages = list(reversed(messaging.history(conn, user, username)))
+
+    return render_template("chat.html", other=username, messages=messages)
+
+
+@app.route("/send_message", methods=["POST"])
+@login_required()
+def send_message():
+    data = request.get_json(silent=True) or request.form
+    receiver = data.get("receiver", "")
+    text = data.get("message", "").strip()
+    sender = session["username"]
+    conn = get_db_connection()
+
+    if not text or not messaging.can_message(conn, sender, receiver):
+        if request.is_json:
+            return jsonify(error="cannot send this message"), 400
+        flash("Message could not be sent", "danger")
+        return redirect(url_for("chat", username=receiver))
+
+    message = messaging.save_message(conn, sender, receiver, text)
+    messaging.hub_for(tenants.current_path()).publish(message, local=True)
+
+    if request.is_json:
+        return jsonify(message), 201
+    return redirect(url_for("chat", username=receiver))
+
+
+@app.route("/messages/<username>")
+@login_required()
+def message_history(username):
+    before_id = request.args.get("before_id", type=int)
+    return jsonify(messaging.history(get_db_connection(), session["username"], username, before_id))
+
+
+@app.route("/messages/stream")
+@login_required()
+def message_stream():
+    user = session["username"]
+
+    # Subscribe before reading the backlog so nothing falls in between
+    sub = messaging.hub_for(tenants.current_path()).subscribe(user)
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    backlog = messaging.missed_since(get_db_connection(), user, last_id) if last_id is not None else []
+
+    return Response(
+        messaging.event_stream(sub, backlog),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.route("/doctor/set_fee", methods=["GET", "POST"])
 @login_required('doctor')
 def set_fee():
@@ -494,7 +880,7 @@ def set_fee():
             """, (doctor_username, fee_amount, upi_id))
 
         conn.commit()
-        conn.close()
+        directory.invalidate(conn)
 
         flash("Consultation fee updated successfully!", "success")
         return redirect("/doctor_dashboard")
@@ -502,7 +888,6 @@ def set_fee():
     # GET request — fetch current fee to pre-fill form
     cursor.execute("SELECT fee_amount, upi_id FROM doctor_fees WHERE doctor_username=?", (doctor_username,))
     fee_data = cursor.fetchone()
-    conn.close()
 
     fee_amount = fee_data[0] if fee_data else ""
     upi_id = fee_data[1] if fee_data else ""
@@ -0,0 +1,266 @@
+"""Fingerprinted, precompressed static assets.
+
+    python assets.py build
+
+Scans templates/ for the static files they actually reference, minifies
+CSS/JS, and writes content-hashed copies plus .gz (and .br when the
+optional `brotli` package is installed) variants under static/dist/,
+with a manifest.json mapping original names to hashed ones. The unused
+static/plugins tree is never shipped.
+
+A page that needs several stylesheets or scripts lists them in one
+{{ asset_bundle('a.css', 'b.css') }}; the build concatenates each such
+list into a single hashed file (manifest key "a.css+b.css"), so the page
+makes one request per kind. Without a build it emits one tag per file.
+
+At runtime init_app() rewrites url_for('static', filename=...) to the
+hashed name when the manifest has one, and serves static/dist/ with
+far-future immutable caching and the best precompressed variant the
+client accepts. Without a build, everything falls back to plain static.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import sys
+
+from flask import current_app, request, send_from_directory, url_for
+from markupsafe import Markup, escape
+
+try:
+    import brotli
+except ImportError:  # optional; gzip alone is still a big win
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT, "static")
+TEMPLATES_DIR = os.path.join(ROOT, "templates")
+DIST = "dist"
+DIST_DIR = os.path.join(STATIC_DIR, DIST)
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+
+ONE_YEAR = 365 * 24 * 3600
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt")
+
+_STATIC_REF = re.compile(r"""url_for\(\s*['"]static['"]\s*,\s*filename\s*=\s*['"]([^'"]+)['"]""")
+_ASSET_REF = re.compile(r"""asset_url\(\s*['"]([^'"]+)['"]""")
+_BUNDLE_REF = re.compile(r"""asset_bundle\(([^)]*)\)""")
+_QUOTED = re.compile(r"""['"]([^'"]+)['"]""")
+_CSS_URL = re.compile(r"""url\(\s*['"]?([^'")]+)['"]?\s*\)""")
+
+
+# ---------------- BUILD ----------------
+
+def _template_texts(templates_dir):
+    for name in sorted(os.listdir(templates_dir)):
+        if name.endswith(".html"):
+            with open(os.path.join(templates_dir, name), encoding="utf-8") as f:
+                yield f.read()
+
+
+def referenced_bundles(templates_dir=TEMPLATES_DIR):
+    """The file lists of every asset_bundle(...) call in the templates."""
+    found = set()
+    for text in _template_texts(templates_dir):
+        for args in _BUNDLE_REF.findall(text):
+            found.add(tuple(_QUOTED.findall(args)))
+    return sorted(files for files in found if files)
+
+
+def referenced_assets(templates_dir=TEMPLATES_DIR):
+    """Static filenames used by any template, plus files those CSS files pull in."""
+    found = set()
+    for text in _template_texts(templates_dir):
+        found.update(_STATIC_REF.findall(text))
+        found.update(_ASSET_REF.findall(text))
+    for files in referenced_bundles(templates_dir):
+        found.update(files)
+
+    pending = [f for f in found if f.endswith(".css")]
+    while pending:
+        css = pending.pop()
+        with open(os.path.join(STATIC_DIR, css), encoding="utf-8") as f:
+            for ref in _CSS_URL.findall(f.read()):
+                if ref.startswith(("data:", "http:", "https:", "//", "/")):
+                    continue
+                path = os.path.normpath(os.path.join(os.path.dirname(css), ref.split("?")[0].split("#")[0]))
+                if path not in found and os.path.exists(os.path.join(STATIC_DIR, path)):
+                    found.add(path)
+                    if path.endswith(".css"):
+                        pending.append(path)
+    return sorted(found)
+
+
+def minify_css(text):
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};,>])\s*", r"\1", text)
+    return text.replace(";}", "}").strip()
+
+
+def minify_js(text):
+    # Conservative: drop block comments and indentation/blank lines only
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def _rewrite_css_urls(text, css_name, manifest, out_dir=None):
+    # Point url(...) references at the hashed copies, relative to where the
+    # rewritten CSS is written (default: beside css_name under dist/)
+    out_dir = out_dir or os.path.dirname(f"{DIST}/{css_name}")
+
+    def replace(match):
+        ref = match.group(1)
+        path = os.path.normpath(os.path.join(os.path.dirname(css_name), ref.split("?")[0].split("#")[0]))
+        if path in manifest:
+            return f"url({os.path.relpath(manifest[path], out_dir)})"
+        return match.group(0)
+    return _CSS_URL.sub(replace, text)
+
+
+def _hashed_name(name, data):
+    base, ext = os.path.splitext(name)
+    return f"{DIST}/{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def build():
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+
+    assets = referenced_assets()
+    # Non-CSS first so CSS can reference their hashed names
+    assets.sort(key=lambda name: name.endswith(".css"))
+    manifest = {}
+    minified = {}
+    total_in = total_out = 0
+
+    for name in assets:
+        with open(os.path.join(STATIC_DIR, name), "rb") as f:
+            data = f.read()
+        total_in += len(data)
+
+        if name.endswith(".css"):
+            minified[name] = minify_css(data.decode("utf-8"))
+            data = _rewrite_css_urls(minified[name], name, manifest).encode("utf-8")
+        elif name.endswith(".js"):
+            minified[name] = minify_js(data.decode("utf-8"))
+            data = minified[name].encode("utf-8")
+        manifest[name] = _hashed_name(name, data)
+        total_out += _write(manifest[name], data)
+        print(f"{name} -> {manifest[name]}")
+
+    for files in referenced_bundles():
+        ext = _bundle_ext(files)
+        if ext == ".css":
+            # url(...)s are relative to each source file; resolve them for dist/
+            data = "\n".join(_rewrite_css_urls(minified[name], name, manifest, DIST) for name in files)
+        else:
+            # ";" so a file ending without one can't run into the next
+            data = ";\n".join(minified[name] for name in files)
+        key = "+".join(files)
+        manifest[key] = _hashed_name("bundle" + ext, data.encode("utf-8"))
+        total_out += _write(manifest[key], data.encode("utf-8"))
+        print(f"{key} -> {manifest[key]}")
+
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f"{len(manifest)} assets, {total_in:,} -> {total_out:,} bytes before compression"
+          + ("" if brotli else " (install brotli for .br variants)"))
+    return manifest
+
+
+def _write(hashed, data):
+    """Write a dist file and its precompressed variants; returns its size."""
+    out = os.path.join(STATIC_DIR, hashed)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "wb") as f:
+        f.write(data)
+    if hashed.endswith(COMPRESSIBLE):
+        with open(out + ".gz", "wb") as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli:
+            with open(out + ".br", "wb") as f:
+                f.write(brotli.compress(data, quality=11))
+    return len(data)
+
+
+def _bundle_ext(files):
+    exts = {os.path.splitext(name)[1] for name in files}
+    if len(exts) != 1 or not exts <= {".css", ".js"}:
+        raise ValueError(f"a bundle is all .css or all .js: {', '.join(files)}")
+    return exts.pop()
+
+
+# ---------------- RUNTIME ----------------
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_app(app):
+    manifest = load_manifest()
+    app.config["ASSET_MANIFEST"] = manifest
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == "static" and values.get("filename") in manifest:
+            values["filename"] = manifest[values["filename"]]
+
+    def serve_dist(filename):
+        accepted = request.headers.get("Accept-Encoding", "")
+        encoding = None
+        if filename.endswith(COMPRESSIBLE):
+            for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+                if candidate in accepted and os.path.exists(os.path.join(DIST_DIR, filename + suffix)):
+                    encoding, filename = candidate, filename + suffix
+                    break
+
+        response = send_from_directory(DIST_DIR, filename, max_age=ONE_YEAR)
+        if encoding:
+            # Don't advertise the .gz/.br file name for what is the decoded CSS/JS
+            response.headers.pop("Content-Disposition", None)
+            response.headers["Content-Encoding"] = encoding
+            response.mimetype = _mimetype(filename.rsplit(".", 1)[0])
+        response.headers["Cache-Control"] = f"public, max-age={ONE_YEAR}, immutable"
+        response.vary.add("Accept-Encoding")
+        return response
+
+    app.add_url_rule(f"{app.static_url_path}/{DIST}/<path:filename>", "static_dist", serve_dist)
+    app.jinja_env.globals["asset_url"] = asset_url
+    app.jinja_env.globals["asset_bundle"] = asset_bundle
+
+
+def _mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+def asset_url(filename, **values):
+    """url_for('static', filename=...) that always resolves through the manifest."""
+    return url_for("static", filename=filename, **values)
+
+
+def asset_bundle(*filenames):
+    """<link>/<script> tags for filenames: one for their built bundle, or
+    one per file when there is no build."""
+    ext = _bundle_ext(filenames)
+    bundle = current_app.config.get("ASSET_MANIFEST", {}).get("+".join(filenames))
+    urls = [url_for("static", filename=bundle)] if bundle else [asset_url(name) for name in filenames]
+    if ext == ".css":
+        tags = [f'<link rel="stylesheet" href="{escape(url)}">' for url in urls]
+    else:
+        tags = [f'<script src="{escape(url)}"></script>' for url in urls]
+    return Markup("\n".join(tags))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["build"]:
+        sys.exit("usage: python assets.py build")
+    build()
@@ -1,5 +1,182 @@
-from datetime import datetime
+import atexit
+import fcntl
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import date, datetime
 
-def log_action(username, action):
-    with open("audit.log", "a") as f:
-        f.write(f"{datetime.now()} | {username} | {action}\n")
+AUDIT_LOG_PATH = os.environ.get("AUDIT_LOG_PATH", "audit.log")
+
+# Flush when this many records are buffered or this many seconds have passed
+FLUSH_SIZE = 200
+FLUSH_INTERVAL = 1.0
+QUEUE_SIZE = 10000
+
+# Rotate when the live file passes this size or was last written on an earlier day
+MAX_BYTES = int(os.environ.get("AUDIT_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Seconds to wait after a failed write before trying the batch again
+RETRY_INTERVAL = 5.0
+
+log = logging.getLogger(__name__)
+
+
+class AuditLogger:
+    """Buffers audit records in memory and appends them from a background
+    thread, one write per batch, as JSON lines.
+
+    Every worker appends to the same file under an exclusive flock, so
+    batches never interleave and only one process rotates at a time.
+    """
+
+    def __init__(self, path=AUDIT_LOG_PATH):
+        self.path = path
+        self.dropped = 0
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Started lazily so each forked gunicorn worker gets its own thread
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def log(self, record):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request on the audit trail
+            self.dropped += 1
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while True:
+            try:
+                record = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if record is None:
+                    self._try_write(batch)
+                    return
+                batch.append(record)
+            except queue.Empty:
+                pass
+            if len(batch) >= FLUSH_SIZE or time.monotonic() >= deadline:
+                if self._try_write(batch):
+                    batch = []
+                    deadline = time.monotonic() + FLUSH_INTERVAL
+                else:
+                    # Keep the batch for the next attempt, bounded like the queue
+                    if len(batch) > QUEUE_SIZE:
+                        self.dropped += len(batch) - QUEUE_SIZE
+                        del batch[:len(batch) - QUEUE_SIZE]
+                    deadline = time.monotonic() + RETRY_INTERVAL
+
+    def _try_write(self, batch):
+        # Disk full, permissions, a failed rotate: the thread must survive it
+        try:
+            self._write(batch)
+            return True
+        except Exception:
+            log.exception("audit: could not write %d records to %s", len(batch), self.path)
+            return False
+
+    def _open_locked(self):
+        # Lock the file currently at self.path; if another worker rotated it
+        # while we waited for the lock, retry on the new file.
+        while True:
+            f = open(self.path, "ab")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _write(self, batch):
+        if not batch:
+            return
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch).encode("utf-8")
+        rotated = None
+        f = self._open_locked()
+        try:
+            if self._should_rotate(f):
+                rotated = self._rotate()
+                f.close()
+                f = self._open_locked()
+            end = os.fstat(f.fileno()).st_size
+            try:
+                f.write(data)
+                f.flush()
+            except OSError:
+                # Don't leave half a batch behind for the retry to follow
+                f.truncate(end)
+                raise
+        finally:
+            f.close()
+        if rotated:
+            # The batch is already written; a failed compression only leaves
+            # the rotated file uncompressed (audit_index reads both)
+            try:
+                gzip_file(rotated)
+            except OSError:
+                log.exception("audit: could not compress %s", rotated)
+
+    def _should_rotate(self, f):
+        st = os.fstat(f.fileno())
+        if st.st_size == 0:
+            return False
+        return st.st_size >= MAX_BYTES or date.fromtimestamp(st.st_mtime) < date.today()
+
+    def _rotate(self):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        rotated = f"{self.path}.{stamp}.{os.getpid()}"
+        os.rename(self.path, rotated)
+        return rotated
+
+    def flush(self, timeout=5.0):
+        """Drain the queue and stop the writer (called at exit)."""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._pid = None
+
+
+def gzip_file(path):
+    # Compress to a temp name so readers never see a truncated .gz
+    tmp = path + ".gz.tmp"
+    try:
+        with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp, path + ".gz")
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.remove(path)
+
+
+logger = AuditLogger()
+atexit.register(logger.flush)
+
+
+def log_action(username, action, **details):
+    record = {"ts": datetime.now().isoformat(), "user": username, "action": action}
+    if details:
+        record.update(details)
+    logger.log(record)
@@ -0,0 +1,302 @@
+"""On-disk index over the audit trail written by audit.log_action.
+
+    python audit_index.py update
+    python audit_index.py query --user Meghna --since 2026-01-22 --until "2026-01-23 12:00"
+    python audit_index.py query --action "Logged in" --since 2026-10-01
+
+The index directory holds:
+
+  records.dat          every ingested record as one JSON line (append-only)
+  seg-N.{user,action,time}.idx
+                       fixed-size entries pointing into records.dat, sorted
+                       by (user, ts), (action, ts) and (ts) respectively
+  meta.json            user/action dictionaries, segment list and how far
+                       each source log has been read
+
+Source files are told apart by their first line, which survives both the
+writer's rename and the later gzip. So a rotated log is read exactly once,
+whether it is seen live, rotated or compressed. An archive that is still
+being written (or was cut short) is read as far as it goes and retried by
+the next update.
+
+`update` only reads log bytes it has not seen before and writes them as a
+new segment; segments are merged once there are more than MAX_SEGMENTS.
+Queries binary-search the segments through mmap, so a user + time range
+lookup touches only the matching entries instead of scanning the log.
+"""
+import argparse
+import fcntl
+import glob
+import gzip
+import heapq
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from datetime import datetime
+
+import audit
+
+INDEX_DIR = os.environ.get("AUDIT_INDEX_DIR", "audit_index")
+MAX_SEGMENTS = 8
+
+# user_id, ts, action_id, offset into records.dat, length
+ENTRY = struct.Struct("<IdIQI")
+
+# audit.AuditLogger._rotate names: <log>.YYYYmmdd-HHMMSS-ffffff.<pid>[.gz]
+_ROTATED = re.compile(r"\.\d{8}-\d{6}-\d{6}\.\d+(\.gz)?$")
+
+ORDERS = {
+    "user": lambda e: (e[0], e[1]),
+    "action": lambda e: (e[2], e[1]),
+    "time": lambda e: (e[1],),
+}
+
+
+def parse_line(line):
+    """Return a record dict for a JSON-lines or legacy "ts | user | action"
+    audit line, or None if the line can't be read."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        if line.startswith("{"):
+            record = json.loads(line)
+            datetime.fromisoformat(record["ts"])
+            return record
+        ts, user, action = (part.strip() for part in line.split(" | ", 2))
+        datetime.fromisoformat(ts)
+        return {"ts": ts, "user": user, "action": action}
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class AuditIndex:
+
+    def __init__(self, directory=INDEX_DIR, log_path=None):
+        self.directory = directory
+        self.log_path = log_path or audit.AUDIT_LOG_PATH
+        os.makedirs(directory, exist_ok=True)
+        self.meta = self._load_meta()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_meta(self):
+        try:
+            with open(self._path("meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"users": {}, "actions": {}, "segments": [], "next_segment": 0, "files": {}}
+
+    def _save_meta(self):
+        tmp = self._path("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._path("meta.json"))
+
+    # ---------------- INGEST ----------------
+
+    def _upgrade_meta(self):
+        # Older indexes tracked the live file by inode and rotated ones by name
+        if "files" in self.meta:
+            return
+        files = self.meta["files"] = {}
+        live = self.meta.pop("live", None)
+        if live:
+            files[live["first"]] = {"offset": live["offset"], "done": False}
+        for name in self.meta.pop("done", []):
+            path = os.path.join(os.path.dirname(self.log_path) or ".", name)
+            first = _first_line(path)
+            if first is not None:
+                files[first] = {"offset": 0, "done": True}
+
+    def _sources(self):
+        """Rotated logs (one path each, gzipped or not), oldest first, then the live log."""
+        rotated = {}
+        for path in glob.glob(self.log_path + ".*"):
+            if not _ROTATED.search(path[len(self.log_path):]):
+                continue
+            base = path[:-3] if path.endswith(".gz") else path
+            # Both exist while gzip_file finishes; the plain one is complete
+            if base not in rotated or not path.endswith(".gz"):
+                rotated[base] = path
+        return [rotated[base] for base in sorted(rotated)] + [self.log_path]
+
+    def _read_sources(self):
+        """Yield raw lines not yet indexed, oldest file first."""
+        self._upgrade_meta()
+        files = self.meta["files"]
+        for path in self._sources():
+            first = _first_line(path)
+            if first is None or files.get(first, {}).get("done"):
+                continue
+            state = files.setdefault(first, {"offset": 0, "done": False})
+            opener = gzip.open if path.endswith(".gz") else open
+            try:
+                with opener(path, "rb") as f:
+                    f.seek(state["offset"])
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break  # partially written batch; pick it up next time
+                        state["offset"] += len(line)
+                        yield line
+                    else:
+                        # Rotated files never grow again
+                        state["done"] = path != self.log_path
+            except (EOFError, gzip.BadGzipFile):
+                continue  # archive still being written or cut short; retry next update
+            except FileNotFoundError:
+                continue  # rotated or compressed under us; found again next update
+
+    def _intern(self, table, value):
+        ids = self.meta[table]
+        if value not in ids:
+            ids[value] = len(ids)
+        return ids[value]
+
+    def update(self):
+        """Index new audit records; returns how many were added."""
+        with open(self._path("lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.meta = self._load_meta()
+
+            entries = []
+            with open(self._path("records.dat"), "ab") as data:
+                offset = data.tell()
+                for raw in self._read_sources():
+                    record = parse_line(raw.decode("utf-8", "replace"))
+                    if record is None:
+                        continue
+                    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                    data.write(line)
+                    entries.append((
+                        self._intern("users", str(record.get("user"))),
+                        datetime.fromisoformat(record["ts"]).timestamp(),
+                        self._intern("actions", str(record.get("action"))),
+                        offset,
+                        len(line),
+                    ))
+                    offset += len(line)
+
+            if entries:
+                self._write_segment(entries)
+            if len(self.meta["segments"]) > MAX_SEGMENTS:
+                self._compact()
+            self._save_meta()
+            return len(entries)
+
+    def _write_segment(self, entries):
+        seg = self.meta["next_segment"]
+        for order, key in ORDERS.items():
+            with open(self._path(f"seg-{seg}.{order}.idx"), "wb") as f:
+                f.write(b"".join(ENTRY.pack(*e) for e in sorted(entries, key=key)))
+        self.meta["segments"].append(seg)
+        self.meta["next_segment"] = seg + 1
+
+    def _compact(self):
+        old = self.meta["segments"]
+        entries = []
+        for seg in old:
+            with open(self._path(f"seg-{seg}.time.idx"), "rb") as f:
+                entries.extend(ENTRY.iter_unpack(f.read()))
+        self.meta["segments"] = []
+        self._write_segment(entries)
+        for seg in old:
+            for order in ORDERS:
+                os.remove(self._path(f"seg-{seg}.{order}.idx"))
+
+    # ---------------- QUERY ----------------
+
+    def _search(self, seg, order, lo, hi):
+        """Yield entries of one segment with lo <= key <= hi, in key order."""
+        path = self._path(f"seg-{seg}.{order}.idx")
+        if os.path.getsize(path) == 0:
+            return
+        key = ORDERS[order]
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            count = len(mm) // ENTRY.size
+            left, right = 0, count
+            while left < right:
+                mid = (left + right) // 2
+                if key(ENTRY.unpack_from(mm, mid * ENTRY.size)) < lo:
+                    left = mid + 1
+                else:
+                    right = mid
+            for i in range(left, count):
+                entry = ENTRY.unpack_from(mm, i * ENTRY.size)
+                if key(entry) > hi:
+                    break
+                yield entry
+
+    def query(self, user=None, action=None, since=None, until=None):
+        """Yield matching records (dicts) in timestamp order."""
+        since = since.timestamp() if since else float("-inf")
+        until = until.timestamp() if until else float("inf")
+        user_id = action_id = None
+
+        if user is not None:
+            user_id = self.meta["users"].get(user)
+            if user_id is None:
+                return
+        if action is not None:
+            action_id = self.meta["actions"].get(action)
+            if action_id is None:
+                return
+
+        if user_id is not None:
+            order, lo, hi = "user", (user_id, since), (user_id, until)
+        elif action_id is not None:
+            order, lo, hi = "action", (action_id, since), (action_id, until)
+        else:
+            order, lo, hi = "time", (since,), (until,)
+
+        streams = [self._search(seg, order, lo, hi) for seg in self.meta["segments"]]
+        path = self._path("records.dat")
+        if not os.path.getsize(path):
+            return
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as records:
+            for entry in heapq.merge(*streams, key=lambda e: e[1]):
+                if action_id is not None and entry[2] != action_id:
+                    continue
+                yield json.loads(records[entry[3]:entry[3] + entry[4]])
+
+
+def _first_line(path):
+    """First line of a log file, gzipped or not, as text; None if empty or unreadable."""
+    try:
+        with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+            first = f.readline()
+    except (OSError, EOFError):
+        return None
+    return first.decode("utf-8", "replace") if first else None
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query the audit log index.")
+    parser.add_argument("--index", default=INDEX_DIR)
+    parser.add_argument("--log", default=None, help="live audit log (default: audit.AUDIT_LOG_PATH)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("update", help="index audit records written since the last update")
+    q = sub.add_parser("query", help="print matching records as JSON lines")
+    q.add_argument("--user")
+    q.add_argument("--action")
+    q.add_argument("--since", type=parse_time, help="ISO date/time, inclusive")
+    q.add_argument("--until", type=parse_time, help="ISO date/time, inclusive")
+    q.add_argument("--no-update", action="store_true", help="don't pick up new log lines first")
+    args = parser.parse_args()
+
+    index = AuditIndex(args.index, args.log)
+    if args.command == "update":
+        print(f"Indexed {index.update()} new records.")
+    else:
+        if not args.no_update:
+            index.update()
+        for record in index.query(args.user, args.action, args.since, args.until):
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
@@ -0,0 +1,76 @@
+"""Per-turn cost of the compiled chatbot flow as flows grow.
+
+    python -m benchmarks.chatbot_bench [--sizes 10 100 1000 10000]
+
+Builds synthetic linear flows of N question nodes and times one turn
+through the compiled transition table against the equivalent sequential
+`if stage == ...` ladder the old chatbot_reply used.
+"""
+import argparse
+import random
+import timeit
+
+from ml_engine import compile_flow
+
+
+def synthetic_flow(size):
+    nodes = {}
+    for i in range(size):
+        node = {"prompt": f"Question {i}?", "field": f"q{i}", "next": f"n{i + 1}" if i + 1 < size else "done"}
+        if i % 10 == 0:
+            node["branches"] = [{"if": ">=", "value": 8, "next": "done"}]
+        nodes[f"n{i}"] = node
+    nodes["done"] = {"prompt": "Thanks.", "final": True}
+    return {"name": f"synthetic-{size}", "start": "n0", "nodes": nodes}
+
+
+def compiled_turn(flow):
+    stages = flow.stages
+
+    def turn(state, answer):
+        current = stages[state["stage"]]
+        state[current.field] = answer
+        nxt = current.advance(answer)
+        state["stage"] = nxt.name
+        return nxt.prompt
+    return turn
+
+
+def ladder_turn(spec):
+    # One (stage, field, next, prompt) entry per branch of an if/elif ladder
+    nodes = spec["nodes"]
+    ladder = [(name, node.get("field"), node.get("next"), nodes[node["next"]]["prompt"] if node.get("next") else None)
+              for name, node in nodes.items()]
+
+    def turn(state, answer):
+        stage = state["stage"]
+        for name, field, nxt, prompt in ladder:
+            if stage == name:
+                state[field] = answer
+                state["stage"] = nxt
+                return prompt
+    return turn
+
+
+def per_turn_ns(turn, stage_names, turns=20000):
+    rng = random.Random(3)
+    states = [{"stage": rng.choice(stage_names)} for _ in range(turns)]
+    best = min(timeit.repeat(lambda: [turn(dict(s), "5") for s in states], number=1, repeat=3))
+    return best / turns * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    print(f"{'nodes':>8}{'compiled ns/turn':>20}{'if-ladder ns/turn':>20}")
+    for size in args.sizes:
+        spec = synthetic_flow(size)
+        flow = compile_flow(spec)
+        names = [n for n in spec["nodes"] if n != "done"]
+        print(f"{size:>8}{per_turn_ns(compiled_turn(flow), names):>20.0f}{per_turn_ns(ladder_turn(spec), names):>20.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""Drive the real Flask routes and report throughput and latency per route.
+
+    python -m benchmarks.routes_bench --rows 100000 --requests 500 --concurrency 8
+    python -m benchmarks.routes_bench --mode gunicorn --workers 4 --out after.json --compare before.json
+
+The database is seeded with benchmarks.seed (reused if the file already
+has the requested scale). `--mode client` runs requests in-process through
+Flask's test client; `--mode gunicorn` starts a local gunicorn on the
+same database and sends real HTTP. Results are written as JSON. With
+--compare, a route is flagged when its p95 or throughput is worse than
+the old run by more than --threshold, and the exit status is then 1.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+
+from benchmarks import seed as seeding
+
+ROUTES = [
+    "POST /login",
+    "GET /booking",
+    "POST /booking",
+    "GET /finalize",
+    "POST /finalize",
+    "GET /doctor_dashboard",
+    "POST /chatbot",
+    "GET /chatbotsummary",
+]
+
+CHAT_ANSWERS = ["", "fever and cough", "throat", "5", "3 days", "no"]
+
+
+# ---------------- DRIVERS ----------------
+
+class ClientDriver:
+    """In-process requests through app.test_client()."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login_as(self, username, role):
+        with self.client.session_transaction() as s:
+            s.clear()
+            s.update(username=username, role=role, fullname=username)
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class HttpDriver:
+    """Keep-alive HTTP connection to a running server, with its own cookie."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.cookie = None
+
+    def login_as(self, username, role):
+        self.cookie = None
+        self.request("POST", "/login", {"uname": username, "psw": seeding.SEED_PASSWORD})
+
+    def request(self, method, path, data=None):
+        headers = {"Cookie": self.cookie} if self.cookie else {}
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        try:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            raise
+        response.read()
+        for header, value in response.getheaders():
+            if header.lower() == "set-cookie" and value.startswith("session="):
+                self.cookie = value.split(";", 1)[0]
+        return response.status
+
+
+# ---------------- SCENARIOS ----------------
+
+class Scenario:
+    """Per-thread request generator for one route."""
+
+    # (doctor, slot) pairs handed to a thread but maybe not booked yet
+    _claimed = set()
+    _claim_lock = threading.Lock()
+
+    def __init__(self, route, driver, scale, rng, fresh_driver):
+        self.route = route
+        self.driver = driver
+        self.scale = scale
+        self.rng = rng
+        self.fresh_driver = fresh_driver
+        self.chat_turn = 0
+        self.slot = None
+
+        patient = seeding.patient_name(rng.randrange(scale["patients"]))
+        doctor = rng.randrange(scale["doctors"])
+        self.doctor = seeding.doctor_name(doctor)
+        self.specialization = seeding.SPECIALIZATIONS[doctor % len(seeding.SPECIALIZATIONS)]
+
+        if route == "POST /login":
+            return
+        if route == "GET /doctor_dashboard":
+            driver.login_as(self.doctor, "doctor")
+            return
+        driver.login_as(patient, "patient")
+        if route == "GET /chatbotsummary":
+            driver.request("POST", "/consult_manual", {"symptoms": "fever and chest pain", "ai_consent": "on"})
+
+    def prepare(self):
+        """Untimed setup before each request: POST /finalize needs a slot
+        that is still free and that no other thread is about to book."""
+        if self.route != "POST /finalize":
+            return
+        import database, directory, scheduling
+
+        conn = database.connect()
+        try:
+            doctor = directory.doctor(conn, self.doctor)
+            with Scenario._claim_lock:
+                Scenario._claimed.discard((self.doctor, self.slot))
+                slots = scheduling.next_free_slots(conn, [doctor], len(Scenario._claimed) + 1, days=365)
+                self.slot = next(slot["start"] for slot in slots
+                                 if (self.doctor, slot["start"]) not in Scenario._claimed)
+                Scenario._claimed.add((self.doctor, self.slot))
+        finally:
+            conn.close()
+
+    def run(self):
+        rng, route = self.rng, self.route
+        if route == "POST /login":
+            # A fresh client each time: measures a full anonymous login
+            user = seeding.patient_name(rng.randrange(self.scale["patients"]))
+            return self.fresh_driver().request("POST", "/login", {"uname": user, "psw": seeding.SEED_PASSWORD})
+        if route == "GET /booking":
+            return self.driver.request("GET", "/booking")
+        if route == "POST /booking":
+            return self.driver.request("POST", "/booking", {"specialization": rng.choice(seeding.SPECIALIZATIONS)})
+        path = "/finalize/" + urllib.parse.quote(self.doctor) + "/" + urllib.parse.quote(self.specialization)
+        if route == "GET /finalize":
+            return self.driver.request("GET", path)
+        if route == "POST /finalize":
+            return self.driver.request("POST", path, {"medical_info": "benchmark booking", "slot": self.slot})
+        if route == "GET /doctor_dashboard":
+            return self.driver.request("GET", "/doctor_dashboard")
+        if route == "POST /chatbot":
+            answer = CHAT_ANSWERS[self.chat_turn % len(CHAT_ANSWERS)]
+            self.chat_turn += 1
+            if not answer:
+                return self.driver.request("POST", "/chatbot", {"clear_chat": "1"})
+            return self.driver.request("POST", "/chatbot", {"message": answer})
+        if route == "GET /chatbotsummary":
+            return self.driver.request("GET", "/chatbotsummary")
+        raise ValueError(route)
+
+
+def run_route(route, make_driver, scale, requests, concurrency, warmup=5):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    per_thread = max(1, requests // concurrency)
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        nonlocal errors
+        rng = random.Random(index)
+        scenario = Scenario(route, make_driver(), scale, rng, make_driver)
+        for _ in range(warmup):
+            scenario.prepare()
+            scenario.run()
+        local, failed = [], 0
+        barrier.wait()
+        for _ in range(per_thread):
+            scenario.prepare()
+            started = time.perf_counter()
+            try:
+                status = scenario.run()
+            except Exception:
+                status = 599
+            local.append(time.perf_counter() - started)
+            if status >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors += failed
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed)
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+
+    def pct(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+# ---------------- SERVERS ----------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(env, workers, threads):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "gthread", "--threads", str(threads),
+         "-b", f"127.0.0.1:{port}", "--log-level", "warning", "app:app"],
+        env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                raise SystemExit("gunicorn failed to start")
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("gunicorn did not start listening within 30s")
+
+
+# ---------------- REPORTING ----------------
+
+def print_table(results):
+    print(f"\n{'route':<24}{'reqs':>7}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for route, r in results.items():
+        print(f"{route:<24}{r['requests']:>7}{r['errors']:>6}{r['rps']:>9.1f}"
+              f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}")
+
+
+def compare(old, new, threshold):
+    """Return human-readable regressions of new vs old results."""
+    regressions = []
+    for route, cur in new["results"].items():
+        prev = old["results"].get(route)
+        if not prev:
+            continue
+        if prev["p95_ms"] and cur["p95_ms"] > prev["p95_ms"] * (1 + threshold):
+            regressions.append(f"{route}: p95 {prev['p95_ms']:.2f} -> {cur['p95_ms']:.2f} ms")
+        if prev["rps"] and cur["rps"] < prev["rps"] * (1 - threshold):
+            regressions.append(f"{route}: throughput {prev['rps']:.1f} -> {cur['rps']:.1f} req/s")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "telemed-bench.db"))
+    parser.add_argument("--rows", type=int, default=10000, help="appointments to seed (10k .. 10M)")
+    parser.add_argument("--mode", choices=["client", "gunicorn"], default="client")
+    parser.add_argument("--routes", nargs="+", default=ROUTES, choices=ROUTES, metavar="ROUTE")
+    parser.add_argument("--requests", type=int, default=300, help="measured requests per route")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="earlier results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    args = parser.parse_args()
+
+    # Set before anything imports the app modules, which read these once
+    scratch = tempfile.mkdtemp(prefix="telemed-bench-")
+    os.environ.update(DATABASE_PATH=args.db,
+                      SESSION_DB_PATH=os.path.join(scratch, "sessions.db"),
+                      AUDIT_LOG_PATH=os.path.join(scratch, "audit.log"),
+                      JOBS_DB_PATH=os.path.join(scratch, "jobs.db"),
+                      LOGIN_RATE_LIMITS="0")
+
+    if seeding.seeded_rows(args.db) != args.rows:
+        seeding.seed(args.db, args.rows)
+    scale = seeding.scale_for(args.rows)
+
+    server = None
+    if args.mode == "client":
+        from app import app
+        make_driver = lambda: ClientDriver(app)
+    else:
+        server, port = start_gunicorn(dict(os.environ), args.workers, args.threads)
+        make_driver = lambda: HttpDriver("127.0.0.1", port)
+
+    results = {}
+    try:
+        for route in args.routes:
+            print(f"{route} ...", end="", flush=True)
+            results[route] = run_route(route, make_driver, scale, args.requests, args.concurrency)
+            print(f" {results[route]['rps']:.1f} req/s")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "mode": args.mode,
+            "rows": args.rows,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers if args.mode == "gunicorn" else None,
+        },
+        "results": results,
+    }
+    print_table(results)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("\nNo regressions beyond threshold.")
+
+
+if __name__ == "__main__":
+    main()
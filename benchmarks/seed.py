@@ -0,0 +1,149 @@
+"""Seed a database with synthetic users, doctors, appointments, messages
+and consultations for benchmarking.
+
+    python -m benchmarks.seed --db bench.db --rows 100000
+
+--rows sets the number of appointments; the other tables scale with it
+(1 patient per 20 appointments, 1 doctor per 1000, one message per
+appointment, one consultation per two). Every seeded account has the
+password SEED_PASSWORD. Rows are written in chunked transactions, so 10M
+rows need no more memory than 10k.
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import time
+
+SEED_PASSWORD = "bench-password"
+SPECIALIZATIONS = ["Cardiology", "General Medicine", "Neurology", "Pediatrics",
+                   "Dermatology", "Orthopedics", "Gastroenterology", "Psychiatry"]
+SYMPTOMS = ["fever and cough", "chest pain radiating to left arm", "headache for two days",
+            "stomach pain after meals", "rash on both arms", "joint pain in the knee"]
+CHUNK = 50000
+
+
+def scale_for(rows):
+    return {
+        "appointments": rows,
+        "patients": max(10, rows // 20),
+        "doctors": max(len(SPECIALIZATIONS), rows // 1000),
+        "messages": rows,
+        "consultations": rows // 2,
+    }
+
+
+def _chunks(iterable, size=CHUNK):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _insert(conn, sql, rows, label):
+    started = time.perf_counter()
+    count = 0
+    for chunk in _chunks(rows):
+        with conn:
+            conn.executemany(sql, chunk)
+        count += len(chunk)
+    print(f"  {label}: {count:,} rows in {time.perf_counter() - started:.1f}s")
+
+
+def doctor_name(i):
+    return f"doctor{i}"
+
+
+def patient_name(i):
+    return f"patient{i}"
+
+
+def seed(path, rows, seed_value=42):
+    # Imported here so callers can set DATABASE_PATH etc. before the app
+    # modules read their configuration
+    import database
+    import security
+
+    if os.path.exists(path):
+        os.remove(path)
+    database.init_db(path)
+    scale = scale_for(rows)
+    rng = random.Random(seed_value)
+    password = security.hash_password(SEED_PASSWORD)
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    print(f"Seeding {path}: " + ", ".join(f"{k}={v:,}" for k, v in scale.items()))
+
+    _insert(conn, """
+        INSERT INTO users (fullname, email, username, password, role, specialization, license_id)
+        VALUES (?, ?, ?, ?, 'doctor', ?, ?)
+    """, ((f"Dr {i}", f"{doctor_name(i)}@bench.test", doctor_name(i), password,
+           SPECIALIZATIONS[i % len(SPECIALIZATIONS)], f"LIC{i}") for i in range(scale["doctors"])), "doctors")
+
+    _insert(conn, """
+        INSERT INTO users (fullname, email, username, password, role)
+        VALUES (?, ?, ?, ?, 'patient')
+    """, ((f"Patient {i}", f"{patient_name(i)}@bench.test", patient_name(i), password)
+          for i in range(scale["patients"])), "patients")
+
+    _insert(conn, """
+        INSERT INTO doctor_fees (doctor_username, fee_amount, upi_id) VALUES (?, ?, ?)
+    """, ((doctor_name(i), 300 + i % 700, f"{doctor_name(i)}@upi") for i in range(scale["doctors"])), "fees")
+
+    def appointments():
+        for _ in range(scale["appointments"]):
+            d = rng.randrange(scale["doctors"])
+            yield (patient_name(rng.randrange(scale["patients"])), doctor_name(d),
+                   SPECIALIZATIONS[d % len(SPECIALIZATIONS)], rng.choice(SYMPTOMS),
+                   f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(8, 18):02d}:00",
+                   rng.choices(["Pending", "Approved", "Rejected"], weights=[2, 6, 1])[0])
+    _insert(conn, """
+        INSERT INTO appointments (patient_username, doctor_username, specialization, medical_info,
+                                  appointment_date, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, appointments(), "appointments")
+
+    def messages():
+        for i in range(scale["messages"]):
+            p, d = patient_name(rng.randrange(scale["patients"])), doctor_name(rng.randrange(scale["doctors"]))
+            yield (p, d, f"message {i}") if i % 2 else (d, p, f"reply {i}")
+    _insert(conn, "INSERT INTO messages (sender, receiver, message) VALUES (?, ?, ?)", messages(), "messages")
+
+    _insert(conn, "INSERT INTO consultations (patient_username, symptoms) VALUES (?, ?)",
+            ((patient_name(rng.randrange(scale["patients"])), rng.choice(SYMPTOMS))
+             for _ in range(scale["consultations"])), "consultations")
+
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS bench_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT OR REPLACE INTO bench_meta VALUES ('rows', ?)", (str(rows),))
+    conn.execute("ANALYZE")
+    conn.close()
+    return scale
+
+
+def seeded_rows(path):
+    """Row scale a database was seeded with, or None."""
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute("SELECT value FROM bench_meta WHERE key='rows'").fetchone()
+        return int(row[0]) if row else None
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    seed(args.db, args.rows, args.seed)
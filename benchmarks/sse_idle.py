@@ -0,0 +1,99 @@
+"""Hold many idle /messages/stream connections against a running server
+and measure fan-out latency of one message to all of them.
+
+    gunicorn -k gthread --threads 2000 -w 1 app:app &
+    python -m benchmarks.sse_idle --url http://127.0.0.1:8000 \\
+        --user sarah --password ... --peer john --peer-password ... --connections 2000
+
+Every stream belongs to --user; --peer sends the message, so both must
+share an appointment. Raise `ulimit -n` first for large counts.
+"""
+import argparse
+import asyncio
+import time
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+
+def login(base, username, password):
+    jar = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({"uname": username, "psw": password}).encode()
+    opener.open(base + "/login", data)
+    cookie = "; ".join(f"{c.name}={c.value}" for c in jar)
+    if not cookie:
+        raise SystemExit(f"login failed for {username}")
+    return opener, cookie
+
+
+async def open_stream(host, port, cookie):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write((
+        "GET /messages/stream HTTP/1.1\r\n"
+        f"Host: {host}\r\nCookie: {cookie}\r\nAccept: text/event-stream\r\n\r\n"
+    ).encode())
+    await writer.drain()
+    status = await reader.readline()
+    if b" 200 " not in status:
+        raise RuntimeError(status.decode().strip())
+    return reader, writer
+
+
+async def wait_for_event(reader, marker):
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("stream closed")
+        if marker in line:
+            return time.perf_counter()
+
+
+async def main(args):
+    url = urllib.parse.urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    _, cookie = login(args.url, args.user, args.password)
+    peer, _ = login(args.url, args.peer, args.peer_password)
+
+    started = time.perf_counter()
+    streams = []
+    for batch in range(0, args.connections, 200):
+        results = await asyncio.gather(
+            *(open_stream(host, port, cookie) for _ in range(min(200, args.connections - batch))),
+            return_exceptions=True)
+        streams += [r for r in results if not isinstance(r, BaseException)]
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            print(f"{len(errors)} connections failed, e.g. {errors[0]!r}")
+    print(f"{len(streams)} streams open in {time.perf_counter() - started:.1f}s; idling {args.idle}s")
+    await asyncio.sleep(args.idle)
+
+    marker = f"bench-{time.time_ns()}".encode()
+    waiters = [asyncio.ensure_future(wait_for_event(r, marker)) for r, _ in streams]
+    sent = time.perf_counter()
+    await asyncio.to_thread(
+        peer.open, args.url + "/send_message",
+        urllib.parse.urlencode({"receiver": args.user, "message": marker.decode()}).encode())
+    done, pending = await asyncio.wait(waiters, timeout=30)
+    latencies = sorted((t.result() - sent) * 1000 for t in done if not t.exception())
+
+    if latencies:
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+        print(f"delivered to {len(latencies)}/{len(streams)}: "
+              f"p50 {pick(0.5):.1f}ms p95 {pick(0.95):.1f}ms p99 {pick(0.99):.1f}ms max {latencies[-1]:.1f}ms")
+    for task in pending:
+        task.cancel()
+    for _, writer in streams:
+        writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--peer", required=True)
+    parser.add_argument("--peer-password", required=True)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--idle", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,97 @@
+"""Compare analyze_symptoms against the original if/elif implementation.
+
+    python -m benchmarks.triage_bench [--rules 100 1000 5000]
+
+The second table shows how each approach scales with the number of rules:
+a naive per-rule substring scan grows linearly, the automaton should not.
+"""
+import argparse
+import random
+import string
+import timeit
+
+from ml_engine import TRIAGE_RULES, TriageMatcher, analyze_symptoms
+
+
+def legacy_analyze_symptoms(text):
+    # The pre-rule-table implementation, kept verbatim for comparison.
+    text = text.lower()
+
+    if "chest pain" in text:
+        return {
+            "risk": "HIGH",
+            "recommendation": "Consult Cardiologist",
+            "explanation": "Chest pain detected → cardiac risk rule triggered"
+        }
+    elif "fever" in text:
+        return {
+            "risk": "MEDIUM",
+            "recommendation": "General Physician",
+            "explanation": "Fever indicates possible infection"
+        }
+    else:
+        return {
+            "risk": "LOW",
+            "recommendation": "Self care / GP",
+            "explanation": "No high-risk symptoms found"
+        }
+
+
+def naive_match(rules, text):
+    text = text.lower()
+    return [rule for rule in rules if rule[0] in text]
+
+
+def random_word(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+
+
+def sample_texts(rng, count, words=40):
+    phrases = [rule[0] for rule in TRIAGE_RULES]
+    texts = []
+    for _ in range(count):
+        parts = [random_word(rng) for _ in range(words)]
+        parts[rng.randrange(words)] = rng.choice(phrases)
+        texts.append(" ".join(parts))
+    return texts
+
+
+def synthetic_rules(rng, count):
+    rules = list(TRIAGE_RULES)
+    while len(rules) < count:
+        phrase = f"{random_word(rng)} {random_word(rng)}"
+        rules.append((phrase, rng.choice(["LOW", "MEDIUM", "HIGH"]), rng.randint(1, 100), "GP", phrase))
+    return rules
+
+
+def per_call_us(fn, texts, repeat=5):
+    runs = timeit.repeat(lambda: [fn(t) for t in texts], number=1, repeat=repeat)
+    return min(runs) / len(texts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--rules", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = sample_texts(rng, args.texts)
+
+    print(f"{len(texts)} texts, ~{sum(map(len, texts)) // len(texts)} chars each\n")
+    print(f"{'implementation':<34}{'us/call':>10}")
+    print(f"{'legacy if/elif (2 rules)':<34}{per_call_us(legacy_analyze_symptoms, texts):>10.2f}")
+    print(f"{f'analyze_symptoms ({len(TRIAGE_RULES)} rules)':<34}{per_call_us(analyze_symptoms, texts):>10.2f}")
+
+    print(f"\n{'rules':>8}{'naive us/call':>16}{'automaton us/call':>20}")
+    for count in args.rules:
+        rules = synthetic_rules(rng, count)
+        matcher = TriageMatcher(rules)
+        naive = per_call_us(lambda t: naive_match(rules, t), texts, repeat=3)
+        compiled = per_call_us(matcher.match, texts, repeat=3)
+        print(f"{count:>8}{naive:>16.2f}{compiled:>20.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Write-behind persistence of triage consultations.
+
+record() is called from the request that shows the AI summary. It only
+puts the consultation on a bounded in-process queue. A background thread
+inserts whatever has queued, up to FLUSH_SIZE rows or every
+FLUSH_INTERVAL seconds, with one executemany per transaction. So a
+summary view never waits on the write lock, and a burst of summaries
+costs one commit rather than one each.
+
+Reloading the same summary is not a new consultation: the session
+remembers the last record it queued. The writer also drops duplicates
+that land in the same batch. If the queue is full the record is written
+synchronously instead of being dropped. The queue is drained at exit.
+Each row goes to the database of the clinic it was recorded at (see
+tenants.py), one transaction per clinic per batch.
+
+With PROFILING=1, /metrics reports queue depth, flush latency and
+rows written, deduplicated, written inline and failed.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import session
+
+import database
+import profiling
+import tenants
+
+FLUSH_SIZE = int(os.environ.get("CONSULTATION_FLUSH_SIZE", "100"))
+FLUSH_INTERVAL = float(os.environ.get("CONSULTATION_FLUSH_INTERVAL", "1.0"))
+QUEUE_SIZE = int(os.environ.get("CONSULTATION_QUEUE_SIZE", "5000"))
+MAX_RETRIES = 5
+
+INSERT = "INSERT INTO consultations (patient_username, symptoms, result, date) VALUES (?, ?, ?, ?)"
+
+log = logging.getLogger(__name__)
+
+
+class ConsultationWriter:
+    """Bounded queue plus one writer thread per worker process."""
+
+    def __init__(self):
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.flush_seconds = profiling.Histogram(
+            "telemed_consultation_flush_seconds", "Time to write one batch of consultations.", ("outcome",))
+        self.rows = profiling.Counter(
+            "telemed_consultation_rows_total", "Consultations by how they were handled.", ("outcome",))
+        self.depth = profiling.Gauge(
+            "telemed_consultation_queue_depth", "Consultations waiting to be written.", self.pending)
+        profiling.register(self.depth, self.flush_seconds, self.rows)
+
+    def _ensure_started(self):
+        # Started lazily so each forked gunicorn worker gets its own thread
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._run, name="consultation-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def pending(self):
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def put(self, row, path=None):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((path, row))
+        except queue.Full:
+            # Backpressure: a clinical record is never dropped
+            conn = database.connect(path)
+            try:
+                with conn:
+                    conn.execute(INSERT, row)
+            finally:
+                conn.close()
+            self.rows.inc(("inline",))
+
+    def _run(self):
+        conns = {}
+        batch = []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            if batch and (stopping or len(batch) >= FLUSH_SIZE or time.monotonic() >= deadline):
+                by_path = {}
+                for path, row in batch:
+                    by_path.setdefault(path, []).append(row)
+                batch = []
+                for path, rows in by_path.items():
+                    batch += [(path, row) for row in self._write(conns, path, rows, final=stopping)]
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + FLUSH_INTERVAL
+        for conn in conns.values():
+            conn.close()
+
+    def _write(self, conns, path, batch, final=False):
+        """Insert one database's rows through conns[path], connecting if
+        needed; returns what is left to retry (nothing on success)."""
+        # Same patient, symptoms and result within one batch: keep the first
+        seen, rows = set(), []
+        for row in batch:
+            if row[:3] not in seen:
+                seen.add(row[:3])
+                rows.append(row)
+        if len(rows) < len(batch):
+            self.rows.inc(("deduplicated",), len(batch) - len(rows))
+        for attempt in range(MAX_RETRIES if final else 1):
+            started = time.perf_counter()
+            try:
+                if path not in conns:
+                    conns[path] = database.connect(path)
+                with conns[path] as conn:
+                    conn.executemany(INSERT, rows)
+            except Exception:
+                # Typically "database is locked" past the busy timeout, but
+                # anything else must not kill the thread either: keep the
+                # rows for the next flush and reconnect then
+                log.exception("consultations: could not write %d rows to %s", len(rows), path or database.DB_PATH)
+                self.flush_seconds.observe(("error",), time.perf_counter() - started)
+                conn = conns.pop(path, None)
+                if conn is not None:
+                    conn.close()
+                continue
+            self.flush_seconds.observe(("ok",), time.perf_counter() - started)
+            self.rows.inc(("written",), len(rows))
+            return []
+        if final or len(rows) >= QUEUE_SIZE:
+            self.rows.inc(("failed",), len(rows))
+            return []
+        return rows
+
+    def flush(self, timeout=10.0):
+        """Drain the queue and stop the writer (called at exit)."""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._pid = None
+
+
+writer = ConsultationWriter()
+atexit.register(writer.flush)
+
+
+def record(patient, symptoms, result):
+    """Queue this session's consultation unless it was already queued.
+    result is the analyze_symptoms dict, or None when AI was declined."""
+    encoded = json.dumps(result, ensure_ascii=False) if result is not None else None
+    # sort_keys: the session store doesn't preserve the result's key order
+    key = hashlib.sha1(f"{patient}\0{symptoms}\0{json.dumps(result, sort_keys=True)}".encode()).hexdigest()
+    if session.get("consultation_key") == key:
+        writer.rows.inc(("deduplicated",))
+        return False
+    session["consultation_key"] = key
+    writer.put((patient, symptoms, encoded, datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")),
+               tenants.current_path())
+    return True
@@ -1,7 +1,135 @@
+import ast
+import os
+import queue
+import re
 import sqlite3
+import sys
+import tempfile
+import threading
 
-def init_db():
-    conn = sqlite3.connect('database.db')
+from flask import g
+
+DB_PATH = os.environ.get("DATABASE_PATH", "database.db")
+
+# Pool / pragma tuning (overridable per deployment)
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "16000"))
+STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", "256"))
+
+
+# ---------------- CONNECTIONS ----------------
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that remembers which file it was opened on, so
+    per-file caches (directory, clinic shards) can tell files apart."""
+    path = None
+
+
+def connect(path=None):
+    """Open a tuned connection: WAL so readers never wait on the writer,
+    NORMAL sync (safe under WAL), a busy timeout instead of instant
+    "database is locked", and a larger page cache."""
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE,
+        check_same_thread=False,
+        factory=Connection,
+    )
+    conn.path = path or DB_PATH
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+class ConnectionPool:
+    """Per-worker pool of open connections.
+
+    gunicorn forks workers after import, so the pool remembers the pid that
+    filled it and starts over in a child instead of sharing file handles.
+    """
+
+    def __init__(self, path=None, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue(maxsize=self.size)
+
+    def acquire(self):
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path)
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+pool = ConnectionPool()
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_for(path=None):
+    """Pool for the file at `path` (default DB_PATH). Any other file, such
+    as a clinic shard (see tenants.py), is brought up to the current schema
+    the first time a worker opens it."""
+    if not path or path == DB_PATH:
+        return pool
+    found = _pools.get(path)
+    if found is None:
+        with _pools_lock:
+            found = _pools.get(path)
+            if found is None:
+                init_db(path)
+                found = _pools[path] = ConnectionPool(path)
+    return found
+
+
+def get_db():
+    """Request-scoped connection, borrowed on first use from the pool of
+    g.db_path (set by tenants.init_app), or DB_PATH."""
+    if "db" not in g:
+        g.db_pool = pool_for(g.get("db_path"))
+        g.db = g.db_pool.acquire()
+    return g.db
+
+
+def close_db(exception=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        g.pop("db_pool", pool).release(conn)
+
+
+# ---------------- SCHEMA ----------------
+
+def init_db(path=None):
+    conn = sqlite3.connect(path or DB_PATH)
     cursor = conn.cursor()
 
     # Users Table
@@ -66,10 +194,508 @@ def init_db():
 )
 ''')
 
-    
     conn.commit()
+    migrate(conn)
     conn.close()
-    print("Database initialized successfully.")
+
+
+def init_app(app, paths=(None,)):
+    """Create/migrate each database the app serves (default DB_PATH)."""
+    for path in paths:
+        init_db(path)
+    app.teardown_appcontext(close_db)
+
+
+# ---------------- MIGRATIONS ----------------
+
+def _rebuild_doctor_fees(conn):
+    # init_db used to key doctor_fees by users.id while every route reads and
+    # writes it by doctor_username; convert older files in place.
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(doctor_fees)")]
+    if "doctor_username" in cols:
+        return
+    conn.execute('''
+        CREATE TABLE doctor_fees_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doctor_username TEXT UNIQUE NOT NULL,
+            fee_amount REAL NOT NULL CHECK (fee_amount >= 0),
+            upi_id TEXT NOT NULL,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (doctor_username) REFERENCES users (username)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO doctor_fees_new (doctor_username, fee_amount, upi_id, last_updated)
+        SELECT u.username, f.fee_amount, f.upi_id, f.last_updated
+        FROM doctor_fees f JOIN users u ON u.id = f.doctor_id
+    ''')
+    conn.execute("DROP TABLE doctor_fees")
+    conn.execute("ALTER TABLE doctor_fees_new RENAME TO doctor_fees")
+
+
+def _consultation_owners(patient):
+    # Owner tokens of every doctor the patient has booked with
+    return f"""(SELECT group_concat(DISTINCT 'u' || hex(doctor_username))
+                FROM appointments WHERE patient_username = {patient})"""
+
+
+def _refresh_consultation_owners(patient):
+    return f"""UPDATE case_search SET owners = {_consultation_owners(patient)}
+            WHERE rowid IN (SELECT id * 2 FROM consultations WHERE patient_username = {patient});"""
+
+
+def _bump_appointments(row, delta):
+    return f"""INSERT INTO rollup_appointments (day, doctor_username, specialization, status, n)
+            VALUES (COALESCE(date({row}.appointment_date), 'unknown'), {row}.doctor_username,
+                    {row}.specialization, COALESCE({row}.status, 'Pending'), {delta})
+            ON CONFLICT (day, doctor_username, specialization, status) DO UPDATE SET n = n + excluded.n;"""
+
+
+def _risk(result):
+    # analyze_symptoms output as stored by rescore.py; anything else is unscored
+    return f"CASE WHEN json_valid({result}) THEN COALESCE(json_extract({result}, '$.risk'), 'UNKNOWN') ELSE 'UNSCORED' END"
+
+
+def _bump_risk(row, delta):
+    return f"""INSERT INTO rollup_triage_risk (day, risk, n)
+            VALUES (COALESCE(date({row}.date), 'unknown'), {_risk(row + ".result")}, {delta})
+            ON CONFLICT (day, risk) DO UPDATE SET n = n + excluded.n;"""
+
+
+# Upper bounds (seconds) of the approval latency histogram: 15m, 1h, 4h,
+# 1d, 3d, 1w; bucket 6 is everything slower. analytics.LATENCY_BUCKETS
+# must match.
+def _latency_bucket(seconds):
+    return f"""CASE WHEN {seconds} <= 900 THEN 0 WHEN {seconds} <= 3600 THEN 1
+                WHEN {seconds} <= 14400 THEN 2 WHEN {seconds} <= 86400 THEN 3
+                WHEN {seconds} <= 259200 THEN 4 WHEN {seconds} <= 604800 THEN 5 ELSE 6 END"""
+
+
+_LATENCY = "((julianday('now') - julianday(NEW.created_at)) * 86400)"
+
+# Recomputes every rollup from the base tables; used by migration 5 and by
+# `python analytics.py rebuild`.
+ROLLUP_BACKFILL = [
+    "DELETE FROM rollup_appointments",
+    "DELETE FROM rollup_approval_latency",
+    "DELETE FROM rollup_triage_risk",
+    """INSERT INTO rollup_appointments (day, doctor_username, specialization, status, n)
+    SELECT COALESCE(date(appointment_date), 'unknown'), doctor_username, specialization,
+           COALESCE(status, 'Pending'), COUNT(*)
+    FROM appointments
+    GROUP BY 1, 2, 3, 4""",
+    f"""INSERT INTO rollup_approval_latency (day, doctor_username, specialization, outcome, bucket, n, total_seconds)
+    SELECT date(decided_at), doctor_username, specialization, status,
+           {_latency_bucket("(julianday(decided_at) - julianday(created_at)) * 86400")},
+           COUNT(*), SUM((julianday(decided_at) - julianday(created_at)) * 86400)
+    FROM appointments
+    WHERE created_at IS NOT NULL AND decided_at IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5""",
+    f"""INSERT INTO rollup_triage_risk (day, risk, n)
+    SELECT COALESCE(date(date), 'unknown'), {_risk("result")}, COUNT(*)
+    FROM consultations
+    GROUP BY 1, 2""",
+]
+
+
+def _slot_row(row):
+    # appointment_slots entry for an appointment: minutes since the epoch
+    # on one axis, the doctor's users.id (as a degenerate range) on the other
+    return f"""SELECT {row}.id,
+                   CAST(strftime('%s', {row}.slot_start) AS INTEGER) / 60,
+                   CAST(strftime('%s', {row}.slot_end) AS INTEGER) / 60,
+                   d.id, d.id
+            FROM users d WHERE d.username = {row}.doctor_username
+              AND {row}.slot_start IS NOT NULL AND COALESCE({row}.status, 'Pending') <> 'Rejected'"""
+
+
+# (version, description, list of SQL statements or a callable taking conn).
+# Append only -- never edit or reorder a shipped migration.
+MIGRATIONS = [
+    (1, "doctor_fees keyed by doctor_username", _rebuild_doctor_fees),
+    (2, "indexes for hot query paths", [
+        # doctor dashboard: status filter + date ordering, covering the row lookup
+        "CREATE INDEX IF NOT EXISTS idx_appointments_doctor_status "
+        "ON appointments (doctor_username, status, appointment_date, id)",
+        # patient dashboard / booking status
+        "CREATE INDEX IF NOT EXISTS idx_appointments_patient_date "
+        "ON appointments (patient_username, appointment_date)",
+        # booking: specialization list and doctors per specialization
+        "CREATE INDEX IF NOT EXISTS idx_users_role_specialization "
+        "ON users (role, specialization, username, fullname)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation "
+        "ON messages (sender, receiver, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_consultations_patient_date "
+        "ON consultations (patient_username, date)",
+    ]),
+    (3, "cache_versions counter bumped on doctor directory changes", [
+        """CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )""",
+        "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('directory', 0)",
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}{when}
+        BEGIN
+            UPDATE cache_versions SET version = version + 1 WHERE name = 'directory';
+        END"""
+        for name, event, table, when in [
+            ("trg_directory_users_insert", "INSERT", "users", " WHEN NEW.role = 'doctor'"),
+            ("trg_directory_users_update", "UPDATE", "users", " WHEN OLD.role = 'doctor' OR NEW.role = 'doctor'"),
+            ("trg_directory_users_delete", "DELETE", "users", " WHEN OLD.role = 'doctor'"),
+            ("trg_directory_fees_insert", "INSERT", "doctor_fees", ""),
+            ("trg_directory_fees_update", "UPDATE", "doctor_fees", ""),
+            ("trg_directory_fees_delete", "DELETE", "doctor_fees", ""),
+        ]
+    ]),
+    (4, "case_search full-text index over symptoms and medical_info", [
+        # One index for both sources; rowid is id*2 for consultations and
+        # id*2+1 for appointments, so triggers can find their row directly.
+        # `owners` holds a token per doctor allowed to see the row (see
+        # search.owner_token): an appointment's doctor, and for a
+        # consultation every doctor the patient has booked with. Searches
+        # filter on it inside the index, so they cost in proportion to one
+        # doctor's caseload rather than to the whole table.
+        """CREATE VIRTUAL TABLE IF NOT EXISTS case_search USING fts5(
+            body,
+            owners,
+            kind UNINDEXED,
+            source_id UNINDEXED,
+            patient_username UNINDEXED,
+            date UNINDEXED,
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )""",
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS {name} {event}
+        BEGIN
+            {body}
+        END"""
+        for name, event, body in [
+            ("trg_search_consultations_insert", "AFTER INSERT ON consultations", f"""
+            INSERT INTO case_search (rowid, body, owners, kind, source_id, patient_username, date)
+            VALUES (NEW.id * 2, NEW.symptoms, {_consultation_owners("NEW.patient_username")},
+                    'consultation', NEW.id, NEW.patient_username, NEW.date);"""),
+            ("trg_search_consultations_update", "AFTER UPDATE OF symptoms, patient_username, date ON consultations", f"""
+            DELETE FROM case_search WHERE rowid = OLD.id * 2;
+            INSERT INTO case_search (rowid, body, owners, kind, source_id, patient_username, date)
+            VALUES (NEW.id * 2, NEW.symptoms, {_consultation_owners("NEW.patient_username")},
+                    'consultation', NEW.id, NEW.patient_username, NEW.date);"""),
+            ("trg_search_consultations_delete", "AFTER DELETE ON consultations", """
+            DELETE FROM case_search WHERE rowid = OLD.id * 2;"""),
+            ("trg_search_appointments_insert", "AFTER INSERT ON appointments", """
+            INSERT INTO case_search (rowid, body, owners, kind, source_id, patient_username, date)
+            VALUES (NEW.id * 2 + 1, NEW.medical_info, 'u' || hex(NEW.doctor_username),
+                    'appointment', NEW.id, NEW.patient_username, NEW.appointment_date);"""),
+            # First booking between this doctor and patient: share the patient's consultations
+            ("trg_search_appointments_grant", """AFTER INSERT ON appointments WHEN NOT EXISTS (
+                SELECT 1 FROM appointments
+                WHERE patient_username = NEW.patient_username
+                  AND doctor_username = NEW.doctor_username AND id <> NEW.id)""",
+             _refresh_consultation_owners("NEW.patient_username")),
+            # Not on status, so approvals don't touch the index
+            ("trg_search_appointments_update",
+             "AFTER UPDATE OF medical_info, patient_username, doctor_username, appointment_date ON appointments", f"""
+            DELETE FROM case_search WHERE rowid = OLD.id * 2 + 1;
+            INSERT INTO case_search (rowid, body, owners, kind, source_id, patient_username, date)
+            VALUES (NEW.id * 2 + 1, NEW.medical_info, 'u' || hex(NEW.doctor_username),
+                    'appointment', NEW.id, NEW.patient_username, NEW.appointment_date);
+            {_refresh_consultation_owners("OLD.patient_username")}
+            {_refresh_consultation_owners("NEW.patient_username")}"""),
+            ("trg_search_appointments_delete", "AFTER DELETE ON appointments", f"""
+            DELETE FROM case_search WHERE rowid = OLD.id * 2 + 1;
+            {_refresh_consultation_owners("OLD.patient_username")}"""),
+        ]
+    ] + [
+        # Initial build; `python search.py rebuild` redoes it in chunks
+        """INSERT INTO case_search (rowid, body, owners, kind, source_id, patient_username, date)
+        SELECT id * 2 + 1, medical_info, 'u' || hex(doctor_username), 'appointment', id,
+               patient_username, appointment_date
+        FROM appointments""",
+        f"""INSERT INTO case_search (rowid, body, owners, kind, source_id, patient_username, date)
+        SELECT id * 2, symptoms, {_consultation_owners("consultations.patient_username")}, 'consultation', id,
+               patient_username, date
+        FROM consultations""",
+    ]),
+    (5, "incrementally maintained analytics rollups", [
+        # Booking and first-decision times, for approval latency; rows from
+        # before this migration have neither and are left out of it
+        "ALTER TABLE appointments ADD COLUMN created_at TIMESTAMP",
+        "ALTER TABLE appointments ADD COLUMN decided_at TIMESTAMP",
+        """CREATE TABLE IF NOT EXISTS rollup_appointments (
+            day TEXT NOT NULL,
+            doctor_username TEXT NOT NULL,
+            specialization TEXT NOT NULL,
+            status TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (day, doctor_username, specialization, status)
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS rollup_approval_latency (
+            day TEXT NOT NULL,
+            doctor_username TEXT NOT NULL,
+            specialization TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            total_seconds REAL NOT NULL,
+            PRIMARY KEY (day, doctor_username, specialization, outcome, bucket)
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS rollup_triage_risk (
+            day TEXT NOT NULL,
+            risk TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (day, risk)
+        ) WITHOUT ROWID""",
+    ] + [
+        f"""CREATE TRIGGER IF NOT EXISTS {name} {event}
+        BEGIN
+            {body}
+        END"""
+        for name, event, body in [
+            ("trg_rollup_appointments_insert", "AFTER INSERT ON appointments", f"""
+            UPDATE appointments SET created_at = CURRENT_TIMESTAMP WHERE id = NEW.id AND created_at IS NULL;
+            {_bump_appointments("NEW", 1)}"""),
+            ("trg_rollup_appointments_update",
+             "AFTER UPDATE OF status, doctor_username, specialization, appointment_date ON appointments", f"""
+            {_bump_appointments("OLD", -1)}
+            {_bump_appointments("NEW", 1)}"""),
+            # The first decision on a pending appointment
+            ("trg_rollup_appointments_decided", """AFTER UPDATE OF status ON appointments
+            WHEN COALESCE(OLD.status, 'Pending') = 'Pending' AND NEW.status <> 'Pending' AND OLD.decided_at IS NULL""",
+             f"""
+            UPDATE appointments SET decided_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            INSERT INTO rollup_approval_latency
+                (day, doctor_username, specialization, outcome, bucket, n, total_seconds)
+            SELECT date('now'), NEW.doctor_username, NEW.specialization, NEW.status,
+                   {_latency_bucket(_LATENCY)}, 1, {_LATENCY}
+            WHERE NEW.created_at IS NOT NULL
+            ON CONFLICT (day, doctor_username, specialization, outcome, bucket)
+            DO UPDATE SET n = n + 1, total_seconds = total_seconds + excluded.total_seconds;"""),
+            ("trg_rollup_appointments_delete", "AFTER DELETE ON appointments",
+             _bump_appointments("OLD", -1)),
+            ("trg_rollup_consultations_insert", "AFTER INSERT ON consultations",
+             _bump_risk("NEW", 1)),
+            ("trg_rollup_consultations_update", "AFTER UPDATE OF result, date ON consultations", f"""
+            {_bump_risk("OLD", -1)}
+            {_bump_risk("NEW", 1)}"""),
+            ("trg_rollup_consultations_delete", "AFTER DELETE ON consultations",
+             _bump_risk("OLD", -1)),
+        ]
+    ] + ROLLUP_BACKFILL),
+    (6, "doctor availability and an interval index of booked slots", [
+        "ALTER TABLE appointments ADD COLUMN slot_start TEXT",
+        "ALTER TABLE appointments ADD COLUMN slot_end TEXT",
+        """CREATE TABLE IF NOT EXISTS doctor_availability (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doctor_username TEXT NOT NULL,
+            weekday INTEGER NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+            start_minute INTEGER NOT NULL CHECK (start_minute BETWEEN 0 AND 1439),
+            end_minute INTEGER NOT NULL CHECK (end_minute > start_minute AND end_minute <= 1440),
+            slot_minutes INTEGER NOT NULL DEFAULT 30 CHECK (slot_minutes BETWEEN 5 AND 480),
+            FOREIGN KEY (doctor_username) REFERENCES users (username)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_availability_doctor ON doctor_availability (doctor_username, weekday)",
+        # R*Tree over (time, doctor): "what overlaps [a, b) for this doctor"
+        # is a box query instead of a scan of the doctor's appointments
+        "CREATE VIRTUAL TABLE IF NOT EXISTS appointment_slots USING rtree_i32(id, start_min, end_min, doctor_min, doctor_max)",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_slots_insert AFTER INSERT ON appointments
+        BEGIN
+            INSERT INTO appointment_slots {_slot_row("NEW")};
+        END""",
+        # Rejected appointments free their slot
+        f"""CREATE TRIGGER IF NOT EXISTS trg_slots_update
+        AFTER UPDATE OF status, slot_start, slot_end, doctor_username ON appointments
+        BEGIN
+            DELETE FROM appointment_slots WHERE id = OLD.id;
+            INSERT INTO appointment_slots {_slot_row("NEW")};
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_slots_delete AFTER DELETE ON appointments
+        BEGIN
+            DELETE FROM appointment_slots WHERE id = OLD.id;
+        END""",
+        # Existing bookings hold a 30-minute slot at their typed-in time
+        """UPDATE appointments
+        SET slot_start = strftime('%Y-%m-%d %H:%M', appointment_date),
+            slot_end = strftime('%Y-%m-%d %H:%M', appointment_date, '+30 minutes')
+        WHERE strftime('%s', appointment_date) IS NOT NULL""",
+    ]),
+    (7, "retention checkpoints; cheaper appointment delete triggers for archival purges", [
+        """CREATE TABLE IF NOT EXISTS retention_checkpoints (
+            table_name TEXT PRIMARY KEY,
+            cutoff TEXT NOT NULL,
+            last_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        # retention.py holds a row here while deleting rows it has archived,
+        # so the rollup delete triggers leave historical counts alone
+        "CREATE TABLE IF NOT EXISTS retention_purge (active INTEGER)",
+        # Only the patient's last booking with a doctor changes who may see
+        # their consultations, as with trg_search_appointments_grant
+        "DROP TRIGGER IF EXISTS trg_search_appointments_delete",
+        """CREATE TRIGGER trg_search_appointments_delete AFTER DELETE ON appointments
+        BEGIN
+            DELETE FROM case_search WHERE rowid = OLD.id * 2 + 1;
+        END""",
+        f"""CREATE TRIGGER trg_search_appointments_revoke AFTER DELETE ON appointments WHEN NOT EXISTS (
+            SELECT 1 FROM appointments
+            WHERE patient_username = OLD.patient_username AND doctor_username = OLD.doctor_username)
+        BEGIN
+            {_refresh_consultation_owners("OLD.patient_username")}
+        END""",
+        "DROP TRIGGER IF EXISTS trg_rollup_appointments_delete",
+        f"""CREATE TRIGGER trg_rollup_appointments_delete AFTER DELETE ON appointments
+        WHEN NOT EXISTS (SELECT 1 FROM retention_purge)
+        BEGIN
+            {_bump_appointments("OLD", -1)}
+        END""",
+        "DROP TRIGGER IF EXISTS trg_rollup_consultations_delete",
+        f"""CREATE TRIGGER trg_rollup_consultations_delete AFTER DELETE ON consultations
+        WHEN NOT EXISTS (SELECT 1 FROM retention_purge)
+        BEGIN
+            {_bump_risk("OLD", -1)}
+        END""",
+    ]),
+    (8, "bulk user import checkpoints", [
+        """CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            rows_done INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+    ]),
+]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, verbose=False):
+    """Apply pending migrations in order, each in its own IMMEDIATE
+    transaction so concurrent workers starting up don't race each other."""
+    saved = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, description, step in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if schema_version(conn) >= version:
+                    conn.execute("COMMIT")
+                    continue
+                if callable(step):
+                    step(conn)
+                else:
+                    for sql in step:
+                        conn.execute(sql)
+                conn.execute(f"PRAGMA user_version={version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if verbose:
+                print(f"Applied migration {version}: {description}")
+    finally:
+        conn.isolation_level = saved
+
+
+# ---------------- QUERY PLAN CHECK ----------------
+
+# Modules `check` covers by default, and the schema their SQL runs against:
+# None is DB_PATH; "jobs" and "sessions" are scratch files given the schema
+# of jobs.db and sessions.db. Not listed: tenants.py (its split/move SQL
+# reads attached and temp tables) and ml_engine.py (build-recommender reads
+# every appointment on purpose).
+CHECKED_SOURCES = {
+    "app.py": None,
+    "analytics.py": None,
+    "consultations.py": None,
+    "database.py": None,
+    "directory.py": None,
+    "messaging.py": None,
+    "profiling.py": None,
+    "rescore.py": None,
+    "retention.py": None,
+    "scheduling.py": None,
+    "search.py": None,
+    "tasks.py": None,
+    "user_import.py": None,
+    "jobs.py": "jobs",
+    "session_store.py": "sessions",
+}
+
+def extract_queries(source_path="app.py"):
+    """Yield (lineno, sql) for every literal SQL string passed to execute()."""
+    with open(source_path) as f:
+        tree = ast.parse(f.read(), source_path)
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ("execute", "executemany")
+                and node.args
+                and isinstance(node.args[0], ast.Constant)
+                and isinstance(node.args[0].value, str)):
+            yield node.lineno, " ".join(node.args[0].value.split())
+
+
+_CTE_NAME = re.compile(r"(?:WITH(?: RECURSIVE)?|,)\s*(\w+)(?:\s*\([^)]*\))?\s+AS\s*\(", re.I)
+
+
+def check_query_plans(conn, source_path="app.py"):
+    """Run EXPLAIN QUERY PLAN on every query in source_path and return the
+    ones that fall back to a full table scan as (lineno, sql, detail)."""
+    problems = []
+    for lineno, sql in extract_queries(source_path):
+        if sql.split(None, 1)[0].upper() not in ("SELECT", "UPDATE", "DELETE", "WITH"):
+            continue
+        params = [None] * sql.count("?")
+        ctes = set(_CTE_NAME.findall(sql)) if sql.upper().startswith("WITH") else set()
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[3]
+            # "SCAN (subquery-N)" and a scan of a WITH table walk an
+            # already-bounded intermediate result
+            if (detail.startswith("SCAN ") and "INDEX" not in detail
+                    and "CONSTANT ROW" not in detail and not detail.startswith("SCAN (")
+                    and detail.split()[1] not in ctes):
+                problems.append((lineno, sql, detail))
+    return problems
+
+
+def _check_connection(schema, scratch):
+    """A connection to check `schema` (see CHECKED_SOURCES) against."""
+    if schema is None:
+        return sqlite3.connect(DB_PATH)
+    path = os.path.join(scratch, schema + ".db")
+    if schema == "jobs":
+        import jobs
+        jobs.JobQueue(path).pool.close_all()
+    else:
+        import session_store
+        session_store.SqliteSessionStore(path).pool.close_all()
+    return sqlite3.connect(path)
+
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    command = sys.argv[1] if len(sys.argv) > 1 else "init"
+
+    if command == "init":
+        init_db()
+        print("Database initialized successfully.")
+    elif command == "migrate":
+        conn = sqlite3.connect(DB_PATH)
+        migrate(conn, verbose=True)
+        print(f"Schema at version {schema_version(conn)}.")
+        conn.close()
+    elif command == "check":
+        here = os.path.dirname(os.path.abspath(__file__))
+        sources = sys.argv[2:] or [os.path.join(here, name) for name in CHECKED_SOURCES]
+        failed = False
+        with tempfile.TemporaryDirectory() as scratch:
+            for source in sources:
+                conn = _check_connection(CHECKED_SOURCES.get(os.path.basename(source)), scratch)
+                problems = check_query_plans(conn, source)
+                conn.close()
+                for lineno, sql, detail in problems:
+                    print(f"{os.path.relpath(source)}:{lineno}: {detail}\n    {sql}")
+                failed = failed or bool(problems)
+        if failed:
+            sys.exit(1)
+        print(f"All queries in {len(sources)} module(s) are served by an index.")
+    else:
+        sys.exit("usage: python database.py [init|migrate|check [source.py ...]]")
\ No newline at end of file
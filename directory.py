@@ -0,0 +1,120 @@
+"""Cached doctor directory (specializations, doctors, fees).
+
+The directory only changes when a doctor registers or edits their fee, so
+lookups are served from a per-worker TTL/LRU cache. Cross-worker
+invalidation uses the directory row in cache_versions, which triggers on
+users and doctor_fees bump on every change (see database.MIGRATIONS).
+Each worker re-reads that counter at most once per VERSION_CHECK_INTERVAL,
+so a cache hit normally costs no query at all. Each database file (one per
+clinic, see tenants.py) has its own counter, so it gets its own cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import database
+
+TTL = 300.0
+MAX_ENTRIES = 1024
+VERSION_CHECK_INTERVAL = 1.0
+
+
+class VersionedCache:
+    """LRU cache with per-entry TTL, emptied whenever the shared version
+    counter moves."""
+
+    def __init__(self, name, ttl=TTL, max_entries=MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked = 0.0
+
+    def _sync_version(self, conn):
+        now = time.monotonic()
+        if now - self._checked < VERSION_CHECK_INTERVAL:
+            return
+        row = conn.execute("SELECT version FROM cache_versions WHERE name=?", (self.name,)).fetchone()
+        version = row[0] if row else 0
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked = now
+
+    def get(self, conn, key, load):
+        self._sync_version(conn)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        value = load(conn)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        # The triggers already bumped the shared version; this just makes the
+        # writing worker see its own change without waiting for the next check.
+        with self._lock:
+            self._entries.clear()
+            self._checked = 0.0
+
+
+cache = VersionedCache("directory")
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache_for(conn):
+    """The directory cache for the file conn was opened on."""
+    path = getattr(conn, "path", None)
+    if path is None or path == database.DB_PATH:
+        return cache
+    found = _caches.get(path)
+    if found is None:
+        with _caches_lock:
+            found = _caches.setdefault(path, VersionedCache("directory"))
+    return found
+
+
+def specializations(conn):
+    return cache_for(conn).get(conn, "specializations", lambda c: [row[0] for row in c.execute("""
+        SELECT DISTINCT specialization
+        FROM users
+        WHERE role='doctor' AND specialization IS NOT NULL
+    """)])
+
+
+def doctors(conn, specialization):
+    return cache_for(conn).get(conn, ("doctors", specialization), lambda c: c.execute("""
+        SELECT u.username, u.fullname, u.specialization, f.fee_amount, f.upi_id, u.id
+        FROM users u
+        LEFT JOIN doctor_fees f ON f.doctor_username = u.username
+        WHERE u.role='doctor' AND u.specialization=?
+    """, (specialization,)).fetchall())
+
+
+def doctor(conn, username):
+    return cache_for(conn).get(conn, ("doctor", username), lambda c: c.execute("""
+        SELECT u.username, u.fullname, u.specialization, f.fee_amount, f.upi_id, u.id
+        FROM users u
+        LEFT JOIN doctor_fees f ON f.doctor_username = u.username
+        WHERE u.username=? AND u.role='doctor'
+    """, (username,)).fetchone())
+
+
+def invalidate(conn=None):
+    cache_for(conn).invalidate()
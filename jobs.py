@@ -0,0 +1,348 @@
+"""Durable background jobs in a local SQLite file.
+
+    python jobs.py work [--queues notifications,reminders] [--threads 4]
+    python jobs.py enqueue rescore_consultations [--payload '{"start_id": 0}'] [--delay 60]
+    python jobs.py status
+
+Request handlers call enqueue(), which is one INSERT into JOBS_DB_PATH, a
+separate file from the main database, so it never waits on the
+application's write lock. Then they return. `jobs.py work` runs next to
+gunicorn, as one or more processes each with a few threads.
+
+A worker first checks, without locking, whether anything is due; only
+then does it claim a job inside BEGIN IMMEDIATE: it marks the job running
+under its own lease_owner until lease_expires. Claims are serialized by
+the jobs file's write lock, so each job goes to exactly one worker. The
+per-queue concurrency limit (JOB_QUEUE_LIMITS, e.g.
+"notifications=4,maintenance=1") is checked in the same transaction
+against every process's running jobs. A job whose worker dies is
+re-queued when its lease runs out. A job that raises is retried with
+exponential backoff until max_attempts and then marked failed.
+Completion only counts if the worker still holds the lease.
+
+Handlers are plain functions registered with @task (see tasks.py) and
+called as handler(conn, payload). conn is a connection to the database of
+the clinic named by payload["clinic"], or to the main database when there
+is none and the app is single-tenant. Once clinics exist, a job without
+one fails rather than run against the retired unsplit file (see tenants.py).
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import database
+import tenants
+
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "jobs.db")
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 10.0
+BACKOFF_MAX = 3600.0
+POLL_INTERVAL = 1.0
+KEEP_FINISHED_DAYS = 7
+DEFAULT_CONCURRENCY = 4
+
+QUEUE_LIMITS = {
+    name.strip(): int(limit)
+    for name, _, limit in (item.partition("=") for item in os.environ.get("JOB_QUEUE_LIMITS", "").split(","))
+    if name.strip() and limit.strip()
+}
+
+# name -> (handler, queue, max_attempts, lease seconds)
+TASKS = {}
+
+
+def task(queue="default", max_attempts=MAX_ATTEMPTS, lease=LEASE_SECONDS):
+    """Register a handler(conn, payload) under its function name."""
+    def register(fn):
+        TASKS[fn.__name__] = (fn, queue, max_attempts, lease)
+        return fn
+    return register
+
+
+def backoff(attempts):
+    """Seconds before retry number `attempts`, with +-20% jitter."""
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX) * random.uniform(0.8, 1.2)
+
+
+# ---------------- STORE ----------------
+
+class JobQueue:
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # Schema is created on first use, not at import
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    conn = database.connect(self.path)
+                    with conn:
+                        conn.execute('''
+                            CREATE TABLE IF NOT EXISTS jobs (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                queue TEXT NOT NULL,
+                                task TEXT NOT NULL,
+                                payload TEXT NOT NULL,
+                                key TEXT UNIQUE,
+                                status TEXT NOT NULL DEFAULT 'queued',
+                                run_at REAL NOT NULL,
+                                attempts INTEGER NOT NULL DEFAULT 0,
+                                max_attempts INTEGER NOT NULL,
+                                lease_seconds REAL NOT NULL,
+                                lease_owner TEXT,
+                                lease_expires REAL,
+                                last_error TEXT,
+                                created REAL NOT NULL,
+                                finished REAL
+                            )
+                        ''')
+                        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (queue, status, run_at)")
+                        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_at, queue)")
+                        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_leases ON jobs (status, lease_expires)")
+                    conn.close()
+                    self._pool = database.ConnectionPool(self.path)
+        return self._pool
+
+    def _conn(self):
+        pool = self.pool
+        return pool, pool.acquire()
+
+    def enqueue(self, name, payload=None, delay=0.0, run_at=None, key=None):
+        """Queue task `name` (or a registered function) to run at run_at
+        (epoch seconds; default now + delay). With a key, a job with the
+        same key that already exists makes this a no-op. Returns the job
+        id, or None if it was a duplicate."""
+        name = getattr(name, "__name__", name)
+        _, queue, max_attempts, lease = TASKS[name]
+        now = time.time()
+        pool, conn = self._conn()
+        try:
+            with conn:
+                cursor = conn.execute("""
+                    INSERT INTO jobs (queue, task, payload, key, run_at, max_attempts, lease_seconds, created)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO NOTHING
+                """, (queue, name, json.dumps(payload or {}), key, run_at or now + delay,
+                      max_attempts, lease, now))
+            return cursor.lastrowid if cursor.rowcount else None
+        finally:
+            pool.release(conn)
+
+    def claim(self, owner, queues):
+        """Lease the next due job from `queues` (None: all) that its queue's
+        concurrency limit allows, or return None."""
+        now = time.time()
+        pool, conn = self._conn()
+        try:
+            # Read-only look first, so idle workers don't queue on the write lock
+            names = list(queues) if queues is not None else self._queue_names(conn)
+            expired = conn.execute(
+                "SELECT 1 FROM jobs WHERE status = 'running' AND lease_expires < ? LIMIT 1", (now,)).fetchone()
+            if not expired and not any(self._due(conn, queue, now) for queue in names):
+                return None
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose worker vanished: retry, or give up if out of attempts
+                conn.execute("""
+                    UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                                    lease_owner = NULL, last_error = 'lease expired',
+                                    finished = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END
+                    WHERE status = 'running' AND lease_expires < ?
+                """, (now, now))
+                running = dict(conn.execute(
+                    "SELECT queue, COUNT(*) FROM jobs WHERE status = 'running' GROUP BY queue").fetchall())
+                candidates = [q for q in names if running.get(q, 0) < QUEUE_LIMITS.get(q, DEFAULT_CONCURRENCY)]
+                random.shuffle(candidates)  # no queue starves another
+
+                job = None
+                for queue in candidates:
+                    job = conn.execute("""
+                        UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                                        lease_owner = ?, lease_expires = ? + lease_seconds
+                        WHERE id = (SELECT id FROM jobs WHERE queue = ? AND status = 'queued' AND run_at <= ?
+                                    ORDER BY run_at, id LIMIT 1)
+                        RETURNING id, task, payload, attempts, max_attempts
+                    """, (owner, now, queue, now)).fetchone()
+                    if job:
+                        break
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            pool.release(conn)
+        return dict(job, payload=json.loads(job["payload"])) if job else None
+
+    @staticmethod
+    def _queue_names(conn):
+        # Distinct queues by skipping along idx_jobs_ready, one seek per
+        # queue rather than a scan of the backlog
+        return [row[0] for row in conn.execute("""
+            WITH RECURSIVE names(queue) AS (
+                SELECT MIN(queue) FROM jobs
+                UNION ALL
+                SELECT (SELECT MIN(queue) FROM jobs WHERE queue > names.queue) FROM names WHERE queue IS NOT NULL
+            )
+            SELECT queue FROM names WHERE queue IS NOT NULL
+        """)]
+
+    @staticmethod
+    def _due(conn, queue, now):
+        return conn.execute("SELECT 1 FROM jobs WHERE queue = ? AND status = 'queued' AND run_at <= ? LIMIT 1",
+                            (queue, now)).fetchone() is not None
+
+    def _finish(self, job_id, owner, sql, params):
+        pool, conn = self._conn()
+        try:
+            with conn:
+                cursor = conn.execute(sql + " WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                                      (*params, job_id, owner))
+            return cursor.rowcount == 1
+        finally:
+            pool.release(conn)
+
+    def complete(self, job, owner):
+        return self._finish(job["id"], owner, "UPDATE jobs SET status = 'done', lease_owner = NULL, finished = ?",
+                            (time.time(),))
+
+    def fail(self, job, owner, error):
+        if job["attempts"] >= job["max_attempts"]:
+            return self._finish(job["id"], owner, """
+                UPDATE jobs SET status = 'failed', lease_owner = NULL, last_error = ?, finished = ?
+            """, (error, time.time()))
+        return self._finish(job["id"], owner, """
+            UPDATE jobs SET status = 'queued', lease_owner = NULL, last_error = ?, run_at = ?
+        """, (error, time.time() + backoff(job["attempts"])))
+
+    def prune(self, days=KEEP_FINISHED_DAYS):
+        """Delete done jobs finished more than `days` ago; failed ones stay."""
+        pool, conn = self._conn()
+        try:
+            with conn:
+                return conn.execute("DELETE FROM jobs WHERE status = 'done' AND finished < ?",
+                                    (time.time() - days * 86400,)).rowcount
+        finally:
+            pool.release(conn)
+
+    def status(self):
+        pool, conn = self._conn()
+        try:
+            return conn.execute("""
+                SELECT queue, status, COUNT(*) AS n, MIN(run_at) AS next_run
+                FROM jobs GROUP BY queue, status ORDER BY queue, status
+            """).fetchall()
+        finally:
+            pool.release(conn)
+
+
+jobs = JobQueue()
+
+
+def enqueue(name, payload=None, delay=0.0, run_at=None, key=None):
+    return jobs.enqueue(name, payload, delay, run_at, key)
+
+
+# ---------------- WORKER ----------------
+
+def work(store, queues=None, threads=2, stop=None, once=False):
+    """Run jobs until `stop` is set (or, with once, until none are due)."""
+    stop = stop or threading.Event()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def loop(n):
+        owner = f"{prefix}:{n}"
+        conns = {}
+        while not stop.is_set():
+            job = store.claim(owner, queues)
+            if job is None:
+                if once:
+                    break
+                stop.wait(POLL_INTERVAL)
+                continue
+            handler = TASKS[job["task"]][0] if job["task"] in TASKS else None
+            conn = None
+            try:
+                if handler is None:
+                    raise LookupError(f"no handler registered for {job['task']!r}")
+                clinic = job["payload"].get("clinic")
+                if clinic not in conns:
+                    conns[clinic] = database.connect(tenants.path_for(clinic))
+                conn = conns[clinic]
+                handler(conn, job["payload"])
+            except Exception:
+                if conn is not None and conn.in_transaction:
+                    conn.rollback()
+                store.fail(job, owner, traceback.format_exc(limit=5)[-2000:])
+            else:
+                store.complete(job, owner)
+        for conn in conns.values():
+            conn.close()
+
+    workers = [threading.Thread(target=loop, args=(n,), name=f"job-worker-{n}") for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    last_prune = 0.0
+    while any(worker.is_alive() for worker in workers):
+        if time.monotonic() - last_prune > 3600:
+            store.prune()
+            last_prune = time.monotonic()
+        stop.wait(POLL_INTERVAL)
+    for worker in workers:
+        worker.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Background job queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("work")
+    run.add_argument("--queues", help="comma-separated queues to serve (default: all)")
+    run.add_argument("--threads", type=int, default=2)
+    run.add_argument("--once", action="store_true", help="exit when no job is due")
+    add = sub.add_parser("enqueue")
+    add.add_argument("task")
+    add.add_argument("--payload", default="{}")
+    add.add_argument("--delay", type=float, default=0.0)
+    add.add_argument("--key")
+    sub.add_parser("status")
+    args = parser.parse_args()
+
+    import tasks  # noqa: F401  registers the handlers
+
+    if args.command == "work":
+        stop = threading.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            # Finish the jobs in hand, then exit; unfinished leases just expire
+            signal.signal(sig, lambda *_: stop.set())
+        queues = set(args.queues.split(",")) if args.queues else None
+        print(f"Worker {os.getpid()}: {args.threads} threads on {', '.join(sorted(queues)) if queues else 'all queues'}")
+        work(jobs, queues, args.threads, stop, args.once)
+    elif args.command == "enqueue":
+        if args.task not in TASKS:
+            parser.error(f"unknown task {args.task!r}; known: {', '.join(sorted(TASKS))}")
+        job_id = enqueue(args.task, json.loads(args.payload), args.delay, key=args.key)
+        print(f"Queued job {job_id}." if job_id else "A job with that key already exists.")
+    else:
+        for row in jobs.status():
+            print(f"  {row['queue']:<16} {row['status']:<8} {row['n']:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    # Run as the jobs module: tasks.py registers its handlers in jobs.TASKS,
+    # which would otherwise be a second copy of this module's
+    import jobs
+    sys.exit(jobs.main())
@@ -0,0 +1,207 @@
+"""Patient–doctor messaging: storage helpers and a per-worker pub/sub hub.
+
+Each open Server-Sent Events stream subscribes a bounded queue to the hub
+under its username. A message sent through this worker is published
+straight away. Messages written by other gunicorn workers are picked up
+by one watcher thread per worker. The watcher polls the messages table
+by id watermark (an indexed range read that is usually empty); this is
+the local stand-in for a shared bus such as Redis pub/sub. So database
+load depends on the number of workers, not the number of open chats.
+Each clinic's database (see tenants.py) gets its own hub and watcher,
+since usernames and message ids are only unique within one file.
+
+Streams hold a thread each, so serve them with a threaded or async
+worker class, e.g. `gunicorn -k gthread --threads 1000 app:app`.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+import database
+
+POLL_INTERVAL = 0.5
+MAX_POLL_BACKOFF = 30.0
+KEEPALIVE = 15.0
+SUBSCRIBER_QUEUE = 100
+HISTORY_PAGE = 50
+
+log = logging.getLogger(__name__)
+
+
+# ---------------- STORAGE ----------------
+
+def can_message(conn, sender, receiver):
+    """Doctors and patients may message each other once they share an appointment."""
+    return conn.execute("""
+        SELECT 1 FROM appointments
+        WHERE (doctor_username=? AND patient_username=?)
+           OR (doctor_username=? AND patient_username=?)
+        LIMIT 1
+    """, (sender, receiver, receiver, sender)).fetchone() is not None
+
+
+def save_message(conn, sender, receiver, message):
+    with conn:
+        cursor = conn.execute(
+            "INSERT INTO messages (sender, receiver, message) VALUES (?, ?, ?)",
+            (sender, receiver, message))
+    return dict(conn.execute(
+        "SELECT id, sender, receiver, message, timestamp FROM messages WHERE id=?",
+        (cursor.lastrowid,)).fetchone())
+
+
+def history(conn, user, other, before_id=None, limit=HISTORY_PAGE):
+    """Newest-first page of the conversation between two users."""
+    rows = conn.execute("""
+        SELECT id, sender, receiver, message, timestamp FROM messages
+        WHERE ((sender=? AND receiver=?) OR (sender=? AND receiver=?))
+          AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    """, (user, other, other, user, before_id or 2 ** 63 - 1, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def missed_since(conn, user, last_id, limit=500):
+    """Messages for or from user after last_id, for EventSource reconnects."""
+    rows = conn.execute("""
+        SELECT id, sender, receiver, message, timestamp FROM messages
+        WHERE id > ? AND (sender=? OR receiver=?)
+        ORDER BY id
+        LIMIT ?
+    """, (last_id, user, user, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+# ---------------- HUB ----------------
+
+class Subscription:
+    __slots__ = ("hub", "user", "queue", "closed")
+
+    def __init__(self, hub, user):
+        self.hub = hub
+        self.user = user
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.closed = False
+
+
+class MessageHub:
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._local_ids = set()
+        self._watcher = None
+
+    @property
+    def connections(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def subscribe(self, user):
+        self._ensure_watcher()
+        sub = Subscription(self, user)
+        with self._lock:
+            self._subscribers.setdefault(user, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.user)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.user]
+
+    def publish(self, message, local=False):
+        with self._lock:
+            if local and self._watcher is not None:
+                # Delivered now; the watcher skips the row when it reads it
+                self._local_ids.add(message["id"])
+            targets = list(self._subscribers.get(message["sender"], ()))
+            if message["receiver"] != message["sender"]:
+                targets += self._subscribers.get(message["receiver"], ())
+        for sub in targets:
+            try:
+                sub.queue.put_nowait(message)
+            except queue.Full:
+                # Client stopped reading; it will catch up via Last-Event-ID
+                sub.closed = True
+
+    def _ensure_watcher(self):
+        if self._watcher is None or not self._watcher.is_alive():
+            with self._lock:
+                if self._watcher is None or not self._watcher.is_alive():
+                    # Take the watermark now so nothing sent after this
+                    # subscribe can slip past the watcher's first poll
+                    conn = database.connect(self.db_path)
+                    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+                    self._watcher = threading.Thread(
+                        target=self._watch, args=(conn, last_id), name="message-watcher", daemon=True)
+                    self._watcher.start()
+
+    def _watch(self, conn, last_id):
+        delay = POLL_INTERVAL
+        while True:
+            time.sleep(delay)
+            try:
+                rows = conn.execute("""
+                    SELECT id, sender, receiver, message, timestamp FROM messages
+                    WHERE id > ? ORDER BY id LIMIT 500
+                """, (last_id,)).fetchall()
+                for row in rows:
+                    last_id = row["id"]
+                    with self._lock:
+                        if row["id"] in self._local_ids:
+                            self._local_ids.discard(row["id"])
+                            continue
+                    self.publish(dict(row))
+                with self._lock:
+                    # Anything at or below the watermark was read already
+                    self._local_ids = {i for i in self._local_ids if i > last_id}
+            except Exception:
+                # A failed poll must not end cross-worker delivery; back off and retry
+                delay = min(delay * 2, MAX_POLL_BACKOFF)
+                log.exception("message watcher poll failed; retrying in %.1fs", delay)
+            else:
+                delay = POLL_INTERVAL
+
+
+hub = MessageHub()
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def hub_for(path=None):
+    """The hub for the database at `path` (default DB_PATH)."""
+    if not path or path == database.DB_PATH:
+        return hub
+    found = _hubs.get(path)
+    if found is None:
+        with _hubs_lock:
+            found = _hubs.setdefault(path, MessageHub(path))
+    return found
+
+
+def event_stream(sub, backlog=()):
+    """Generator of SSE frames for one subscription."""
+    try:
+        yield "retry: 3000\n\n"
+        for message in backlog:
+            yield format_event(message)
+        while not sub.closed:
+            try:
+                message = sub.queue.get(timeout=KEEPALIVE)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(message)
+    finally:
+        sub.hub.unsubscribe(sub)
+
+
+def format_event(message):
+    return f"id: {message['id']}\nevent: message\ndata: {json.dumps(message)}\n\n"
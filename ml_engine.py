@@ -1,74 +1,561 @@
-def analyze_symptoms(text):
-    text = text.lower()
+import json
+import logging
+import math
+import os
+import re
+import time
+from collections import Counter, deque
+from itertools import islice
 
-    if "chest pain" in text:
-        return {
-            "risk": "HIGH",
-            "recommendation": "Consult Cardiologist",
-            "explanation": "Chest pain detected → cardiac risk rule triggered"
-        }
-    elif "fever" in text:
-        return {
-            "risk": "MEDIUM",
-            "recommendation": "General Physician",
-            "explanation": "Fever indicates possible infection"
-        }
-    else:
+try:
+    import numpy as np
+except ImportError:  # optional; without it the summary keeps the rule-based recommendation only
+    np = None
+
+log = logging.getLogger(__name__)
+
+RISK_LEVELS = {"LOW": 0, "MEDIUM": 1, "HIGH": 2}
+
+DEFAULT_RESULT = {
+    "risk": "LOW",
+    "recommendation": "Self care / GP",
+    "explanation": "No high-risk symptoms found"
+}
+
+# Triage rules: (phrase, risk, priority, recommendation, explanation).
+# Phrases are matched case-insensitively as substrings of the symptom text.
+# The winning rule is the one with the highest risk, then highest priority.
+TRIAGE_RULES = [
+    ("chest pain", "HIGH", 100, "Consult Cardiologist", "Chest pain detected → cardiac risk rule triggered"),
+    ("chest tightness", "HIGH", 95, "Consult Cardiologist", "Chest tightness → cardiac risk rule triggered"),
+    ("left arm", "HIGH", 60, "Consult Cardiologist", "Pain radiating to the left arm → cardiac risk rule triggered"),
+    ("shortness of breath", "HIGH", 90, "Emergency care", "Breathing difficulty → respiratory emergency rule triggered"),
+    ("difficulty breathing", "HIGH", 90, "Emergency care", "Breathing difficulty → respiratory emergency rule triggered"),
+    ("unconscious", "HIGH", 100, "Emergency care", "Loss of consciousness → emergency rule triggered"),
+    ("fainted", "HIGH", 85, "Emergency care", "Fainting episode → emergency rule triggered"),
+    ("seizure", "HIGH", 95, "Consult Neurologist", "Seizure reported → neurological emergency rule triggered"),
+    ("slurred speech", "HIGH", 95, "Emergency care", "Slurred speech → possible stroke rule triggered"),
+    ("face drooping", "HIGH", 95, "Emergency care", "Facial droop → possible stroke rule triggered"),
+    ("coughing blood", "HIGH", 90, "Consult Pulmonologist", "Coughing blood → respiratory risk rule triggered"),
+    ("vomiting blood", "HIGH", 90, "Consult Gastroenterologist", "Vomiting blood → GI bleed rule triggered"),
+    ("suicidal", "HIGH", 100, "Consult Psychiatrist", "Self-harm risk → urgent mental health rule triggered"),
+    ("palpitations", "MEDIUM", 70, "Consult Cardiologist", "Palpitations → cardiac follow-up recommended"),
+    ("fever", "MEDIUM", 50, "General Physician", "Fever indicates possible infection"),
+    ("high temperature", "MEDIUM", 50, "General Physician", "High temperature indicates possible infection"),
+    ("severe headache", "MEDIUM", 65, "Consult Neurologist", "Severe headache → neurological review recommended"),
+    ("migraine", "MEDIUM", 45, "Consult Neurologist", "Migraine symptoms → neurological review recommended"),
+    ("abdominal pain", "MEDIUM", 55, "Consult Gastroenterologist", "Abdominal pain → GI review recommended"),
+    ("stomach pain", "MEDIUM", 55, "Consult Gastroenterologist", "Stomach pain → GI review recommended"),
+    ("rash", "MEDIUM", 40, "Consult Dermatologist", "Skin rash → dermatology review recommended"),
+    ("blurred vision", "MEDIUM", 60, "Consult Ophthalmologist", "Blurred vision → eye examination recommended"),
+    ("joint pain", "MEDIUM", 40, "Consult Orthopedist", "Joint pain → orthopedic review recommended"),
+    ("cough", "LOW", 30, "General Physician", "Cough without red flags → GP review"),
+    ("sore throat", "LOW", 30, "General Physician", "Sore throat without red flags → GP review"),
+    ("headache", "LOW", 25, "Self care / GP", "Headache without red flags"),
+    ("cold", "LOW", 20, "Self care / GP", "Common cold symptoms"),
+]
+
+
+class TriageMatcher:
+    """Aho-Corasick automaton over the rule phrases.
+
+    Built once; a scan costs O(len(text) + matches) whatever the number of
+    rules, instead of one substring pass per rule.
+    """
+
+    def __init__(self, rules):
+        self.rules = [
+            {"phrase": phrase.lower(), "risk": risk, "priority": priority,
+             "recommendation": recommendation, "explanation": explanation}
+            for phrase, risk, priority, recommendation, explanation in rules
+        ]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for index, rule in enumerate(self.rules):
+            state = 0
+            for ch in rule["phrase"]:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(index)
+
+        # Breadth-first fail links; each state inherits its fail state's outputs
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, nxt in self._goto[state].items():
+                pending.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def match(self, text):
+        """Return the indexes of every rule whose phrase occurs in text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in " ".join(text.lower().split()):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+    def analyze(self, text):
+        hits = [self.rules[i] for i in self.match(text)]
+        if not hits:
+            return dict(DEFAULT_RESULT, rules=[])
+
+        hits.sort(key=lambda r: (RISK_LEVELS[r["risk"]], r["priority"]), reverse=True)
+        top = hits[0]
         return {
-            "risk": "LOW",
-            "recommendation": "Self care / GP",
-            "explanation": "No high-risk symptoms found"
+            "risk": top["risk"],
+            "recommendation": top["recommendation"],
+            "explanation": top["explanation"],
+            "rules": [r["phrase"] for r in hits]
         }
 
+
+_matcher = TriageMatcher(TRIAGE_RULES)
+
+
+def analyze_symptoms(text):
+    """Triage free-text symptoms against TRIAGE_RULES.
+
+    Returns the highest-risk matching rule's risk/recommendation/explanation
+    plus "rules", every matched phrase ordered by risk and priority.
+    """
+    return _matcher.analyze(text)
+
+
+def analyze_symptoms_batch(texts, chunk_size=1000):
+    """Lazily triage an iterable of texts, pulling chunk_size at a time.
+
+    Yields one result list per chunk, in input order, so callers can write
+    each chunk back before the next is read.
+    """
+    analyze = _matcher.analyze
+    texts = iter(texts)
+    while True:
+        chunk = list(islice(texts, chunk_size))
+        if not chunk:
+            return
+        yield [analyze(text or "") for text in chunk]
+
 def summarize_consultation(text):
     return f"Patient reported: {text}. AI summary generated for clinical assistance."
-# ml_engine.py
+
+
+# ---------------- SPECIALIZATION RECOMMENDER ----------------
+
+# TF-IDF over the chatbot's symptom/location/severity answers, scored
+# against one row per specialization. `python ml_engine.py build-recommender`
+# writes the model to RECOMMENDER_DIR as .npy files that every worker
+# memory-maps, so gunicorn workers share one copy through the page cache.
+# If no model has been built yet, load_recommender() builds one from
+# SPECIALIZATION_PROFILES and TRIAGE_RULES when the app starts. Past appointments can sharpen it
+# (--db): each medical_info counts towards its appointment's specialization.
+RECOMMENDER_DIR = os.environ.get("RECOMMENDER_DIR",
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), "recommender"))
+RECOMMENDER_FIELDS = ("symptom", "location")  # plus "severity", as a sev:* term
+
+# Vocabulary of each specialization offered at registration
+SPECIALIZATION_PROFILES = {
+    "Cardiology": "chest pain chest tightness chest pressure palpitations heart racing irregular heartbeat "
+                  "left arm pain jaw pain shortness of breath on exertion swollen ankles high blood pressure "
+                  "fainting cold sweat heart chest",
+    "Neurology": "headache severe headache migraine seizure numbness tingling weakness on one side slurred "
+                 "speech face drooping dizziness vertigo blurred vision memory loss confusion tremor head "
+                 "neck back of head",
+    "Pediatrics": "child baby infant toddler kid son daughter fever in child rash ear pain ear infection "
+                  "crying not feeding vomiting diarrhea growth vaccination teething",
+    "General Medicine": "fever cough cold sore throat runny nose fatigue tiredness body ache stomach pain "
+                        "abdominal pain nausea vomiting diarrhea back pain joint pain rash infection flu "
+                        "throat stomach skin",
+}
+
+# TRIAGE_RULES recommendations -> the specialization that handles them
+RECOMMENDATION_SPECIALIZATIONS = {
+    "Consult Cardiologist": "Cardiology",
+    "Consult Neurologist": "Neurology",
+}
+DEFAULT_SPECIALIZATION = "General Medicine"
+
+_WORD = re.compile(r"[a-z]+")
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _severity_term(value):
+    match = _NUMBER.search(str(value or ""))
+    if not match:
+        return None
+    level = float(match.group())
+    return "sev:high" if level >= 8 else "sev:medium" if level >= 4 else "sev:low"
+
+
+def recommender_terms(text):
+    """Unigrams and bigrams of text, the recommender's vocabulary units."""
+    words = _WORD.findall((text or "").lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _state_terms(state):
+    terms = []
+    for field in RECOMMENDER_FIELDS:
+        terms += recommender_terms(state.get(field))
+    severity = _severity_term(state.get("severity"))
+    if severity:
+        terms.append(severity)
+    return terms
+
+
+def _training_documents(extra=()):
+    """Term counts per specialization from the built-in profiles, the triage
+    rules (with their risk as a severity term) and (specialization, text) pairs."""
+    documents = {label: Counter(recommender_terms(text)) for label, text in SPECIALIZATION_PROFILES.items()}
+    for phrase, risk, _, recommendation, _ in TRIAGE_RULES:
+        label = RECOMMENDATION_SPECIALIZATIONS.get(recommendation, DEFAULT_SPECIALIZATION)
+        documents[label].update(recommender_terms(phrase) + [f"sev:{risk.lower()}"])
+    for label, text in extra:
+        documents.setdefault(label, Counter()).update(recommender_terms(text))
+    return documents
+
+
+def build_recommender(directory=RECOMMENDER_DIR, extra=()):
+    """Fit the TF-IDF matrix and write it to directory. Returns (labels, terms)."""
+    documents = _training_documents(extra)
+    labels = sorted(documents)
+    vocab = {term: i for i, term in enumerate(sorted(set().union(*documents.values())))}
+
+    matrix = np.zeros((len(labels), len(vocab)), dtype=np.float32)
+    for row, label in enumerate(labels):
+        for term, count in documents[label].items():
+            matrix[row, vocab[term]] = 1 + math.log(count)
+    df = np.count_nonzero(matrix, axis=0)
+    idf = (np.log((1 + len(labels)) / (1 + df)) + 1).astype(np.float32)
+    matrix *= idf
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    os.makedirs(directory, exist_ok=True)
+    for name, array in (("matrix.npy", matrix), ("idf.npy", idf)):
+        tmp = os.path.join(directory, f".{name}.{os.getpid()}")
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, os.path.join(directory, name))
+    # meta.json last: a reader that sees it sees arrays of the same build
+    tmp = os.path.join(directory, f".meta.json.{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"labels": labels, "vocab": vocab}, f)
+    os.replace(tmp, os.path.join(directory, "meta.json"))
+    return labels, len(vocab)
+
+
+class SpecializationRecommender:
+    """A built model, memory-mapped read-only."""
+
+    def __init__(self, directory=RECOMMENDER_DIR):
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.labels = meta["labels"]
+        self.vocab = meta["vocab"]
+        self.matrix = np.load(os.path.join(directory, "matrix.npy"), mmap_mode="r")
+        self.idf = np.load(os.path.join(directory, "idf.npy"), mmap_mode="r")
+
+    def scores(self, states):
+        """Cosine similarity of each state to each specialization, (len(states), labels)."""
+        vocab = self.vocab
+        indices, weights, offsets = [], [], []
+        for state in states:
+            offsets.append(len(indices))
+            for term, count in Counter(t for t in _state_terms(state) if t in vocab).items():
+                indices.append(vocab[term])
+                weights.append(1 + math.log(count))
+        scores = np.zeros((len(states), len(self.labels)), dtype=np.float32)
+        if not indices:
+            return scores
+
+        indices = np.asarray(indices, dtype=np.intp)
+        weights = np.asarray(weights, dtype=np.float32) * self.idf[indices]
+        offsets = np.asarray(offsets, dtype=np.intp)
+        lengths = np.diff(np.append(offsets, len(indices)))
+        rows = np.repeat(np.arange(len(states)), lengths)
+        weights /= np.sqrt(np.bincount(rows, weights * weights))[rows]
+
+        # One gather of the query terms' columns, then a segmented sum per state
+        contributions = self.matrix[:, indices] * weights
+        nonempty = lengths > 0
+        scores[nonempty] = np.add.reduceat(contributions, offsets[nonempty], axis=1).T
+        return scores
+
+    def recommend_batch(self, states, k=3):
+        """Top-k [{"specialization", "score"}] per state, best first."""
+        scores = self.scores(states)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return [
+            [{"specialization": self.labels[j], "score": round(float(row[j]), 4)} for j in top if row[j] > 0]
+            for row, top in zip(scores, order)
+        ]
+
+
+_recommender = None
+
+
+def load_recommender(directory=RECOMMENDER_DIR):
+    """Load this worker's recommender, building the default model first if
+    none exists. Called once at startup; None when numpy isn't installed."""
+    global _recommender
+    if np is None:
+        log.warning("numpy is not installed; specialization recommendations are disabled")
+        return None
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        build_recommender(directory)
+    _recommender = SpecializationRecommender(directory)
+    return _recommender
+
+
+def get_recommender():
+    """The recommender loaded by load_recommender(), or None."""
+    return _recommender
+
+
+def recommend_specializations(state, k=3):
+    """Specializations best matching a chatbot state's answers, best first."""
+    recommender = get_recommender()
+    return recommender.recommend_batch([state], k)[0] if recommender else []
+
+
+# ---------------- CHATBOT FLOWS ----------------
+
+# Intake flows are JSON graphs in FLOWS_DIR (one file per flow):
+#
+#   {"name": ..., "start": <node>, "nodes": {<node>: {
+#       "prompt": question asked on entering the node,
+#       "field": state key the answer is stored under,
+#       "branches": [{"if": op, "value": v, "next": <node>}, ...],
+#       "next": default next node,
+#       "set": {key: value} extra state written on entry,
+#       "final": true / "repeat": reply once the flow is finished}}}
+#
+# Files are re-read when they change on disk, so clinicians can edit a
+# flow without a deploy.
+FLOWS_DIR = os.environ.get("CHATBOT_FLOWS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "flows"))
+DEFAULT_FLOW = "general"
+FLOW_RELOAD_INTERVAL = 5.0
+
+BRANCH_OPS = {
+    ">=": lambda answer, number, value: number is not None and number >= value,
+    ">": lambda answer, number, value: number is not None and number > value,
+    "<=": lambda answer, number, value: number is not None and number <= value,
+    "<": lambda answer, number, value: number is not None and number < value,
+    "==": lambda answer, number, value: answer == str(value).lower(),
+    "contains": lambda answer, number, value: str(value).lower() in answer,
+}
+
+
+class Stage:
+    __slots__ = ("name", "prompt", "field", "branches", "next", "set", "final", "repeat")
+
+    def __init__(self, name, prompt, field, branches, next, set, final, repeat):
+        self.name = name
+        self.prompt = prompt
+        self.field = field
+        self.branches = branches
+        self.next = next
+        self.set = set
+        self.final = final
+        self.repeat = repeat
+
+    def advance(self, answer):
+        """Return the next Stage for an answer to this stage's prompt."""
+        if self.branches:
+            match = _NUMBER.search(answer)
+            number = float(match.group()) if match else None
+            for test, value, target in self.branches:
+                if test(answer, number, value):
+                    return target
+        return self.next
+
+
+class Flow:
+    __slots__ = ("name", "start", "stages")
+
+    def __init__(self, name, start, stages):
+        self.name = name
+        self.start = start
+        self.stages = stages
+
+
+def compile_flow(spec):
+    """Validate a flow spec and link it into a Flow of Stage objects."""
+    nodes = spec["nodes"]
+    errors = []
+    if spec.get("start") not in nodes:
+        errors.append(f"start node {spec.get('start')!r} is not defined")
+
+    stages = {}
+    for name, node in nodes.items():
+        if "done" in nodes and name != "done" and node.get("final"):
+            errors.append(f"node {name!r}: only 'done' may be final")
+        if not node.get("final") and node.get("next") not in nodes:
+            errors.append(f"node {name!r}: next {node.get('next')!r} is not defined")
+        for branch in node.get("branches", ()):
+            if branch.get("if") not in BRANCH_OPS:
+                errors.append(f"node {name!r}: unknown branch test {branch.get('if')!r}")
+            if branch.get("next") not in nodes:
+                errors.append(f"node {name!r}: branch target {branch.get('next')!r} is not defined")
+        stages[name] = Stage(
+            name, node["prompt"], node.get("field"), (), None,
+            tuple(node.get("set", {}).items()), bool(node.get("final")),
+            node.get("repeat", "You may now proceed to consultation."),
+        )
+    if errors:
+        raise ValueError(f"flow {spec.get('name')!r}: " + "; ".join(errors))
+
+    # Second pass: replace node names with Stage references
+    for name, node in nodes.items():
+        stage = stages[name]
+        stage.next = stages.get(node.get("next"))
+        stage.branches = tuple(
+            (BRANCH_OPS[b["if"]], b["value"] if b["if"] in ("==", "contains") else float(b["value"]), stages[b["next"]])
+            for b in node.get("branches", ())
+        )
+
+    # "done" is the stage name the rest of the app checks for completion
+    if "done" not in stages:
+        raise ValueError(f"flow {spec.get('name')!r}: a final 'done' node is required")
+    return Flow(spec.get("name"), stages[spec["start"]], stages)
+
+
+class FlowRegistry:
+    """Compiled flows, reloaded from FLOWS_DIR when a file changes."""
+
+    def __init__(self, directory=FLOWS_DIR):
+        self.directory = directory
+        self.flows = {}
+        self._mtimes = {}
+        self._checked = 0.0
+        self.reload()
+
+    def reload(self):
+        mtimes = {}
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                path = os.path.join(self.directory, filename)
+                mtimes[path] = os.stat(path).st_mtime
+        if mtimes == self._mtimes:
+            return
+
+        flows = {}
+        for path in sorted(mtimes):
+            with open(path, encoding="utf-8") as f:
+                flow = compile_flow(json.load(f))
+            flows[flow.name] = flow
+        # Swap in atomically; a broken edit raises above and keeps the old set
+        self.flows = flows
+        self._mtimes = mtimes
+
+    def get(self, name):
+        now = time.monotonic()
+        if now - self._checked > FLOW_RELOAD_INTERVAL:
+            self._checked = now
+            try:
+                self.reload()
+            except (OSError, ValueError, KeyError):
+                pass
+        return self.flows.get(name) or self.flows[DEFAULT_FLOW]
+
+
+flows = FlowRegistry()
+
+# How a finished intake is summarized, in this order; fields a flow adds
+# beyond these follow, labelled from their name
+SUMMARY_LABELS = {
+    "child_age": "Child's age",
+    "symptom": "Symptom",
+    "location": "Location",
+    "radiating": "Pain spreads to arm, jaw, neck or back",
+    "severity": "Severity",
+    "duration": "Duration",
+    "additional": "Additional info",
+    "urgent": "Urgent",
+}
+
+
+def intake_summary(state):
+    """The answers a finished flow collected, one "Label: value" line each."""
+    flow = flows.get(state.get("flow", DEFAULT_FLOW))
+    fields = list(SUMMARY_LABELS)
+    for stage in flow.stages.values():
+        for field in (stage.field, *(key for key, _ in stage.set)):
+            if field and field not in fields:
+                fields.append(field)
+    lines = []
+    for field in fields:
+        if field in state:
+            value = f"{state[field]}/10" if field == "severity" else state[field]
+            lines.append(f"{SUMMARY_LABELS.get(field, field.replace('_', ' ').capitalize())}: {value}")
+    return "\n".join(lines)
+
 
 def chatbot_reply(user_input, state):
     """
     Professional telemedicine chatbot that collects structured patient info.
-    State-aware:
-    - symptom
-    - location
-    - severity
-    - duration
-    - additional questions
+
+    state["flow"] picks the intake flow (default "general"); state["stage"]
+    is the node awaiting an answer, "start" before the first question and
+    "done" once everything is collected.
     """
 
     user_input = user_input.strip().lower()
+    flow = flows.get(state.get("flow", DEFAULT_FLOW))
     stage = state.get("stage", "start")
 
     if stage == "start":
-        state["stage"] = "symptom"
-        return "Hello, I’m your AI Health Assistant. What main symptom are you experiencing?"
-
-    if stage == "symptom":
-        state["symptom"] = user_input
-        state["stage"] = "location"
-        return "Can you tell me where the symptom is located? (e.g., chest, head, stomach)"
-
-    if stage == "location":
-        state["location"] = user_input
-        state["stage"] = "severity"
-        return "On a scale of 1 to 10, how severe is the symptom?"
-
-    if stage == "severity":
-        state["severity"] = user_input
-        state["stage"] = "duration"
-        return "How long have you been experiencing this symptom? (hours, days, weeks)"
-
-    if stage == "duration":
-        state["duration"] = user_input
-        state["stage"] = "additional"
-        return "Do you have any other symptoms or information to share?"
-
-    if stage == "additional":
-        # Collect additional notes if any
-        state["additional"] = user_input
-        state["stage"] = "done"
-        return "Thank you. I have collected your information. You can now proceed to consultation."
-
-    if stage == "done":
-        return "You may now proceed to consultation."
-
-    return "Please provide more information."
\ No newline at end of file
+        current = flow.start
+    else:
+        current = flow.stages.get(stage)
+        if current is None:
+            return "Please provide more information."
+        if current.final:
+            return current.repeat
+        if current.field:
+            state[current.field] = user_input
+        current = current.advance(user_input)
+
+    for key, value in current.set:
+        state[key] = value
+    state["stage"] = current.name
+    return current.prompt
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the specialization recommender")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build-recommender")
+    build.add_argument("--db", help="also learn from appointments.medical_info in this database")
+    build.add_argument("--out", default=RECOMMENDER_DIR)
+    args = parser.parse_args()
+
+    if np is None:
+        parser.error("numpy is required to build the recommender")
+    extra = []
+    if args.db:
+        import sqlite3
+        conn = sqlite3.connect(args.db)
+        extra = conn.execute("SELECT specialization, medical_info FROM appointments").fetchall()
+        conn.close()
+    labels, terms = build_recommender(args.out, extra)
+    print(f"Wrote {len(labels)} specializations x {terms} terms to {args.out}")
@@ -0,0 +1,408 @@
+"""Opt-in per-request profiling, enabled with PROFILING=1.
+
+Each request records how long it spent in these stages:
+  sql       statements run on the connection from get_db_connection
+  template  top-level Jinja rendering
+  analyze   analyze_symptoms
+  session   loading and saving the server-side session
+The times go out in a Server-Timing header and into per-endpoint
+histograms. Those histograms are served in Prometheus text format at
+/metrics, to local clients only.
+
+Statements are also counted by their SQL text. When one statement runs
+PROFILING_N_PLUS_ONE times or more in a single request, a warning is
+logged; that usually means a query inside a loop. A PROFILING_SAMPLE_RATE
+fraction of requests runs under cProfile. A trace is kept in
+PROFILING_DIR only when its request took longer than PROFILING_SLOW_MS;
+open it with `python -m pstats`.
+
+Metrics are per worker process; with several gunicorn workers each scrape
+sees the worker that answered it. With PROFILING unset, init_app,
+wrap() and traced() add no overhead.
+"""
+import cProfile
+import glob
+import os
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import (Response, abort, before_render_template, g, has_request_context, request,
+                   request_finished, template_rendered)
+
+ENABLED = os.environ.get("PROFILING", "0") == "1"
+SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0.01"))
+SLOW_MS = float(os.environ.get("PROFILING_SLOW_MS", "500"))
+PROFILE_DIR = os.environ.get("PROFILING_DIR", "profiles")
+PROFILES_KEPT = 50
+N_PLUS_ONE = int(os.environ.get("PROFILING_N_PLUS_ONE", "10"))
+
+STAGES = ("sql", "template", "analyze", "recommend", "session")
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+LOCAL_ADDRS = {"127.0.0.1", "::1"}
+UNPROFILED_ENDPOINTS = {"metrics", "static", "static_dist"}
+
+
+# ---------------- METRICS ----------------
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, labels, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                labels = _labels(self.labels, label_values)
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {n}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{labels}}} {total}")
+                lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+class Gauge:
+    """A value read from a callback at scrape time."""
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+def _labels(names, values):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+request_seconds = Histogram(
+    "telemed_request_duration_seconds", "Request wall time.", ("endpoint", "method"))
+stage_seconds = Histogram(
+    "telemed_stage_duration_seconds", "Time per request spent in each stage.", ("endpoint", "stage"))
+sql_per_request = Histogram(
+    "telemed_sql_statements_per_request", "SQL statements executed per request.", ("endpoint",),
+    buckets=COUNT_BUCKETS)
+responses = Counter("telemed_responses_total", "Responses by status code.", ("endpoint", "status"))
+n_plus_one = Counter(
+    "telemed_n_plus_one_total", "Requests that repeated one statement N_PLUS_ONE times or more.",
+    ("endpoint",))
+profiles_saved = Counter("telemed_slow_profiles_total", "cProfile traces kept for slow requests.",
+                         ("endpoint",))
+
+METRICS = [request_seconds, stage_seconds, sql_per_request, responses, n_plus_one, profiles_saved]
+
+
+def register(*metrics):
+    """Add other modules' metrics to /metrics."""
+    METRICS.extend(metrics)
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------- REQUEST PROFILE ----------------
+
+class RequestProfile:
+    __slots__ = ("started", "stages", "statements", "sql_count", "template_started", "profiler")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.statements = {}
+        self.sql_count = 0
+        self.template_started = None
+        self.profiler = None
+
+    def add(self, stage, seconds):
+        self.stages[stage] += seconds
+
+    def statement(self, sql, seconds):
+        self.stages["sql"] += seconds
+        self.sql_count += 1
+        self.statements[sql] = self.statements.get(sql, 0) + 1
+
+
+def _profile():
+    """This request's profile, created on first use (the session is opened
+    before any before_request hook runs)."""
+    profile = g.get("_profile")
+    if profile is None:
+        profile = g._profile = RequestProfile()
+    return profile
+
+
+class ProfiledCursor:
+    """Times row fetching on top of the initial execute()."""
+
+    def __init__(self, cursor, profile):
+        self._cursor = cursor
+        self._profile = profile
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._profile.add("sql", time.perf_counter() - started)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ProfiledConnection:
+    """Counts and times every statement run through the wrapped connection."""
+
+    def __init__(self, conn, profile):
+        self._conn = conn
+        self._profile = profile
+
+    def _run(self, fn, sql, *args):
+        started = time.perf_counter()
+        try:
+            cursor = fn(sql, *args)
+        finally:
+            self._profile.statement(" ".join(sql.split()), time.perf_counter() - started)
+        return ProfiledCursor(cursor, self._profile)
+
+    def execute(self, sql, params=()):
+        return self._run(self._conn.execute, sql, params)
+
+    def executemany(self, sql, seq):
+        return self._run(self._conn.executemany, sql, seq)
+
+    def executescript(self, script):
+        return self._run(self._conn.executescript, script)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        # The commit (or rollback) is SQL time too
+        started = time.perf_counter()
+        try:
+            return self._conn.__exit__(*exc)
+        finally:
+            self._profile.add("sql", time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def wrap(conn):
+    """Return conn wrapped for SQL accounting while profiling a request."""
+    if not ENABLED or not has_request_context():
+        return conn
+    wrapped = g.get("_profiled_conn")
+    if wrapped is None or wrapped._conn is not conn:
+        wrapped = g._profiled_conn = ProfiledConnection(conn, _profile())
+    return wrapped
+
+
+def traced(stage):
+    """Decorator that adds a function's run time to `stage`."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            if not has_request_context():
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _profile().add(stage, time.perf_counter() - started)
+        return timed
+    return decorator
+
+
+class ProfiledSessionInterface:
+    """Delegates to the real session interface, timing open and save."""
+
+    def __init__(self, inner):
+        self._inner = inner
+
+    def open_session(self, app, request):
+        started = time.perf_counter()
+        try:
+            return self._inner.open_session(app, request)
+        finally:
+            _profile().add("session", time.perf_counter() - started)
+
+    def save_session(self, app, session, response):
+        started = time.perf_counter()
+        try:
+            return self._inner.save_session(app, session, response)
+        finally:
+            _profile().add("session", time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+# ---------------- SLOW-REQUEST TRACES ----------------
+
+# Python 3.12+ allows one active cProfile per process, so sample one at a time
+_profiler_lock = threading.Lock()
+
+
+def _start_sampling(profile):
+    if random.random() >= SAMPLE_RATE or not _profiler_lock.acquire(blocking=False):
+        return
+    profile.profiler = cProfile.Profile()
+    profile.profiler.enable()
+
+
+def _stop_sampling(profile, endpoint, elapsed):
+    profiler, profile.profiler = profile.profiler, None
+    if profiler is None:
+        return
+    profiler.disable()
+    _profiler_lock.release()
+    if elapsed * 1000 < SLOW_MS:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{int(elapsed * 1000)}ms-{os.getpid()}.prof"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    profiles_saved.inc((endpoint,))
+    for old in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.prof")), key=os.path.getmtime)[:-PROFILES_KEPT]:
+        os.remove(old)
+
+
+# ---------------- APP WIRING ----------------
+
+def init_app(app):
+    if not ENABLED:
+        return
+
+    app.session_interface = ProfiledSessionInterface(app.session_interface)
+
+    @app.route("/metrics")
+    def metrics():
+        if request.remote_addr not in LOCAL_ADDRS:
+            abort(404)
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint not in UNPROFILED_ENDPOINTS:
+            _start_sampling(_profile())
+
+    def template_started(sender, template, context, **extra):
+        _profile().template_started = time.perf_counter()
+
+    def template_done(sender, template, context, **extra):
+        profile = _profile()
+        if profile.template_started is not None:
+            profile.add("template", time.perf_counter() - profile.template_started)
+            profile.template_started = None
+
+    @app.after_request
+    def server_timing(response):
+        profile = g.get("_profile")
+        if profile is not None:
+            response.headers["Server-Timing"] = ", ".join(
+                f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in profile.stages.items())
+        return response
+
+    def finish(sender, response, **extra):
+        # Sent after the session is saved, so every stage is complete
+        profile = g.get("_profile")
+        endpoint = request.endpoint or "unmatched"
+        if profile is None or endpoint in UNPROFILED_ENDPOINTS:
+            return
+        elapsed = time.perf_counter() - profile.started
+        _stop_sampling(profile, endpoint, elapsed)
+
+        request_seconds.observe((endpoint, request.method), elapsed)
+        for stage, seconds in profile.stages.items():
+            stage_seconds.observe((endpoint, stage), seconds)
+        sql_per_request.observe((endpoint,), profile.sql_count)
+        responses.inc((endpoint, response.status_code))
+
+        repeated = [(n, sql) for sql, n in profile.statements.items() if n >= N_PLUS_ONE]
+        if repeated:
+            n_plus_one.inc((endpoint,))
+            for n, sql in sorted(repeated, reverse=True):
+                app.logger.warning("Possible N+1 in %s: %d x %s", endpoint, n, sql)
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        # If the request died before request_finished, don't leave cProfile running
+        profile = g.get("_profile")
+        if profile is not None and profile.profiler is not None:
+            profile.profiler.disable()
+            profile.profiler = None
+            _profiler_lock.release()
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_done, app, weak=False)
+    request_finished.connect(finish, app, weak=False)
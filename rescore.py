@@ -0,0 +1,81 @@
+"""Re-score consultations.result with the current triage rules.
+
+    python rescore.py [--batch 1000] [--clinic north | --db database.db]
+
+Rows are read in id order one batch at a time and written back with one
+executemany per batch, each in its own short transaction, so memory stays
+flat and live requests only ever wait on a single batch. Consultations
+stored without a result (the patient declined AI analysis) are skipped.
+"""
+import argparse
+import json
+import sys
+import time
+
+import database
+import tenants
+from ml_engine import analyze_symptoms_batch
+
+
+def rescore(conn, batch_size=1000, start_id=0, report=None):
+    """Re-score every consultation with id > start_id, except those where
+    the patient declined AI analysis (result IS NULL).
+
+    Returns (rows scanned, rows changed). Rows whose stored result already
+    matches are not rewritten.
+    """
+    last_id = start_id
+    scanned = changed = 0
+    started = time.perf_counter()
+
+    while True:
+        rows = conn.execute("""
+            SELECT id, symptoms, result FROM consultations
+            WHERE id > ? AND result IS NOT NULL
+            ORDER BY id
+            LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+
+        (results,) = analyze_symptoms_batch((row["symptoms"] for row in rows), chunk_size=len(rows))
+        updates = []
+        for row, result in zip(rows, results):
+            encoded = json.dumps(result, ensure_ascii=False)
+            if encoded != row["result"]:
+                updates.append((encoded, row["id"]))
+
+        with conn:
+            conn.executemany("UPDATE consultations SET result=? WHERE id=?", updates)
+
+        last_id = rows[-1]["id"]
+        scanned += len(rows)
+        changed += len(updates)
+        if report:
+            report(scanned, changed, last_id, time.perf_counter() - started)
+
+    return scanned, changed
+
+
+def print_progress(scanned, changed, last_id, elapsed):
+    rate = scanned / elapsed if elapsed else 0.0
+    print(f"\r{scanned} rows ({changed} changed) up to id {last_id}, {rate:,.0f} rows/s",
+          end="", file=sys.stderr, flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score consultations with the current triage rules.")
+    tenants.add_arguments(parser)
+    parser.add_argument("--batch", type=int, default=1000, help="rows per transaction")
+    parser.add_argument("--start-id", type=int, default=0, help="resume after this consultation id")
+    args = parser.parse_args()
+
+    conn = database.connect(tenants.cli_path(parser, args))
+    started = time.perf_counter()
+    scanned, changed = rescore(conn, args.batch, args.start_id, report=print_progress)
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(file=sys.stderr)
+    print(f"Re-scored {scanned} consultations, {changed} updated in {elapsed:.1f}s "
+          f"({scanned / elapsed if elapsed else 0:,.0f} rows/s).")
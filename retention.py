@@ -0,0 +1,320 @@
+"""Move old rows out of the live database in small, resumable batches.
+
+    python retention.py purge --before 2025-01-01 --to-dir archive/
+    python retention.py purge --older-than 365 --to-db archive.db [--tables messages]
+    python retention.py purge --older-than 365 --dry-run
+    python retention.py enable-incremental-vacuum
+
+Each batch is its own BEGIN IMMEDIATE transaction. The batch's rows are
+read, written to the archive, deleted, and the per-table checkpoint is
+advanced, then the write lock is released. Live requests therefore only
+ever wait on one batch, never on the whole run. After each batch the tool
+sleeps for --pause seconds and runs PRAGMA incremental_vacuum, so freed
+pages go back to the filesystem as it goes. This needs auto_vacuum=
+INCREMENTAL; enable-incremental-vacuum converts an existing file once
+(a full VACUUM, so run it in a maintenance window).
+
+Archives are either gzipped JSON Lines files, one per batch and named by
+id range (--to-dir), or tables of the same name in a separate SQLite
+database (--to-db). Either way the batch is durably written, in its own
+commit, before the delete commits, and rewriting it is idempotent per row
+id. (Attaching the archive and committing both in one transaction would
+not be atomic across the two files in WAL mode.) An interrupted run may
+leave the last batch archived but not deleted; re-running with the same
+cutoff resumes from the checkpoint and rewrites it. --older-than counts
+from midnight, so runs on the same day share a cutoff and can resume.
+
+Rollup counts of archived appointments and consultations are kept (see
+database migration 7). `python analytics.py rebuild` recomputes rollups
+from live rows only, so it drops the archived history.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import database
+import tenants
+
+# Table -> the timestamp column that decides a row's age. users has no
+# timestamp and is never purged by age.
+TABLES = {
+    "appointments": "appointment_date",
+    "consultations": "date",
+    "messages": "timestamp",
+}
+
+DEFAULT_BATCH = 500
+DEFAULT_PAUSE = 0.05
+DEFAULT_VACUUM_PAGES = 256
+
+
+def cutoff_from(before=None, older_than_days=None):
+    """Normalise --before / --older-than to 'YYYY-MM-DD HH:MM:SS'.
+    Raises ValueError for anything else."""
+    if before:
+        return datetime.fromisoformat(before).strftime("%Y-%m-%d %H:%M:%S")
+    if older_than_days is not None and older_than_days >= 0:
+        # Whole days, so the checkpoint still matches when re-run later today
+        return (datetime.now() - timedelta(days=older_than_days)).strftime("%Y-%m-%d 00:00:00")
+    raise ValueError("Give a cutoff with --before or --older-than")
+
+
+# ---------------- ARCHIVES ----------------
+
+class FileArchive:
+    """One gzipped JSON Lines file per batch: DIR/table/FIRST-LAST.jsonl.gz."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def prepare(self, conn, table, columns):
+        os.makedirs(os.path.join(self.directory, table), exist_ok=True)
+
+    def write(self, conn, table, columns, rows):
+        path = os.path.join(self.directory, table, f"{rows[0]['id']:010d}-{rows[-1]['id']:010d}.jsonl.gz")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False).encode() + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    def close(self, conn):
+        pass
+
+
+class DatabaseArchive:
+    """Tables of the same name in another database file, keyed by id.
+
+    Written through its own connection, so each batch commits (with
+    synchronous=FULL) before the live database's delete does.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+
+    def prepare(self, conn, table, columns):
+        if self.conn is None:
+            self.conn = database.connect(self.path)
+            self.conn.execute("PRAGMA synchronous=FULL")
+        existing = [r["name"] for r in self.conn.execute(f"PRAGMA table_info({table})")]
+        with self.conn:
+            if not existing:
+                rest = ", ".join(c for c in columns if c != "id")
+                self.conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, {rest}, "
+                                  f"archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+            else:
+                # Columns added to the live table since the archive was created
+                for column in columns:
+                    if column not in existing:
+                        self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+
+    def write(self, conn, table, columns, rows):
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                [tuple(row) for row in rows],
+            )
+        return 0
+
+    def close(self, conn):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# ---------------- PURGE ----------------
+
+def checkpoint(conn, table, cutoff):
+    # Resume point of an earlier run with the same cutoff, else the start
+    row = conn.execute("SELECT cutoff, last_id FROM retention_checkpoints WHERE table_name=?",
+                       (table,)).fetchone()
+    return row["last_id"] if row and row["cutoff"] == cutoff else 0
+
+
+def pending(conn, table, cutoff, after_id=0):
+    """(rows, first id, last id) of table older than cutoff past after_id."""
+    row = conn.execute(f"""
+        SELECT COUNT(*), MIN(id), MAX(id) FROM {table}
+        WHERE id > ? AND julianday({TABLES[table]}) < julianday(?)
+    """, (after_id, cutoff)).fetchone()
+    return tuple(row)
+
+
+def incremental_vacuum(conn, pages):
+    """Release up to `pages` free pages; returns how many were released."""
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def purge_table(conn, table, cutoff, archive, batch_size=DEFAULT_BATCH, pause=DEFAULT_PAUSE,
+                vacuum_pages=DEFAULT_VACUUM_PAGES, restart=False, report=None):
+    """Archive and delete every row of table older than cutoff, one batch
+    per transaction. Returns a stats dict (rows, batches, bytes, pages)."""
+    column = TABLES[table]
+    columns = [r["name"] for r in conn.execute(f"PRAGMA table_info({table})")]
+    archive.prepare(conn, table, columns)
+    last_id = 0 if restart else checkpoint(conn, table, cutoff)
+    stats = {"table": table, "rows": 0, "batches": 0, "bytes": 0, "pages": 0, "seconds": 0.0}
+    started = time.perf_counter()
+
+    while True:
+        # Find the next batch without holding any lock (WAL readers never block)
+        ids = conn.execute(f"""
+            SELECT id FROM {table}
+            WHERE id > ? AND julianday({column}) < julianday(?)
+            ORDER BY id
+            LIMIT ?
+        """, (last_id, cutoff, batch_size)).fetchall()
+        if not ids:
+            break
+        first, last = ids[0]["id"], ids[-1]["id"]
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read under the lock; the same predicate is deleted below
+            rows = conn.execute(f"""
+                SELECT {', '.join(columns)} FROM {table}
+                WHERE id BETWEEN ? AND ? AND julianday({column}) < julianday(?)
+                ORDER BY id
+            """, (first, last, cutoff)).fetchall()
+            if rows:
+                # Durable in the archive (its own commit) before the delete below
+                stats["bytes"] += archive.write(conn, table, columns, rows)
+                conn.execute("INSERT INTO retention_purge (active) VALUES (1)")
+                conn.execute(f"""
+                    DELETE FROM {table}
+                    WHERE id BETWEEN ? AND ? AND julianday({column}) < julianday(?)
+                """, (first, last, cutoff))
+                conn.execute("DELETE FROM retention_purge")
+            conn.execute("""
+                INSERT INTO retention_checkpoints (table_name, cutoff, last_id, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (table_name) DO UPDATE
+                SET cutoff=excluded.cutoff, last_id=excluded.last_id, updated_at=excluded.updated_at
+            """, (table, cutoff, last))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+        last_id = last
+        stats["rows"] += len(rows)
+        stats["batches"] += 1
+        if vacuum_pages:
+            stats["pages"] += incremental_vacuum(conn, vacuum_pages)
+        stats["seconds"] = time.perf_counter() - started
+        if report:
+            report(stats, last_id)
+        if pause:
+            time.sleep(pause)
+
+    if vacuum_pages:
+        # Whatever the per-batch steps left behind
+        stats["pages"] += incremental_vacuum(conn, 0)
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def print_progress(stats, last_id):
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"\r{stats['table']}: {stats['rows']:,} rows in {stats['batches']} batches up to id {last_id}, "
+          f"{rate:,.0f} rows/s", end="", file=sys.stderr, flush=True)
+
+
+def enable_incremental_vacuum(conn):
+    """Switch the file to auto_vacuum=INCREMENTAL. Takes a full VACUUM,
+    which locks the database for its duration."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and purge old rows in small batches")
+    tenants.add_arguments(parser)
+    sub = parser.add_subparsers(dest="command", required=True)
+    purge = sub.add_parser("purge")
+    when = purge.add_mutually_exclusive_group(required=True)
+    when.add_argument("--before", help="purge rows dated before this ISO date/time")
+    when.add_argument("--older-than", type=int, metavar="DAYS", help="purge rows older than DAYS days, counted from midnight")
+    to = purge.add_mutually_exclusive_group()
+    to.add_argument("--to-dir", help="write gzipped JSON Lines archives here")
+    to.add_argument("--to-db", help="append to tables in this SQLite archive")
+    purge.add_argument("--tables", default=",".join(TABLES), help="comma-separated, default: all")
+    purge.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="rows per transaction")
+    purge.add_argument("--pause", type=float, default=DEFAULT_PAUSE, help="seconds to yield between batches")
+    purge.add_argument("--vacuum-pages", type=int, default=DEFAULT_VACUUM_PAGES,
+                       help="free pages to release after each batch (0: none)")
+    purge.add_argument("--restart", action="store_true", help="ignore saved checkpoints")
+    purge.add_argument("--dry-run", action="store_true", help="only report what would be purged")
+    sub.add_parser("enable-incremental-vacuum")
+    args = parser.parse_args()
+
+    conn = database.connect(tenants.cli_path(parser, args))
+    database.migrate(conn)
+
+    if args.command == "enable-incremental-vacuum":
+        changed = enable_incremental_vacuum(conn)
+        print("auto_vacuum is now INCREMENTAL." if changed else "auto_vacuum was already INCREMENTAL.")
+        conn.close()
+        return 0
+
+    tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+    unknown = [t for t in tables if t not in TABLES]
+    if unknown:
+        parser.error(f"unknown table(s): {', '.join(unknown)}; choose from {', '.join(TABLES)}")
+    try:
+        cutoff = cutoff_from(args.before, args.older_than)
+    except ValueError as e:
+        parser.error(str(e))
+    if not (args.dry_run or args.to_dir or args.to_db):
+        parser.error("give --to-dir or --to-db (or --dry-run)")
+
+    print(f"Cutoff: {cutoff}")
+    if args.dry_run:
+        for table in tables:
+            after = 0 if args.restart else checkpoint(conn, table, cutoff)
+            count, first, last = pending(conn, table, cutoff, after)
+            batches = -(-count // args.batch)
+            print(f"  {table:<14} {count:>10,} rows" + (f" (ids {first}..{last}, {batches} batches)" if count else ""))
+        conn.close()
+        return 0
+
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        print("Note: auto_vacuum is not INCREMENTAL, so freed pages stay in the file; "
+              "see `retention.py enable-incremental-vacuum`.", file=sys.stderr)
+        args.vacuum_pages = 0
+
+    archive = FileArchive(args.to_dir) if args.to_dir else DatabaseArchive(args.to_db)
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    try:
+        for table in tables:
+            stats = purge_table(conn, table, cutoff, archive, args.batch, args.pause,
+                                args.vacuum_pages, args.restart, report=print_progress)
+            if stats["batches"]:
+                print(file=sys.stderr)
+            rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+            print(f"  {table:<14} {stats['rows']:>10,} rows archived in {stats['seconds']:.1f}s "
+                  f"({rate:,.0f} rows/s), {stats['bytes'] / 1e6:.1f} MB written, "
+                  f"{stats['pages'] * page_size / 1e6:.1f} MB released")
+    finally:
+        archive.close(conn)
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""Doctor availability, free-slot search and conflict-free booking.
+
+A doctor's week is a set of availability windows (weekday, start, end,
+slot length) in doctor_availability. Doctors who haven't set any get
+DEFAULT_AVAILABILITY. A booked appointment holds [slot_start, slot_end).
+Triggers mirror it into the appointment_slots R*Tree (database migration
+6), keyed by time and by the doctor's users.id. So finding one doctor's
+bookings in a date range is a box query on that index, however many
+appointments exist.
+
+reserve() checks for an overlap and inserts inside BEGIN IMMEDIATE. SQLite
+allows only one such writer at a time, so two requests for the same slot
+are serialized and the second sees the first booking and gets SlotTaken.
+"""
+import bisect
+import heapq
+from datetime import datetime, time, timedelta, timezone
+from itertools import islice
+
+import directory
+
+SLOT_FORMAT = "%Y-%m-%d %H:%M"
+SEARCH_DAYS = 14
+
+# Mon-Fri 09:00-17:00 in 30-minute slots: (weekday, start_minute, end_minute, slot_minutes)
+DEFAULT_AVAILABILITY = [(weekday, 9 * 60, 17 * 60, 30) for weekday in range(5)]
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+class SlotTaken(Exception):
+    """Another booking already holds (part of) the requested slot."""
+
+
+class InvalidSlot(ValueError):
+    """The requested time isn't one of the doctor's bookable slots."""
+
+
+def _epoch_minutes(dt):
+    # Naive local times throughout, the same reading strftime('%s') gives them in SQL
+    return int(dt.replace(tzinfo=timezone.utc).timestamp()) // 60
+
+
+# ---------------- AVAILABILITY ----------------
+
+def availability(conn, doctor_username):
+    rows = conn.execute("""
+        SELECT weekday, start_minute, end_minute, slot_minutes
+        FROM doctor_availability
+        WHERE doctor_username=?
+        ORDER BY weekday, start_minute
+    """, (doctor_username,)).fetchall()
+    return [tuple(row) for row in rows] or list(DEFAULT_AVAILABILITY)
+
+
+def set_availability(conn, doctor_username, windows):
+    """Replace a doctor's weekly windows; raises ValueError on bad input."""
+    for weekday, start, end, length in windows:
+        if not (0 <= weekday <= 6 and 0 <= start < end <= 1440 and 5 <= length <= 480):
+            raise ValueError("Invalid availability window")
+        if end - start < length:
+            raise ValueError(f"{WEEKDAYS[weekday]} is shorter than one slot")
+    with conn:
+        conn.execute("DELETE FROM doctor_availability WHERE doctor_username=?", (doctor_username,))
+        conn.executemany("""
+            INSERT INTO doctor_availability (doctor_username, weekday, start_minute, end_minute, slot_minutes)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(doctor_username, *window) for window in windows])
+
+
+# ---------------- FREE SLOTS ----------------
+
+def _busy(conn, doctor_ids, start, end):
+    """Booked intervals overlapping [start, end) of each of doctor_ids,
+    merged and sorted, as {doctor id: (starts, intervals)} in epoch
+    minutes. One box query spans every doctor id between the lowest and
+    highest; bookings of doctors in that range but not asked for are
+    dropped here."""
+    wanted = set(doctor_ids)
+    busy = {doctor_id: [] for doctor_id in wanted}
+    if not wanted:
+        return {}
+    rows = conn.execute("""
+        SELECT doctor_min, start_min, end_min FROM appointment_slots
+        WHERE doctor_min <= ? AND doctor_max >= ? AND start_min < ? AND end_min > ?
+        ORDER BY start_min
+    """, (max(wanted), min(wanted), _epoch_minutes(end), _epoch_minutes(start))).fetchall()
+    for doctor_id, s, e in rows:
+        merged = busy.get(doctor_id)
+        if merged is None:
+            continue
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return {doctor_id: ([s for s, _ in merged], merged) for doctor_id, merged in busy.items()}
+
+
+def _is_free(busy, start, end):
+    starts, intervals = busy
+    i = bisect.bisect_left(starts, end) - 1
+    return i < 0 or intervals[i][1] <= start
+
+
+def _doctor_slots(doctor, windows, busy, start, end):
+    """Free slots of one doctor in [start, end), in time order."""
+    day = start.date()
+    while day < end.date() + timedelta(days=1):
+        base = datetime.combine(day, time())
+        slots = sorted(
+            (base + timedelta(minutes=m), length)
+            for weekday, s, e, length in windows if weekday == day.weekday()
+            for m in range(s, e - length + 1, length)
+        )
+        for slot_start, length in slots:
+            slot_end = slot_start + timedelta(minutes=length)
+            if slot_start < start or slot_end > end:
+                continue
+            if _is_free(busy, _epoch_minutes(slot_start), _epoch_minutes(slot_end)):
+                yield {
+                    "start": slot_start.strftime(SLOT_FORMAT),
+                    "end": slot_end.strftime(SLOT_FORMAT),
+                    "doctor_username": doctor["username"],
+                    "fullname": doctor["fullname"],
+                }
+        day += timedelta(days=1)
+
+
+def _windows_by_doctor(conn, usernames):
+    if not usernames:
+        return {}
+    rows = conn.execute(f"""
+        SELECT doctor_username, weekday, start_minute, end_minute, slot_minutes
+        FROM doctor_availability
+        WHERE doctor_username IN ({','.join('?' * len(usernames))})
+    """, usernames).fetchall()
+    windows = {}
+    for row in rows:
+        windows.setdefault(row[0], []).append(tuple(row[1:]))
+    return windows
+
+
+def next_free_slots(conn, doctors, n, start=None, days=SEARCH_DAYS):
+    """The n earliest free slots across `doctors` (directory rows) from
+    `start` (default: now) over the next `days` days."""
+    start = start or datetime.now()
+    end = start + timedelta(days=days)
+    windows = _windows_by_doctor(conn, [d["username"] for d in doctors])
+    busy = _busy(conn, [d["id"] for d in doctors], start, end)
+    streams = [
+        _doctor_slots(d, windows.get(d["username"]) or DEFAULT_AVAILABILITY, busy[d["id"]], start, end)
+        for d in doctors
+    ]
+    return list(islice(heapq.merge(*streams, key=lambda slot: slot["start"]), n))
+
+
+def free_slots_for_specialization(conn, specialization, n, start=None, days=SEARCH_DAYS):
+    return next_free_slots(conn, directory.doctors(conn, specialization), n, start, days)
+
+
+# ---------------- BOOKING ----------------
+
+def _slot_length(windows, slot_start):
+    # Length of the availability slot starting exactly at slot_start, if any
+    minute = slot_start.hour * 60 + slot_start.minute
+    for weekday, start, end, length in windows:
+        if (weekday == slot_start.weekday() and start <= minute <= end - length
+                and (minute - start) % length == 0):
+            return length
+    return None
+
+
+def reserve(conn, patient, doctor, specialization, slot_start, medical_info):
+    """Book `slot_start` ("YYYY-MM-DD HH:MM") with `doctor` (a directory
+    row). Returns the new appointment id; raises InvalidSlot or SlotTaken."""
+    try:
+        start = datetime.strptime(slot_start.replace("T", " "), SLOT_FORMAT)
+    except ValueError:
+        raise InvalidSlot("Please choose one of the listed times")
+    if start < datetime.now():
+        raise InvalidSlot("That time has already passed")
+    length = _slot_length(availability(conn, doctor["username"]), start)
+    if length is None:
+        raise InvalidSlot("The doctor is not available at that time")
+    end = start + timedelta(minutes=length)
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        clash = conn.execute("""
+            SELECT 1 FROM appointment_slots
+            WHERE doctor_min <= ? AND doctor_max >= ? AND start_min < ? AND end_min > ?
+            LIMIT 1
+        """, (doctor["id"], doctor["id"], _epoch_minutes(end), _epoch_minutes(start))).fetchone()
+        if clash:
+            raise SlotTaken("That slot has just been booked; please pick another")
+        cursor = conn.execute("""
+            INSERT INTO appointments
+            (patient_username, doctor_username, specialization, medical_info, appointment_date, status,
+             slot_start, slot_end)
+            VALUES (?, ?, ?, ?, ?, 'Pending', ?, ?)
+        """, (patient, doctor["username"], specialization, medical_info,
+              start.strftime(SLOT_FORMAT), start.strftime(SLOT_FORMAT), end.strftime(SLOT_FORMAT)))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return cursor.lastrowid
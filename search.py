@@ -0,0 +1,155 @@
+"""Full-text case search over consultations.symptoms and appointments.medical_info.
+
+    python search.py [--clinic north | --db database.db] rebuild [--chunk 50000]
+    python search.py [--clinic north | --db database.db] query DOCTOR "chest pain left arm"
+
+The case_search FTS5 table (database migration 4) is kept in sync by
+triggers. rebuild empties it and refills it from the source tables in
+chunks, then merges the index segments. Use it after bulk loads that
+bypassed the triggers, or to repair the index.
+
+A doctor sees their own appointments, plus consultations from patients
+who have booked with them. That access list is stored in the index
+itself, so a query only ranks that doctor's matching cases.
+"""
+import argparse
+import re
+import sys
+import time
+
+from markupsafe import Markup, escape
+
+import database
+import tenants
+
+PAGE_SIZE = 20
+MAX_PAGE = 50
+SNIPPET_TOKENS = 16
+
+# Private-use characters mark matches in snippets; the text is escaped
+# first and they become <mark> afterwards, so stored text can't inject HTML
+_HIT_START, _HIT_END = "\ue000", "\ue001"
+_TERMS = re.compile(r'"([^"]+)"|(\w+)')
+
+
+def build_query(text):
+    """Turn free text into an FTS5 query: every word (or "quoted phrase")
+    must appear, and the last word also matches as a prefix. Returns None
+    when there is nothing to search for."""
+    terms = []
+    for phrase, word in _TERMS.findall(text or ""):
+        words = re.findall(r"\w+", phrase or word)
+        if words:
+            terms.append('"' + " ".join(words) + '"')
+    if not terms:
+        return None
+    if not text.rstrip().endswith('"'):
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def highlight(snippet):
+    return Markup(str(escape(snippet)).replace(_HIT_START, "<mark>").replace(_HIT_END, "</mark>"))
+
+
+def owner_token(username):
+    # Matches 'u' || hex(username) in the migration's SQL: one alphanumeric
+    # token per user, whatever characters the username contains
+    return "u" + username.encode().hex().upper()
+
+
+def search(conn, doctor, text, page=1, page_size=PAGE_SIZE):
+    """Best-ranked page of cases matching text for doctor.
+
+    Returns (results, has_more); each result has kind, source_id,
+    patient_username, date, score and an HTML-safe snippet.
+    """
+    query = build_query(text)
+    if query is None:
+        return [], False
+    page = max(1, min(page, MAX_PAGE))
+    rows = conn.execute(f"""
+        SELECT kind, source_id, patient_username, date,
+               snippet(case_search, 0, '{_HIT_START}', '{_HIT_END}', '…', {SNIPPET_TOKENS}) AS snippet,
+               bm25(case_search, 1.0, 0.0) AS score
+        FROM case_search
+        WHERE case_search MATCH ?
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    """, (f"owners:{owner_token(doctor)} AND body:({query})", page_size + 1, (page - 1) * page_size)).fetchall()
+
+    results = [dict(row, snippet=highlight(row["snippet"])) for row in rows[:page_size]]
+    return results, len(rows) > page_size
+
+
+# ---------------- BULK BUILD ----------------
+
+# (table, rowid, body, owners, kind, date) expressions, as in the migration
+SOURCES = [
+    ("appointments", "id * 2 + 1", "medical_info", "'u' || hex(doctor_username)", "'appointment'",
+     "appointment_date"),
+    ("consultations", "id * 2", "symptoms", """(SELECT group_concat(DISTINCT 'u' || hex(a.doctor_username))
+        FROM appointments a WHERE a.patient_username = consultations.patient_username)""", "'consultation'",
+     "date"),
+]
+
+
+def rebuild(conn, chunk=50000, report=None):
+    """Refill case_search from scratch, one id range per transaction.
+    Returns the number of rows indexed."""
+    with conn:
+        conn.execute("DELETE FROM case_search")
+    total = 0
+    for table, rowid, body, owners, kind, date in SOURCES:
+        last_id = 0
+        while True:
+            with conn:
+                cursor = conn.execute(f"""
+                    INSERT INTO case_search (rowid, body, owners, kind, source_id, patient_username, date)
+                    SELECT {rowid}, {body}, {owners}, {kind}, id, patient_username, {date}
+                    FROM {table}
+                    WHERE id > ? AND id <= ?
+                """, (last_id, last_id + chunk))
+                count = cursor.rowcount
+            more = conn.execute(f"SELECT 1 FROM {table} WHERE id > ? LIMIT 1", (last_id + chunk,)).fetchone()
+            total += count
+            last_id += chunk
+            if report:
+                report(table, total)
+            if more is None:
+                break
+    with conn:
+        conn.execute("INSERT INTO case_search (case_search) VALUES ('optimize')")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Case search index tools")
+    tenants.add_arguments(parser)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("rebuild")
+    build.add_argument("--chunk", type=int, default=50000)
+    query = sub.add_parser("query")
+    query.add_argument("doctor")
+    query.add_argument("text")
+    query.add_argument("--page", type=int, default=1)
+    args = parser.parse_args()
+
+    conn = database.connect(tenants.cli_path(parser, args))
+    started = time.perf_counter()
+    if args.command == "rebuild":
+        total = rebuild(conn, args.chunk,
+                        report=lambda table, n: print(f"\r{table}: {n:,} rows indexed", end="", flush=True))
+        elapsed = time.perf_counter() - started
+        print(f"\nIndexed {total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+    else:
+        results, more = search(conn, args.doctor, args.text, args.page)
+        elapsed = (time.perf_counter() - started) * 1000
+        for r in results:
+            print(f"{r['score']:8.2f}  {r['kind']:<12} #{r['source_id']:<8} {r['patient_username']:<16} {r['snippet']}")
+        print(f"{len(results)} results{' (more)' if more else ''} in {elapsed:.1f} ms")
+    conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,154 @@
 import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Any werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# Changing it rehashes each user's password on their next successful login.
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+
+# KDF work runs here, off the request thread; hashlib releases the GIL so
+# threads give real parallelism. Waiting work beyond the queue is refused.
+HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "4"))
+HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", "16"))
+HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", "5"))
+
+_LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated; callers should ask the
+    client to retry rather than queue more KDF work."""
+
+
+# ---------------- HASHING ----------------
+
+def _method_prefix(method):
+    # Normalize e.g. "scrypt" to "scrypt:32768:8:1", as werkzeug writes it
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
+
+CURRENT_PREFIX = _method_prefix(PASSWORD_HASH_METHOD)
+
+# Verified when the username doesn't exist, so unknown and known users cost the same
+DUMMY_HASH = generate_password_hash("dummy-password", method=PASSWORD_HASH_METHOD)
+
 
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
 
 def verify_password(password, hashed):
-    return hash_password(password) == hashed
+    if _LEGACY_SHA256.match(hashed):
+        # Unsalted SHA-256 from the original helper; accepted once, then rehashed
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, hashed)
+    return check_password_hash(hashed, password)
+
+
+def needs_rehash(hashed):
+    return hashed.split("$", 1)[0] != CURRENT_PREFIX
+
+
+class HashPool:
+    """Bounded executor for password hashing and verification."""
+
+    def __init__(self, workers=HASH_WORKERS, queue_size=HASH_QUEUE):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._pid = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # One executor per forked worker process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="pwhash")
+                    self._pid = os.getpid()
+        return self._executor
+
+    def run(self, fn, *args, timeout=HASH_TIMEOUT):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            # Queued too long behind other KDF work: same answer as a full queue
+            raise HasherBusy() from None
+
+
+pool = HashPool()
+
+
+def check_login(password, hashed):
+    """Verify on the hash pool. hashed=None (unknown user) checks against
+    DUMMY_HASH and always fails. Raises HasherBusy when saturated."""
+    if hashed is None:
+        pool.run(verify_password, password, DUMMY_HASH)
+        return False
+    return pool.run(verify_password, password, hashed)
+
+
+def hash_password_pooled(password):
+    return pool.run(hash_password, password)
+
+
+# ---------------- RATE LIMITING ----------------
+
+class TokenBucketLimiter:
+    """In-memory token buckets keyed by e.g. ("ip", addr) or ("user", name).
+
+    Each key holds up to `burst` tokens and regains `rate` per second. The
+    number of tracked keys is LRU-bounded so a spray of spoofed usernames
+    can't grow memory without limit.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, stamp = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - stamp) * self.rate)
+
+    def available(self, key):
+        with self._lock:
+            return self._tokens(key, time.monotonic()) >= 1
+
+    def hit(self, key):
+        """Take one token; returns False (and takes nothing) if empty."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+
+# Set LOGIN_RATE_LIMITS=0 to switch limiting off, e.g. for load tests
+RATE_LIMITS_ENABLED = os.environ.get("LOGIN_RATE_LIMITS", "1") != "0"
+
+# Per client IP: bursts of 20, then one attempt every 3 seconds
+ip_limiter = TokenBucketLimiter(rate=1 / 3, burst=20)
+# Per username, charged on failures only: 5 misses, then one per minute
+user_limiter = TokenBucketLimiter(rate=1 / 60, burst=5)
@@ -0,0 +1,260 @@
+import os
+import secrets
+import threading
+import time
+
+from flask import current_app, session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+import database
+
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+
+# Expired sessions are swept on roughly one save in this many.
+PURGE_EVERY = 500
+
+serializer = TaggedJSONSerializer()
+
+
+# ---------------- STORES ----------------
+
+class MemorySessionStore:
+    """Process-local store for development and single-worker runs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._chat = {}
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def save(self, sid, data, expires):
+        with self._lock:
+            self._data[sid] = (data, expires)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+            self._chat.pop(sid, None)
+
+    def append_chat(self, sid, speaker, message):
+        with self._lock:
+            self._chat.setdefault(sid, []).append((speaker, message))
+
+    def chat_history(self, sid):
+        with self._lock:
+            return list(self._chat.get(sid, ()))
+
+    def clear_chat(self, sid):
+        with self._lock:
+            self._chat.pop(sid, None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for sid in [sid for sid, (_, expires) in self._data.items() if expires < now]:
+                self._data.pop(sid, None)
+                self._chat.pop(sid, None)
+
+
+class SqliteSessionStore:
+    """Sessions in their own SQLite file, shared by every gunicorn worker.
+
+    Session data is one row per session; chat turns are append-only rows so
+    a new message costs one small INSERT rather than rewriting the history.
+    """
+
+    def __init__(self, path=SESSION_DB_PATH):
+        self.pool = database.ConnectionPool(path)
+        conn = database.connect(path)
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sid TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS chat_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sid TEXT NOT NULL,
+                    speaker TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    created REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_log_sid ON chat_log (sid, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires)")
+        conn.close()
+
+    def _run(self, sql, params=(), fetch=False):
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                rows = conn.execute(sql, params).fetchall() if fetch else conn.execute(sql, params)
+            return rows
+        finally:
+            self.pool.release(conn)
+
+    def load(self, sid):
+        rows = self._run("SELECT data FROM sessions WHERE sid=? AND expires>=?", (sid, time.time()), fetch=True)
+        return rows[0]["data"] if rows else None
+
+    def save(self, sid, data, expires):
+        self._run("""
+            INSERT INTO sessions (sid, data, expires) VALUES (?, ?, ?)
+            ON CONFLICT(sid) DO UPDATE SET data=excluded.data, expires=excluded.expires
+        """, (sid, data, expires))
+
+    def delete(self, sid):
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                conn.execute("DELETE FROM sessions WHERE sid=?", (sid,))
+                conn.execute("DELETE FROM chat_log WHERE sid=?", (sid,))
+        finally:
+            self.pool.release(conn)
+
+    def append_chat(self, sid, speaker, message):
+        self._run("INSERT INTO chat_log (sid, speaker, message, created) VALUES (?, ?, ?, ?)",
+                  (sid, speaker, message, time.time()))
+
+    def chat_history(self, sid):
+        rows = self._run("SELECT speaker, message FROM chat_log WHERE sid=? ORDER BY id", (sid,), fetch=True)
+        return [(row["speaker"], row["message"]) for row in rows]
+
+    def clear_chat(self, sid):
+        self._run("DELETE FROM chat_log WHERE sid=?", (sid,))
+
+    def purge_expired(self):
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                conn.execute("""
+                    DELETE FROM chat_log WHERE sid IN (SELECT sid FROM sessions WHERE expires<?)
+                """, (time.time(),))
+                conn.execute("DELETE FROM sessions WHERE expires<?", (time.time(),))
+        finally:
+            self.pool.release(conn)
+
+
+# ---------------- FLASK SESSION INTERFACE ----------------
+
+class ServerSideSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.rotate = False
+
+    def clear(self):
+        # Login and logout both clear the session; hand out a fresh id then
+        # so the old one (and its chat history) can't be reused.
+        super().clear()
+        self.rotate = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps only a signed, random session id in the cookie."""
+
+    def __init__(self, store):
+        self.store = store
+        self._saves = 0
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="server-side-session")
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                data = self.store.load(sid)
+                if data is not None:
+                    return ServerSideSession(serializer.loads(data), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.rotate:
+            self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.modified = True
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+            if session.modified or not session.new:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not (session.modified or self.should_set_cookie(app, session)):
+            return
+
+        expires = self.get_expiration_time(app, session)
+        ttl = app.permanent_session_lifetime.total_seconds()
+        self.store.save(session.sid, serializer.dumps(dict(session)), time.time() + ttl)
+
+        self._saves += 1
+        if self._saves % PURGE_EVERY == 0:
+            self.store.purge_expired()
+
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid.encode()).decode(),
+            expires=expires,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def init_app(app, backend=None):
+    backend = backend or os.environ.get("SESSION_BACKEND", "sqlite")
+    if backend == "memory":
+        store = MemorySessionStore()
+    elif backend == "sqlite":
+        store = SqliteSessionStore()
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND {backend!r}")
+    app.session_interface = ServerSideSessionInterface(store)
+
+
+# ---------------- CHAT HISTORY ----------------
+
+def _store():
+    return current_app.session_interface.store
+
+
+def chat_history():
+    return _store().chat_history(session.sid)
+
+
+def append_chat(speaker, message):
+    _store().append_chat(session.sid, speaker, message)
+
+
+def clear_chat():
+    _store().clear_chat(session.sid)
@@ -0,0 +1,64 @@
+"""Background job handlers; enqueue them with jobs.enqueue(tasks.<name>, payload).
+
+Patients are notified through the ordinary message thread with their
+doctor, so notices show up live in the chat page like any other message.
+Payloads name their clinic ("clinic", see tenants.py) so the worker runs
+them against that clinic's database.
+"""
+import os
+from datetime import datetime, timedelta
+
+import jobs
+import messaging
+import rescore
+import tenants
+
+REMINDER_LEAD_HOURS = float(os.environ.get("REMINDER_LEAD_HOURS", "24"))
+
+
+@jobs.task(queue="notifications")
+def notify_appointment_status(conn, payload):
+    """Tell each patient their appointment was approved or rejected."""
+    ids = payload["ids"]
+    rows = conn.execute(f"""
+        SELECT id, patient_username, doctor_username, appointment_date, status FROM appointments
+        WHERE id IN ({','.join('?' * len(ids))}) AND doctor_username = ?
+    """, (*ids, payload["doctor"])).fetchall()
+    for row in rows:
+        # Changed again since this job was queued; that change sends its own notice
+        if row["status"] != payload["status"]:
+            continue
+        messaging.save_message(conn, row["doctor_username"], row["patient_username"],
+                               f"Your appointment on {row['appointment_date']} was {row['status'].lower()}.")
+
+
+def schedule_reminder(appointment_id, slot_start, clinic=None):
+    """Queue a reminder REMINDER_LEAD_HOURS before slot_start ("YYYY-MM-DD HH:MM",
+    local time); nothing if that moment has already passed. clinic defaults
+    to the current request's."""
+    remind_at = datetime.strptime(slot_start, "%Y-%m-%d %H:%M") - timedelta(hours=REMINDER_LEAD_HOURS)
+    if remind_at <= datetime.now():
+        return None
+    clinic = clinic or tenants.current()
+    return jobs.enqueue(appointment_reminder, {"id": appointment_id, "slot_start": slot_start, "clinic": clinic},
+                        run_at=remind_at.timestamp(), key=f"reminder:{clinic}:{appointment_id}:{slot_start}")
+
+
+@jobs.task(queue="reminders")
+def appointment_reminder(conn, payload):
+    row = conn.execute("""
+        SELECT a.patient_username, a.doctor_username, a.slot_start, a.status, u.fullname
+        FROM appointments a JOIN users u ON u.username = a.doctor_username
+        WHERE a.id = ?
+    """, (payload["id"],)).fetchone()
+    # Cancelled, rejected or moved since it was booked
+    if row is None or row["status"] == "Rejected" or row["slot_start"] != payload["slot_start"]:
+        return
+    messaging.save_message(conn, row["doctor_username"], row["patient_username"],
+                           f"Reminder: your appointment with {row['fullname']} is at {row['slot_start']}.")
+
+
+@jobs.task(queue="maintenance", max_attempts=3, lease=6 * 3600)
+def rescore_consultations(conn, payload):
+    """Re-run triage over stored consultations (see rescore.py)."""
+    rescore.rescore(conn, payload.get("batch", 1000), payload.get("start_id", 0))
@@ -0,0 +1,536 @@
+"""Clinics as tenants, each in its own SQLite file.
+
+    python tenants.py split --default main [--assign doctors.csv] [--out shards] [--db database.db]
+    python tenants.py move dr_rao dr_sen --to south
+    python tenants.py stats
+
+Without a clinics file the app runs single-tenant on DATABASE_PATH as
+before. With one (CLINICS_PATH, default clinics.json), every clinic's users,
+appointments, consultations, messages, fees and availability live in a
+separate database file. Clinics then stop queueing on one write lock.
+
+    {"default": "north",
+     "clinics": {"north": {"path": "shards/north.db", "hosts": ["clinic.example.org"]},
+                 "south": {"path": "shards/south.db"}}}
+
+Relative paths are relative to the clinics file. The request's Host picks
+its clinic: a listed host, then a first label that names a clinic
+(south.example.org), then the default. get_db() borrows from that file's
+pool. Each worker opens a pool the first time it needs it and keeps it
+(database.pool_for). A login only counts at the clinic where it was made.
+Background jobs carry their clinic in the payload (see tasks.py).
+Command-line tools that work on one database take --clinic (see
+add_arguments); once clinics exist, neither they nor a job without a
+clinic fall back to DATABASE_PATH.
+
+Directory-wide lookups (fan_out, specializations, doctors) query every
+clinic at once on a small thread pool and merge what comes back.
+
+`split` shards an existing database. A CSV of username,clinic assigns the
+doctors, and unlisted doctors go to --default. A doctor's fees,
+availability and appointments go with the doctor. Each patient is copied,
+with their consultations, to every clinic where they booked or messaged a
+doctor, or to the default clinic if none. A message goes to every clinic
+that has both of its participants. Rows keep their ids, and the rollups are
+rebuilt per shard. The source file is then renamed to <db>.retired, so
+nothing keeps writing to a database the app no longer reads.
+
+`move` rebalances. It moves doctors to another clinic along with their
+fees, availability, appointments (renumbered) and messages. It copies
+their patients, with consultations, to that clinic if they aren't there
+already, and re-queues the moved appointments' reminders. Writers to the
+source clinic wait while a move runs, so move a few doctors at a time.
+If a move is interrupted after the copy, run it again and it finishes
+the cleanup.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request, session
+
+import audit
+import database
+import directory
+
+CLINICS_PATH = os.environ.get("CLINICS_PATH", "clinics.json")
+FAN_OUT_THREADS = int(os.environ.get("TENANT_FAN_OUT_THREADS", "8"))
+
+# In copy order: the slot and search triggers look up users and appointments
+TABLES = ("users", "doctor_fees", "doctor_availability", "appointments", "consultations", "messages")
+
+_NAME = re.compile(r"^[a-z0-9][a-z0-9-]*$")
+
+CLINICS = {}  # clinic -> database file
+HOSTS = {}    # host -> clinic
+DEFAULT = None
+
+
+def load(path=CLINICS_PATH):
+    """(Re)read the clinics file; a missing file means single-tenant."""
+    global DEFAULT
+    CLINICS.clear()
+    HOSTS.clear()
+    DEFAULT = None
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for name, clinic in config["clinics"].items():
+        CLINICS[name] = os.path.join(base, clinic["path"])
+        for host in clinic.get("hosts", ()):
+            HOSTS[host.lower()] = name
+    DEFAULT = config.get("default") or min(CLINICS)
+    if DEFAULT not in CLINICS:
+        raise ValueError(f"{path}: default clinic {DEFAULT!r} is not listed")
+
+
+load()
+
+
+def clinics():
+    """Every clinic name, or [None] when single-tenant."""
+    return sorted(CLINICS) or [None]
+
+
+def path_for(clinic):
+    """Database file of `clinic`; None is DATABASE_PATH, which only exists
+    while single-tenant (split retires it)."""
+    if clinic is None:
+        if CLINICS:
+            raise LookupError(f"no clinic given, but {CLINICS_PATH} lists clinics: {', '.join(sorted(CLINICS))}")
+        return database.DB_PATH
+    try:
+        return CLINICS[clinic]
+    except KeyError:
+        raise LookupError(f"unknown clinic {clinic!r}") from None
+
+
+def paths():
+    """Every clinic's database file, or [DATABASE_PATH] when single-tenant."""
+    return [path_for(clinic) for clinic in clinics()]
+
+
+def resolve(host):
+    host = host.rsplit(":", 1)[0].lower()
+    if host in HOSTS:
+        return HOSTS[host]
+    label = host.split(".", 1)[0]
+    return label if label in CLINICS else DEFAULT
+
+
+def current():
+    """This request's clinic (None when single-tenant or outside a request)."""
+    return g.get("clinic") if has_app_context() else None
+
+
+def current_path():
+    return g.get("db_path") if has_app_context() else None
+
+
+def init_app(app):
+    @app.before_request
+    def route_clinic():
+        if not CLINICS:
+            return
+        g.clinic = resolve(request.host)
+        g.db_path = CLINICS[g.clinic]
+        # Usernames are only unique within a clinic
+        if "username" in session and session.get("clinic") != g.clinic:
+            session.clear()
+
+
+@contextmanager
+def connection(clinic):
+    """A pooled connection to `clinic`'s file."""
+    pool = database.pool_for(path_for(clinic))
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+# ---------------- FAN-OUT ----------------
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _fan_out_pool():
+    # Threads don't survive gunicorn's fork; each worker starts its own
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(FAN_OUT_THREADS, thread_name_prefix="clinic-fan-out")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def fan_out(fn, *args):
+    """{clinic: fn(conn, *args)} for every clinic, run in parallel."""
+    names = clinics()
+
+    def run(clinic):
+        with connection(clinic) as conn:
+            return fn(conn, *args)
+
+    if len(names) == 1:
+        return {names[0]: run(names[0])}
+    return dict(zip(names, _fan_out_pool().map(run, names)))
+
+
+def specializations():
+    """[(specialization, [clinics offering it])], by specialization."""
+    offered = {}
+    for clinic, names in fan_out(directory.specializations).items():
+        for name in names:
+            offered.setdefault(name, []).append(clinic)
+    return sorted(offered.items())
+
+
+def doctors(specialization):
+    """Doctors of `specialization` in every clinic, as directory rows
+    turned into dicts with a clinic key, by name."""
+    found = [dict(row, clinic=clinic)
+             for clinic, rows in fan_out(directory.doctors, specialization).items() for row in rows]
+    return sorted(found, key=lambda doctor: (doctor["fullname"], doctor["clinic"] or ""))
+
+
+def stats():
+    """{clinic: {table: rows, "bytes": file size}}."""
+    def count(conn):
+        found = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in TABLES}
+        found["bytes"] = os.path.getsize(conn.path)
+        return found
+    return fan_out(count)
+
+
+# ---------------- SPLIT ----------------
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _copy(conn, table, where, params=(), keep_ids=True):
+    """INSERT the src rows of `table` matching `where` into main; only the
+    columns both sides have, so an older source file still copies."""
+    theirs = set(_columns(conn, "src", table))
+    cols = ", ".join(col for col in _columns(conn, "main", table)
+                     if col in theirs and (keep_ids or col != "id"))
+    return conn.execute(f"INSERT INTO main.{table} ({cols}) SELECT {cols} FROM src.{table} WHERE {where}",
+                        params).rowcount
+
+
+def _attach_source(conn, path):
+    # Read-only, so BEGIN IMMEDIATE on conn doesn't also want its write lock
+    conn.execute("ATTACH DATABASE ? AS src", ("file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro",))
+
+
+def _members_table(conn, name, usernames):
+    conn.execute(f"DROP TABLE IF EXISTS temp.{name}")
+    conn.execute(f"CREATE TEMP TABLE {name} (username TEXT PRIMARY KEY)")
+    conn.executemany(f"INSERT OR IGNORE INTO temp.{name} VALUES (?)", [(u,) for u in usernames])
+
+
+def members(src, assignments, default):
+    """{clinic: usernames} for split: doctors where assigned, patients
+    wherever they booked or messaged a doctor, everyone else at default."""
+    roles = dict(src.execute("SELECT username, role FROM users").fetchall())
+    home = {user: assignments.get(user, default) for user, role in roles.items() if role == "doctor"}
+    found = {clinic: set() for clinic in set(home.values()) | set(assignments.values()) | {default}}
+    for user, clinic in home.items():
+        found[clinic].add(user)
+    for user, other in src.execute("""
+        SELECT patient_username, doctor_username FROM appointments
+        UNION SELECT sender, receiver FROM messages
+        UNION SELECT receiver, sender FROM messages
+    """):
+        if user in roles and user not in home and other in home:
+            found[home[other]].add(user)
+    placed = set().union(*found.values())
+    found[default].update(user for user in roles if user not in placed)
+    return found
+
+
+def split(source, assignments, default, out_dir, report=None):
+    """Shard `source` into <out_dir>/<clinic>.db. assignments maps doctor
+    username -> clinic. Returns {clinic: (path, {table: rows})}."""
+    src = database.connect(source)
+    database.migrate(src)
+    doctors = {row[0] for row in src.execute("SELECT username FROM users WHERE role='doctor'")}
+    unknown = sorted(set(assignments) - doctors)
+    if unknown:
+        raise ValueError("not doctors: " + ", ".join(unknown))
+    placement = members(src, assignments, default)
+    src.close()
+    for clinic in placement:
+        if not _NAME.match(clinic):
+            raise ValueError(f"clinic names are lowercase letters, digits and dashes: {clinic!r}")
+        if os.path.exists(os.path.join(out_dir, clinic + ".db")):
+            raise FileExistsError(os.path.join(out_dir, clinic + ".db"))
+
+    os.makedirs(out_dir, exist_ok=True)
+    done = {}
+    for clinic, usernames in sorted(placement.items()):
+        path = os.path.join(out_dir, clinic + ".db")
+        database.init_db(path)
+        conn = database.connect(path)
+        _attach_source(conn, source)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _members_table(conn, "members", usernames)
+            inside = "IN (SELECT username FROM temp.members)"
+            counts = {
+                "users": _copy(conn, "users", f"username {inside}"),
+                "doctor_fees": _copy(conn, "doctor_fees", f"doctor_username {inside}"),
+                "doctor_availability": _copy(conn, "doctor_availability", f"doctor_username {inside}"),
+                "appointments": _copy(conn, "appointments", f"doctor_username {inside}"),
+                "consultations": _copy(conn, "consultations", f"patient_username {inside}"),
+                "messages": _copy(conn, "messages", f"sender {inside} AND receiver {inside}"),
+            }
+            # Latency rollups are only maintained on update; rebuild them all
+            for sql in database.ROLLUP_BACKFILL:
+                conn.execute(sql)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DETACH DATABASE src")
+            conn.close()
+        done[clinic] = (path, counts)
+        if report:
+            report(clinic, counts)
+    return done
+
+
+def retire(path):
+    """Rename a split database (and any -wal/-shm) to <path>.retired."""
+    conn = database.connect(path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    retired = path + ".retired"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.replace(path + suffix, retired + suffix)
+    return retired
+
+
+def write_clinics(path, shards, default):
+    """Write a clinics file for `shards` ({clinic: database path})."""
+    base = os.path.dirname(os.path.abspath(path))
+    config = {"default": default,
+              "clinics": {clinic: {"path": os.path.relpath(os.path.abspath(shard), base), "hosts": []}
+                          for clinic, shard in sorted(shards.items())}}
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+# ---------------- REBALANCE ----------------
+
+def locate(usernames):
+    """{doctor username: [clinics]}; more than one only after an interrupted move."""
+    def find(conn):
+        return [row[0] for row in conn.execute(f"""
+            SELECT username FROM users WHERE role='doctor' AND username IN ({','.join('?' * len(usernames))})
+        """, usernames)]
+    found = {}
+    for clinic, users in fan_out(find).items():
+        for user in users:
+            found.setdefault(user, []).append(clinic)
+    return found
+
+
+def move(usernames, source, target):
+    """Move doctors from clinic `source` to `target` (see module docstring).
+    Returns ({table: rows copied}, [(appointment id, slot_start)] still ahead)."""
+    if source == target:
+        raise ValueError("source and target are the same clinic")
+    usernames = list(usernames)
+    # Hold the source's write lock throughout so nothing is booked with a
+    # moving doctor between the copy and the delete
+    src = database.connect(path_for(source))
+    src.execute("BEGIN IMMEDIATE")
+    try:
+        dst = database.connect(path_for(target))
+        _attach_source(dst, path_for(source))
+        try:
+            counts = _copy_doctors(dst, usernames)
+            marks = ",".join("?" * len(usernames))
+            upcoming = [tuple(row) for row in dst.execute(f"""
+                SELECT id, slot_start FROM appointments
+                WHERE doctor_username IN ({marks}) AND slot_start > strftime('%Y-%m-%d %H:%M', 'now', 'localtime')
+                  AND COALESCE(status, 'Pending') <> 'Rejected'
+            """, usernames)]
+        finally:
+            dst.execute("DETACH DATABASE src")
+            dst.close()
+
+        src.execute(f"DELETE FROM appointments WHERE doctor_username IN ({marks})", usernames)
+        src.execute(f"DELETE FROM messages WHERE sender IN ({marks}) OR receiver IN ({marks})", usernames * 2)
+        src.execute(f"DELETE FROM doctor_availability WHERE doctor_username IN ({marks})", usernames)
+        src.execute(f"DELETE FROM doctor_fees WHERE doctor_username IN ({marks})", usernames)
+        src.execute(f"DELETE FROM users WHERE role='doctor' AND username IN ({marks})", usernames)
+        for sql in database.ROLLUP_BACKFILL:
+            src.execute(sql)
+        src.commit()
+    except BaseException:
+        src.rollback()
+        raise
+    finally:
+        src.close()
+    return counts, upcoming
+
+
+def _copy_doctors(dst, usernames):
+    """Copy step of move, in one transaction on the target (main) from src."""
+    dst.execute("BEGIN IMMEDIATE")
+    try:
+        _members_table(dst, "moving", usernames)
+        clash = dst.execute("""
+            SELECT m.username FROM main.users m JOIN src.users s ON s.username = m.username
+            WHERE m.username IN (SELECT username FROM temp.moving) AND m.email <> s.email
+        """).fetchall()
+        if clash:
+            raise ValueError("username taken in the target clinic: " + ", ".join(row[0] for row in clash))
+        # Doctors already here were copied by an interrupted earlier run
+        dst.execute("DELETE FROM temp.moving WHERE username IN (SELECT username FROM main.users)")
+        moving = "IN (SELECT username FROM temp.moving)"
+        _members_table(dst, "patients", [row[0] for row in dst.execute(f"""
+            SELECT patient_username FROM src.appointments WHERE doctor_username {moving}
+            UNION SELECT sender FROM src.messages WHERE receiver {moving}
+            UNION SELECT receiver FROM src.messages WHERE sender {moving}
+            EXCEPT SELECT username FROM main.users
+        """)])
+        clash = dst.execute("""
+            SELECT s.username FROM src.users s JOIN main.users m ON m.email = s.email
+            WHERE s.username IN (SELECT username FROM temp.patients) AND s.role <> 'doctor'
+        """).fetchall()
+        if clash:
+            raise ValueError("email used by another account in the target clinic: "
+                             + ", ".join(row[0] for row in clash))
+        patients = "IN (SELECT username FROM temp.patients)"
+        counts = {
+            "users": _copy(dst, "users", f"username {moving} OR (username {patients} AND role <> 'doctor')",
+                           keep_ids=False),
+            "doctor_fees": _copy(dst, "doctor_fees", f"doctor_username {moving}", keep_ids=False),
+            "doctor_availability": _copy(dst, "doctor_availability", f"doctor_username {moving}", keep_ids=False),
+            "appointments": _copy(dst, "appointments", f"doctor_username {moving}", keep_ids=False),
+            "consultations": _copy(dst, "consultations", f"patient_username {patients}", keep_ids=False),
+            "messages": _copy(dst, "messages", f"sender {moving} OR receiver {moving}", keep_ids=False),
+        }
+        for sql in database.ROLLUP_BACKFILL:
+            dst.execute(sql)
+        dst.commit()
+    except BaseException:
+        dst.rollback()
+        raise
+    return counts
+
+
+# ---------------- CLI ----------------
+
+def add_arguments(parser):
+    """--db / --clinic for a command-line tool that works on one database;
+    read them back with cli_path."""
+    which = parser.add_mutually_exclusive_group()
+    which.add_argument("--clinic", help=f"clinic whose database to use (see {CLINICS_PATH})")
+    which.add_argument("--db", help="database file (default: DATABASE_PATH when there is no clinics file)")
+
+
+def cli_path(parser, args):
+    """The file named by --db or --clinic. Without either, DATABASE_PATH,
+    unless clinics exist: then it is a usage error, not a silent write to
+    the retired unsplit file."""
+    if args.db:
+        return args.db
+    try:
+        return path_for(args.clinic)
+    except LookupError as e:
+        parser.error(f"{e}; pass --clinic or --db")
+
+
+def print_counts(clinic, counts):
+    print(f"  {clinic:<16} " + "  ".join(f"{table} {n:,}" for table, n in counts.items()), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-clinic database files")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cut = sub.add_parser("split", help="shard one database into per-clinic files")
+    cut.add_argument("--default", required=True, help="clinic for unassigned doctors and patients")
+    cut.add_argument("--assign", help="CSV with username,clinic columns for doctors")
+    cut.add_argument("--out", default="shards", help="directory for the <clinic>.db files")
+    cut.add_argument("--db", default=database.DB_PATH)
+    cut.add_argument("--clinics", default=CLINICS_PATH, help="clinics file to write")
+    mv = sub.add_parser("move", help="move doctors to another clinic")
+    mv.add_argument("doctors", nargs="+")
+    mv.add_argument("--to", required=True, dest="target")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    if args.command == "split":
+        if os.path.exists(args.clinics):
+            parser.error(f"{args.clinics} exists; move it away before splitting again")
+        assignments = {}
+        if args.assign:
+            with open(args.assign, newline="", encoding="utf-8") as f:
+                assignments = {row["username"].strip(): row["clinic"].strip() for row in csv.DictReader(f)}
+        try:
+            done = split(args.db, assignments, args.default, args.out, report=print_counts)
+        except (ValueError, FileExistsError) as e:
+            parser.error(str(e))
+        write_clinics(args.clinics, {clinic: path for clinic, (path, _) in done.items()}, args.default)
+        retired = retire(args.db)
+        print(f"Split {args.db} into {len(done)} clinics; wrote {args.clinics} and renamed the source to {retired}. "
+              "Restart the app to route by clinic.")
+        audit.log_action("tenants", "Split database into clinics", source=args.db, retired=retired,
+                         clinics=sorted(done))
+        return 0
+
+    if not CLINICS:
+        parser.error(f"no clinics file at {CLINICS_PATH}; run split first")
+    if args.command == "stats":
+        for clinic, found in sorted(stats().items()):
+            print_counts(clinic, found)
+        return 0
+
+    if args.target not in CLINICS:
+        parser.error(f"unknown clinic {args.target!r}")
+    found = locate(args.doctors)
+    missing = sorted(set(args.doctors) - set(found))
+    if missing:
+        parser.error("no such doctor: " + ", ".join(missing))
+    import tasks
+
+    for source in sorted({clinic for found_at in found.values() for clinic in found_at} - {args.target}):
+        usernames = [user for user, found_at in found.items() if source in found_at]
+        try:
+            counts, upcoming = move(usernames, source, args.target)
+        except ValueError as e:
+            parser.error(str(e))
+        for appointment_id, slot_start in upcoming:
+            tasks.schedule_reminder(appointment_id, slot_start, args.target)
+        print_counts(f"{source} -> {args.target}", counts)
+        audit.log_action("tenants", "Moved doctors between clinics", doctors=usernames, source=source,
+                         target=args.target, appointments=counts["appointments"])
+    print(f"{', '.join(args.doctors)} now at {args.target}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
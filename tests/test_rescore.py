@@ -0,0 +1,41 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import rescore
+
+
+class RescoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "test.db")
+        database.init_db(path)
+        self.conn = database.connect(path)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def test_declined_consultation_keeps_null_result(self):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO consultations (patient_username, symptoms, result, date) VALUES (?, ?, ?, ?)",
+                [("p1", "chest pain", None, "2026-10-18 09:00:00"),
+                 ("p2", "chest pain", json.dumps({"risk": "LOW"}), "2026-10-18 09:00:00")])
+
+        scanned, changed = rescore.rescore(self.conn)
+
+        self.assertEqual((scanned, changed), (1, 1))
+        results = dict(self.conn.execute("SELECT patient_username, result FROM consultations").fetchall())
+        self.assertIsNone(results["p1"])
+        self.assertEqual(json.loads(results["p2"])["risk"], "HIGH")
+
+
+if __name__ == "__main__":
+    unittest.main()
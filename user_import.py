@@ -0,0 +1,246 @@
+"""Bulk import of doctors and patients from CSV or JSON Lines.
+
+    python user_import.py doctors.csv [--role doctor] [--chunk 500] [--workers 8] [--clinic north]
+    python user_import.py patients.jsonl --format jsonl --role patient --resume
+    cat staff.csv | python user_import.py - --role doctor
+
+Columns/keys: fullname, email, username, password, and for doctors
+specialization and license_id. A `role` column overrides --role per row.
+
+Input is streamed chunk by chunk, so memory stays flat for any file size.
+Each chunk is validated, and rows whose username or email already exists
+are set aside before any hashing. The remaining passwords are hashed on a
+process pool, one slice per core. While one chunk is hashing, the previous
+one is inserted with a single executemany in its own BEGIN IMMEDIATE
+transaction. That transaction re-checks uniqueness, so rows that collide
+with a concurrent registration or an earlier row of the same file are
+recorded rather than aborting the import. It also advances the file's
+checkpoint (database migration 8), so --resume continues after the last
+committed chunk.
+
+Rejected rows are written to REJECTS (default: <input>.rejects.jsonl) with
+their input row number and reason; passwords are never written.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import audit
+import database
+import security
+import tenants
+
+FIELDS = ("fullname", "email", "username", "password", "role", "specialization", "license_id")
+ROLES = ("doctor", "patient")
+DEFAULT_CHUNK = 500
+PIPELINE = 2  # chunks hashing ahead of the one being inserted
+
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def read_records(f, fmt):
+    """Yield one dict per input row; unparsable JSON lines yield {"_error": ...}."""
+    if fmt == "csv":
+        yield from csv.DictReader(f)
+        return
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else {"_error": "not a JSON object"}
+
+
+def validate(record, default_role=None):
+    """(row tuple in FIELDS order, None) or (None, reason)."""
+    if "_error" in record:
+        return None, record["_error"]
+    values = {field: str(record.get(field) or "").strip() for field in FIELDS}
+    values["role"] = values["role"].lower() or (default_role or "")
+    if values["role"] not in ROLES:
+        return None, "role must be doctor or patient"
+    required = ("fullname", "email", "username", "password")
+    if values["role"] == "doctor":
+        required += ("specialization", "license_id")
+    missing = [field for field in required if not values[field]]
+    if missing:
+        return None, "missing " + ", ".join(missing)
+    if not _EMAIL.match(values["email"]):
+        return None, "invalid email"
+    if values["role"] == "patient":
+        values["specialization"] = values["license_id"] = None
+    return tuple(values[field] for field in FIELDS), None
+
+
+def _hash_many(passwords):
+    return [security.hash_password(password) for password in passwords]
+
+
+def _existing(conn, rows):
+    # Usernames and emails among rows that are already taken
+    if not rows:
+        return set(), set()
+    # Two JSON array parameters, so --chunk isn't bound by SQLite's variable limit
+    found = conn.execute("""
+        SELECT username, email FROM users
+        WHERE username IN (SELECT value FROM json_each(?)) OR email IN (SELECT value FROM json_each(?))
+    """, (json.dumps([row[2] for row in rows]), json.dumps([row[1] for row in rows]))).fetchall()
+    return {r["username"] for r in found}, {r["email"] for r in found}
+
+
+def _split_conflicts(conn, numbered):
+    """Partition (number, row) pairs into (clean, [(number, row, reason)])
+    against the users table and against each other."""
+    taken_usernames, taken_emails = _existing(conn, [row for _, row in numbered])
+    clean, conflicts = [], []
+    for number, row in numbered:
+        if row[2] in taken_usernames:
+            conflicts.append((number, row, "username exists"))
+        elif row[1] in taken_emails:
+            conflicts.append((number, row, "email exists"))
+        else:
+            clean.append((number, row))
+        taken_usernames.add(row[2])
+        taken_emails.add(row[1])
+    return clean, conflicts
+
+
+def checkpoint(conn, source):
+    row = conn.execute("SELECT rows_done FROM import_checkpoints WHERE source=?", (source,)).fetchone()
+    return row["rows_done"] if row else 0
+
+
+def import_users(conn, records, source=None, default_role=None, chunk_size=DEFAULT_CHUNK, workers=None,
+                 resume=False, on_reject=None, report=None):
+    """Import an iterable of dicts. With a source name, progress is
+    checkpointed under it and resume skips rows already committed.
+    Returns stats (rows, imported, rejected, seconds)."""
+    workers = workers or os.cpu_count() or 1
+    start = checkpoint(conn, source) if source and resume else 0
+    stats = {"rows": start, "imported": 0, "rejected": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    numbered = islice(enumerate(records, 1), start, None)
+
+    def commit(last_number, clean, futures, rejects):
+        hashed = dict(zip([number for number, _ in clean], [h for future in futures for h in future.result()]))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock: earlier chunks and live sign-ups
+            clean, conflicts = _split_conflicts(conn, clean)
+            conn.executemany("""
+                INSERT INTO users (fullname, email, username, password, role, specialization, license_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(*row[:3], hashed[number], *row[4:]) for number, row in clean])
+            if source:
+                conn.execute("""
+                    INSERT INTO import_checkpoints (source, rows_done, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (source) DO UPDATE SET rows_done=excluded.rows_done, updated_at=excluded.updated_at
+                """, (source, last_number))
+            # Rejects go out before the checkpoint commits; after a crash
+            # --resume may repeat a chunk's rejects but never loses them
+            rejects += [(number, row, reason) for number, row, reason in conflicts]
+            if on_reject:
+                for number, row, reason in sorted(rejects, key=lambda r: r[0]):
+                    on_reject(number, row, reason)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        stats["rows"] = last_number
+        stats["imported"] += len(clean)
+        stats["rejected"] += len(rejects)
+        stats["seconds"] = time.perf_counter() - started
+        if report:
+            report(stats)
+
+    pending = deque()
+    with ProcessPoolExecutor(workers) as pool:
+        for chunk in iter(lambda: list(islice(numbered, chunk_size)), []):
+            valid, rejects = [], []
+            for number, record in chunk:
+                row, reason = validate(record, default_role)
+                if row is None:
+                    rejects.append((number, record, reason))
+                else:
+                    valid.append((number, row))
+            # Skip hashing rows that can't be inserted anyway
+            clean, conflicts = _split_conflicts(conn, valid)
+            rejects += conflicts
+
+            step = -(-len(clean) // workers) or 1
+            futures = [pool.submit(_hash_many, [row[3] for _, row in clean[i:i + step]])
+                       for i in range(0, len(clean), step)]
+            pending.append((chunk[-1][0], clean, futures, rejects))
+            if len(pending) > PIPELINE:
+                commit(*pending.popleft())
+        while pending:
+            commit(*pending.popleft())
+
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def print_progress(stats):
+    rate = (stats["imported"] + stats["rejected"]) / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"\r{stats['rows']:,} rows: {stats['imported']:,} imported, {stats['rejected']:,} rejected, "
+          f"{rate:,.0f} rows/s", end="", file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import doctors and patients")
+    parser.add_argument("input", help="CSV or JSON Lines file, or - for stdin")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="default: from the file extension")
+    parser.add_argument("--role", choices=ROLES, help="role for rows without a role column")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="rows per transaction")
+    parser.add_argument("--workers", type=int, help="hashing processes (default: one per core)")
+    parser.add_argument("--rejects", help="where to record rejected rows (default: <input>.rejects.jsonl)")
+    parser.add_argument("--resume", action="store_true", help="continue after the last committed chunk")
+    tenants.add_arguments(parser)
+    args = parser.parse_args()
+    path = tenants.cli_path(parser, args)
+
+    fmt = args.format or ("jsonl" if args.input.endswith((".jsonl", ".ndjson")) else "csv")
+    if args.input == "-":
+        if args.resume:
+            parser.error("--resume needs a file, not stdin")
+        f, source, rejects_path = sys.stdin, None, args.rejects or "stdin.rejects.jsonl"
+    else:
+        f = open(args.input, newline="", encoding="utf-8")
+        source, rejects_path = os.path.abspath(args.input), args.rejects or args.input + ".rejects.jsonl"
+
+    # Creates the schema for a new file, migrates an existing one
+    database.init_db(path)
+    conn = database.connect(path)
+    with f, open(rejects_path, "a" if args.resume else "w", encoding="utf-8") as rejects:
+        def on_reject(number, row, reason):
+            if isinstance(row, tuple):
+                row = dict(zip(FIELDS, row))
+            rejects.write(json.dumps({"row": number, "username": row.get("username"), "email": row.get("email"),
+                                      "reason": reason}, ensure_ascii=False) + "\n")
+            rejects.flush()
+
+        stats = import_users(conn, read_records(f, fmt), source, args.role, args.chunk, args.workers,
+                             args.resume, on_reject, report=print_progress)
+    conn.close()
+
+    print(file=sys.stderr)
+    processed = stats["imported"] + stats["rejected"]
+    rate = processed / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"Imported {stats['imported']:,} users, rejected {stats['rejected']:,} (see {rejects_path}) "
+          f"in {stats['seconds']:.1f}s ({rate:,.0f} rows/s).")
+    audit.log_action("import", "Bulk imported users", source=args.input, imported=stats["imported"],
+                     rejected=stats["rejected"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())